@@ -2,10 +2,12 @@
 Tests for Clients App
 اختبارات تطبيق العملاء
 """
-from django.test import TestCase, Client as TestClient
+from django.test import TestCase, Client as TestClient, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 
+from core.models import PDFRenderRecord
+from core.telemetry import flush_render_records
 from institutes.models import Institute
 from .models import Client
 
@@ -172,6 +174,32 @@ class ClientViewsTests(TestCase):
         self.assertEqual(response.status_code, 302)  # Redirect after success
         self.assertTrue(Client.objects.filter(national_id='NEW001').exists())
     
+    def test_export_clients_pdf_streamed(self):
+        """اختبار إن تقرير العملاء PDF بيرجع streaming وفيه عملاء المعهد بس"""
+        Client.objects.create(
+            first_name='Test', last_name='Client', national_id='1234567890', gender='male',
+            birth_date='1990-01-01', phone='0123456789', address='Test', institute=self.institute,
+        )
+        self.client.login(username='employee', password='testpass123')
+        response = self.client.get(reverse('clients:export_clients_pdf'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+    def test_export_clients_pdf_recorded(self):
+        """اختبار إن تقرير العملاء بيتسجل في قياسات الرسم بعدد الصفحات والحجم"""
+        flush_render_records()
+        self.client.login(username='employee', password='testpass123')
+        with override_settings(PDF_TELEMETRY_BATCH_SIZE=1), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(reverse('clients:export_clients_pdf'))
+        size = len(b''.join(response.streaming_content))
+
+        record = PDFRenderRecord.objects.get(kind=PDFRenderRecord.Kind.REPORT)
+        self.assertEqual((record.template, record.institute_id, record.pages), ('سجل العملاء المسجلين', self.institute.pk, 1))
+        self.assertEqual(record.size, size)
+        self.assertIn('write', record.stages)
+
     def test_search_clients_ajax(self):
         """اختبار البحث عن العملاء عبر AJAX"""
         Client.objects.create(
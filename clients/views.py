@@ -5,6 +5,7 @@ from django.db.models import Q
 from django.http import JsonResponse, HttpResponse
 from django.shortcuts import redirect
 from django.contrib import messages
+from django.utils import timezone
 import pandas as pd
 import logging
 
@@ -12,7 +13,7 @@ from core.mixins import (
     EmployeeRequiredMixin, BranchManagerRequiredMixin,
     InstituteScopedMixin, InstituteScopedDetailMixin, SearchMixin, FilterMixin, SoftDeleteMixin
 )
-from core.utils import get_pdf_response
+from core.reports import ReportColumn, TabularReport
 from institutes.models import Institute
 from .models import Client
 
@@ -293,11 +294,20 @@ def export_clients_pdf(request):
     else:
         clients = Client.objects.none()
     
-    context = {
-        'clients': clients,
-        'title': 'سجل العملاء المسجلين',
-    }
-    return get_pdf_response(request, 'clients/clients_pdf_template.html', context, 'clients_report')
+    report = TabularReport(
+        'سجل العملاء المسجلين',
+        [
+            ReportColumn('الاسم الكامل', 'full_name', width=3, align='RIGHT'),
+            ReportColumn('رقم الهوية', 'national_id', width=1.5),
+            ReportColumn('الهاتف', 'phone', width=1.5),
+            ReportColumn('المعهد', lambda client: client.institute.name, width=2.5, align='RIGHT'),
+            ReportColumn('الحالة', 'get_status_display'),
+            ReportColumn('تاريخ التسجيل', lambda client: f'{timezone.localtime(client.created_at):%Y-%m-%d}'),
+        ],
+        clients.select_related('institute'),
+        user=user, orientation='landscape', color='#27ae60',
+    )
+    return report.response('clients_report')
 
 
 def export_clients_excel(request):
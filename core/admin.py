@@ -1,3 +1,59 @@
 from django.contrib import admin
+from django.db.models import Avg, Count, Max, Q
+from django.db.models.functions import TruncDate
+from django.utils.translation import gettext_lazy as _
 
-# Register your models here.
+from .models import PDFRenderRecord
+
+
+def render_cost_summary(queryset, limit=10):
+    """أبطأ المعاهد والقوالب ومتوسط كل يوم - من سجلات الرسم المفلترة في صفحة الأدمن"""
+    queryset = queryset.order_by()
+    # الملفات اللي اتقرت من الديسك (render_mode=stored) بتتحسب في cache_hits بس، مش في تكلفة الرسم
+    rendered = ~Q(render_mode='stored')
+    stats = {
+        'renders': Count('id', filter=rendered),
+        'avg_ms': Avg('total_ms', filter=rendered),
+        'max_ms': Max('total_ms', filter=rendered),
+        'avg_size': Avg('size', filter=rendered),
+        'fallbacks': Count('id', filter=Q(fallback=True)),
+        'cache_hits': Count('id', filter=Q(cache_hit=True)),
+    }
+    return {
+        'slowest_institutes': list(
+            queryset.values('institute__name').annotate(**stats).order_by('-avg_ms')[:limit]
+        ),
+        'slowest_templates': list(
+            queryset.values('template', 'institute__name').annotate(**stats).order_by('-avg_ms')[:limit]
+        ),
+        'daily_render_cost': list(
+            queryset.annotate(day=TruncDate('created_at')).values('day').annotate(**stats).order_by('-day')[:30]
+        ),
+    }
+
+
+@admin.register(PDFRenderRecord)
+class PDFRenderRecordAdmin(admin.ModelAdmin):
+    list_display = [
+        'created_at', 'kind', 'institute', 'template', 'font_family', 'render_mode',
+        'total_ms', 'pages', 'size', 'cache_hit', 'fallback'
+    ]
+    list_filter = ['kind', 'render_mode', 'output_profile', 'font_family', 'cache_hit', 'fallback', 'institute']
+    search_fields = ['template', 'institute__name']
+    date_hierarchy = 'created_at'
+    list_select_related = ['institute']
+    readonly_fields = [field.name for field in PDFRenderRecord._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        context = getattr(response, 'context_data', None)
+        if context and 'cl' in context:
+            context.update(render_cost_summary(context['cl'].queryset))
+            context['summary_title'] = _('Slowest templates and institutes')
+        return response
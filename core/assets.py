@@ -0,0 +1,116 @@
+"""
+كاش على مستوى العملية (process) لملفات الصور والخطوط المضمّنة Base64 في ملفات PDF
+
+بدل ما كل رسم PDF يفتح الخط/الخلفية/التوقيع/الختم من الديسك ويعمله Base64 من جديد، النتيجة
+بتتخزن في الذاكرة بمفتاح (المسار، وقت التعديل، الحجم) - فأي تعديل على الملف نفسه بيطلع مفتاح
+جديد تلقائياً. الحجم الكلي محدود (PDF_ASSET_CACHE_MAX_BYTES) والأقدم استخداماً بيتشال الأول.
+"""
+import base64
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class AssetCache:
+    """LRU محدود بالحجم (bytes) لمحتوى الملفات (Base64 أو bytes خام حسب الاستخدام)"""
+
+    def __init__(self, max_bytes=None):
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def max_bytes(self):
+        if self._max_bytes is not None:
+            return self._max_bytes
+        return settings.PDF_ASSET_CACHE_MAX_BYTES
+
+    def get_b64(self, path):
+        """يرجع محتوى الملف Base64، أو '' لو الملف مش موجود (stat واحد بدل exists + open)"""
+        return self._get(path, lambda data: base64.b64encode(data).decode('ascii'), '')
+
+    def get_bytes(self, path):
+        """يرجع محتوى الملف نفسه (bytes)، أو None لو الملف مش موجود - لـ url_fetcher بتاع WeasyPrint"""
+        return self._get(path, bytes, None)
+
+    def _get(self, path, transform, missing):
+        if not path:
+            return missing
+        try:
+            stat = os.stat(path)
+        except (OSError, ValueError):
+            return missing
+
+        key = (os.fspath(path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        try:
+            with open(path, 'rb') as f:
+                value = transform(f.read())
+        except OSError:
+            return missing
+
+        self._store(key, value)
+        return value
+
+    def get_data_uri(self, path, mime_type=None):
+        """يرجع data: URI جاهز للاستخدام في src/url()، أو '' لو الملف مش موجود"""
+        encoded = self.get_b64(path)
+        if not encoded:
+            return ''
+        mime_type = mime_type or mimetypes.guess_type(os.fspath(path))[0] or 'application/octet-stream'
+        return f'data:{mime_type};base64,{encoded}'
+
+    def _store(self, key, value):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            # نسخة قديمة من نفس الملف (اتعدل) مبقاش ليها لازمة
+            for stale_key in [k for k in self._entries if k[0] == key[0] and k != key]:
+                self._size -= len(self._entries.pop(stale_key))
+
+            if key in self._entries:
+                return
+            self._entries[key] = value
+            self._size += size
+
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+asset_cache = AssetCache()
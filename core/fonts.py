@@ -0,0 +1,141 @@
+"""
+خطوط ملفات PDF
+
+- ملفات Cairo بتتقلص (subset) للحروف العربية واللاتينية المستخدمة فعلاً في المشاهد والتقارير
+  (fontTools) مع الاحتفاظ بجداول الـ shaping (GSUB/GPOS) اللازمة لتوصيل الحروف العربية.
+- CSS الـ @font-face و FontConfiguration الخاصين بـ WeasyPrint بيتجهزوا مرة واحدة لكل خط
+  (لكل thread، لأن FontConfiguration مش مضمون يتشارك بين threads) ويتعاد استخدامهم في كل رسم،
+  بدل ما الخط يتضمّن Base64 جوه HTML كل إذن ويتحلل ويتحمل من جديد.
+- المقاس: حجم الخط المضمّن اتقاس (Cairo ‏252KB -> 183KB Base64). أثر ده على زمن الرسم نفسه لسه
+  متقاسش على بيئة فيها Pango - bench_pdf --only cairo --font-baseline بيطلع أرقام قبل/بعد.
+"""
+import base64
+import functools
+import io
+import logging
+import os
+import threading
+
+from django.conf import settings
+from weasyprint import CSS
+from weasyprint.text.fonts import FontConfiguration
+
+from core.assets import asset_cache
+from core.url_fetcher import local_url_fetcher
+
+logger = logging.getLogger('edu_system')
+
+FONT_DIR = os.path.join(settings.BASE_DIR, 'static', 'fonts')
+
+FONT_STACKS = {
+    'arial': "'Arial', sans-serif",
+    'cairo': "'Cairo', 'Arial', sans-serif",
+}
+
+# ملفات كل خط مضمّنة Base64 مباشرة داخل الـ CSS بدل الاعتماد على url() نسبي، لأن تحليل
+# base_url في WeasyPrint مش مضمون يفضل شغال على كل بيئة/سيرفر
+CUSTOM_FONT_FILES = {
+    'cairo': [('normal', 'Cairo-Regular.ttf'), ('bold', 'Cairo-Bold.ttf')],
+}
+
+# نطاقات الحروف اللي بنحتاجها: لاتيني أساسي + Latin-1، العربي وملحقاته وأشكال العرض
+# (Presentation Forms)، وعلامات الترقيم العامة (فيها ZWJ/ZWNJ وعلامات الاتجاه RLM/LRM)
+SUBSET_UNICODE_RANGES = [
+    (0x0020, 0x007E),
+    (0x00A0, 0x00FF),
+    (0x0600, 0x06FF),
+    (0x0750, 0x077F),
+    (0x2000, 0x206F),
+    (0xFB50, 0xFDFF),
+    (0xFE70, 0xFEFF),
+]
+
+
+def font_path(filename):
+    return os.path.join(FONT_DIR, filename)
+
+
+@functools.lru_cache(maxsize=16)
+def _subset_font_b64(path, mtime_ns, size):
+    from fontTools import subset
+    from fontTools.ttLib import TTFont
+
+    options = subset.Options()
+    options.layout_features = ['*']
+    options.name_IDs = ['*']
+    options.notdef_outline = True
+    options.hinting = False
+
+    unicodes = set()
+    for start, end in SUBSET_UNICODE_RANGES:
+        unicodes.update(range(start, end + 1))
+
+    font = TTFont(path)
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(unicodes=unicodes)
+    subsetter.subset(font)
+
+    buffer = io.BytesIO()
+    font.save(buffer)
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def subset_font_b64(path):
+    """Base64 لنسخة مقلصة من الخط، ولو التقليص فشل لأي سبب بنرجع للملف الكامل"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return ''
+    try:
+        return _subset_font_b64(path, stat.st_mtime_ns, stat.st_size)
+    except Exception as e:
+        logger.warning(f'Font subsetting failed for {path}, embedding full font: {e}')
+        return asset_cache.get_b64(path)
+
+
+@functools.lru_cache(maxsize=8)
+def build_font_face_css(font_choice):
+    files = CUSTOM_FONT_FILES.get(font_choice)
+    if not files:
+        return ''
+
+    faces = []
+    for weight, filename in files:
+        font_b64 = subset_font_b64(font_path(filename))
+        if not font_b64:
+            continue
+        faces.append(f"""
+                    @font-face {{
+                        font-family: '{font_choice.capitalize()}';
+                        src: url('data:font/ttf;base64,{font_b64}');
+                        font-weight: {weight};
+                    }}
+        """)
+    return ''.join(faces)
+
+
+_thread_resources = threading.local()
+
+
+def get_font_resources(font_choice):
+    """
+    يرجع (stylesheets, font_config) جاهزين للتمرير لـ write_pdf - بيتبنوا أول مرة بس لكل خط
+    في كل thread، وبعد كده نفس الكائنات بتتعاد (الخط بيتحلل ويتسجل في fontconfig مرة واحدة)
+    """
+    resources = getattr(_thread_resources, 'by_font', None)
+    if resources is None:
+        resources = _thread_resources.by_font = {}
+
+    if font_choice not in resources:
+        font_config = FontConfiguration()
+        font_face_css = build_font_face_css(font_choice)
+        stylesheets = [CSS(string=font_face_css, font_config=font_config, url_fetcher=local_url_fetcher)] if font_face_css else []
+        resources[font_choice] = (stylesheets, font_config)
+
+    return resources[font_choice]
+
+
+def clear_font_caches():
+    """تفضية كاش الخطوط المقلصة والـ CSS (للقياس) - الـ FontConfiguration الخاص بكل thread بيفضل"""
+    _subset_font_b64.cache_clear()
+    build_font_face_css.cache_clear()
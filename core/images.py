@@ -0,0 +1,177 @@
+"""
+نسخ صور المعهد المجهزة للطباعة (derivatives) - اللوجو، التوقيع، الختم، والخلفية
+
+الموظفين بيرفعوا الصور بأي دقة (صور موبايل 12MP مثلاً)، والصورة كانت بتتضمّن في كل PDF بحجمها
+الأصلي. هنا بنعمل نسخة واحدة لكل صورة:
+- مصغرة لأقصى مقاس طباعة فعلي بدقة PDF_IMAGE_DPI (الخلفية على مقاس الصفحة نفسها، لأنها
+  بتتمط على الصفحة كلها أصلاً).
+- متصلحة الاتجاه حسب EXIF، ومن غير أي metadata (EXIF/ICC/تعليقات).
+- PNG للصور الشفافة والتوقيع/الختم (خطوط حادة)، و JPEG لأي حاجة تانية.
+
+النسخ بتتعمل عند حفظ المعهد (permissions.signals) وبتتخزن في MEDIA_ROOT/institutes/render/،
+واسم الملف فيه بصمة الصورة الأصلية والإعدادات، فأي تغيير بيطلع نسخة جديدة. لو النسخة مش موجودة
+وقت الرسم بتتعمل ساعتها، ولو حصل أي خطأ بنرجع للصورة الأصلية.
+"""
+import hashlib
+import io
+import logging
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+logger = logging.getLogger('edu_system')
+
+# يتغير يدوياً لما طريقة التجهيز نفسها تتغير عشان كل النسخ القديمة تتعمل من جديد
+DERIVATIVE_VERSION = '1'
+
+DERIVATIVE_DIR = 'institutes/render'
+
+# مقاسات الصفحات بالمليمتر (عرض، طول) في الوضع الطولي
+PAGE_SIZES_MM = {
+    'A3': (297, 420),
+    'A4': (210, 297),
+    'A5': (148, 210),
+    'LETTER': (216, 279),
+    'LEGAL': (216, 356),
+}
+
+# أقصى مقاس طباعة (بالبوصة) لكل صورة، و هل لازم تفضل PNG
+IMAGE_SPECS = {
+    'logo': {'max_inches': 2.0, 'png': False},
+    'signature_image': {'max_inches': 3.0, 'png': True},
+    'stamp_image': {'max_inches': 2.5, 'png': True},
+}
+
+BACKGROUND_FIELD = 'background_img'
+
+
+def page_pixels(page_size='A4', orientation='portrait'):
+    """مقاس الصفحة بالـ pixels بدقة PDF_IMAGE_DPI"""
+    width_mm, height_mm = PAGE_SIZES_MM.get(str(page_size).upper(), PAGE_SIZES_MM['A4'])
+    if orientation == 'landscape':
+        width_mm, height_mm = height_mm, width_mm
+    dpi = settings.PDF_IMAGE_DPI
+    return round(width_mm / 25.4 * dpi), round(height_mm / 25.4 * dpi)
+
+
+def _target(field_name, page_size, orientation):
+    if field_name == BACKGROUND_FIELD:
+        return page_pixels(page_size, orientation), False
+    spec = IMAGE_SPECS[field_name]
+    side = round(spec['max_inches'] * settings.PDF_IMAGE_DPI)
+    return (side, side), spec['png']
+
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def build_derivative(data, field_name, page_size='A4', orientation='portrait'):
+    """يرجع (bytes, الامتداد) للنسخة المجهزة من محتوى الصورة الأصلية"""
+    (max_width, max_height), force_png = _target(field_name, page_size, orientation)
+
+    with Image.open(io.BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source)
+        image.load()
+
+    if field_name == BACKGROUND_FIELD:
+        # الخلفية بتتمط على الصفحة (background-size: 100% 100%) فكل بُعد بيتصغر لوحده من غير تكبير
+        size = (min(image.width, max_width), min(image.height, max_height))
+        if size != image.size:
+            image = image.resize(size, Image.LANCZOS)
+    else:
+        image.thumbnail((max_width, max_height), Image.LANCZOS)
+
+    use_png = force_png or (field_name != BACKGROUND_FIELD and _has_alpha(image))
+    buffer = io.BytesIO()
+
+    if use_png:
+        if image.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+            image = image.convert('RGBA')
+        image.save(buffer, 'PNG', optimize=True)
+        return buffer.getvalue(), 'png'
+
+    if _has_alpha(image):
+        # الخلفية ورا المحتوى على صفحة بيضا، فدمج الشفافية على أبيض مش بيغير شكلها
+        image = image.convert('RGBA')
+        flattened = Image.new('RGB', image.size, 'white')
+        flattened.paste(image, mask=image.getchannel('A'))
+        image = flattened
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    image.save(buffer, 'JPEG', quality=settings.PDF_IMAGE_JPEG_QUALITY, optimize=True)
+    return buffer.getvalue(), 'jpg'
+
+
+def _source_fingerprint(field_file):
+    stat = os.stat(field_file.path)
+    return f'{field_file.name}:{stat.st_mtime_ns}:{stat.st_size}'
+
+
+def _derivative_prefix(institute_pk, field_name):
+    return f'{DERIVATIVE_DIR}/{institute_pk}/{field_name}-'
+
+
+def _derivative_stem(field_file, institute_pk, field_name, page_size, orientation):
+    parts = [
+        DERIVATIVE_VERSION, _source_fingerprint(field_file), settings.PDF_IMAGE_DPI,
+        settings.PDF_IMAGE_JPEG_QUALITY,
+    ]
+    if field_name == BACKGROUND_FIELD:
+        parts += [str(page_size).upper(), orientation]
+    digest = hashlib.sha256('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:16]
+    return f'{_derivative_prefix(institute_pk, field_name)}{digest}'
+
+
+def get_render_image_path(institute, field_name, page_size='A4', orientation='portrait'):
+    """
+    المسار الكامل للنسخة المجهزة لصورة من صور المعهد (بيعملها لو مش موجودة)،
+    أو مسار الصورة الأصلية لو حصل خطأ، أو '' لو المعهد مالوش الصورة دي
+    """
+    field_file = getattr(institute, field_name)
+    if not field_file:
+        return ''
+
+    try:
+        stem = _derivative_stem(field_file, institute.pk, field_name, page_size, orientation)
+        for ext in ('jpg', 'png'):
+            if default_storage.exists(f'{stem}.{ext}'):
+                return default_storage.path(f'{stem}.{ext}')
+
+        with field_file.open('rb') as f:
+            data, ext = build_derivative(f.read(), field_name, page_size, orientation)
+        name = default_storage.save(f'{stem}.{ext}', ContentFile(data))
+        return default_storage.path(name)
+    except Exception as e:
+        logger.warning(f'Could not build render image {field_name} for institute {institute.pk}: {e}')
+        try:
+            return field_file.path
+        except (NotImplementedError, ValueError):
+            return ''
+
+
+def build_institute_derivatives(institute, page_size='A4', orientation='portrait'):
+    """يعمل كل نسخ صور المعهد ويمسح النسخ القديمة (صور اتغيرت أو اتشالت). يرجع المسارات."""
+    paths = {}
+    for field_name in (*IMAGE_SPECS, BACKGROUND_FIELD):
+        path = get_render_image_path(institute, field_name, page_size, orientation)
+        if path:
+            paths[field_name] = path
+
+    directory = f'{DERIVATIVE_DIR}/{institute.pk}'
+    keep = {os.path.basename(path) for path in paths.values()}
+    try:
+        _, files = default_storage.listdir(directory)
+    except (OSError, NotImplementedError):
+        return paths
+    for name in files:
+        if name not in keep:
+            try:
+                default_storage.delete(f'{directory}/{name}')
+            except OSError as e:
+                logger.warning(f'Could not delete stale render image {directory}/{name}: {e}')
+    return paths
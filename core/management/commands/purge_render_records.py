@@ -0,0 +1,25 @@
+"""
+مسح قياسات رسم PDF القديمة (PDFRenderRecord) - برّه مسار الطلبات.
+
+الاستخدام:
+    python manage.py purge_render_records
+    python manage.py purge_render_records --days 7
+
+- الافتراضي PDF_TELEMETRY_RETENTION_DAYS. يتشغل من cron مرة في اليوم مثلاً.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from core.telemetry import purge_render_records
+
+
+class Command(BaseCommand):
+    help = 'مسح قياسات رسم PDF الأقدم من مدة الاحتفاظ'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='مدة الاحتفاظ بالأيام (الافتراضي PDF_TELEMETRY_RETENTION_DAYS)')
+
+    def handle(self, *args, **options):
+        if options['days'] is not None and options['days'] < 0:
+            raise CommandError('--days لازم يكون 0 أو أكتر')
+        deleted = purge_render_records(options['days'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} PDF render records'))
@@ -57,8 +57,9 @@ class AuthenticationMiddleware:
         
         response = self.get_response(request)
         
-        # إضافة headers لمنع caching للصفحات المحمية
-        if request.user.is_authenticated:
+        # إضافة headers لمنع caching للصفحات المحمية - ماعدا الردود اللي مسموح للمتصفح يخزنها
+        # لنفسه ويتأكد منها بـ ETag (core.utils.mark_private_cacheable)
+        if request.user.is_authenticated and not getattr(response, 'private_cache', False):
             response['Cache-Control'] = 'no-cache, no-store, must-revalidate'
             response['Pragma'] = 'no-cache'
             response['Expires'] = '0'
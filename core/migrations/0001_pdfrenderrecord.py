@@ -0,0 +1,43 @@
+# Generated by Django 5.2.11 on 2026-10-18 17:20
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('institutes', '0004_institute_registration_officer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PDFRenderRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Created At')),
+                ('kind', models.CharField(choices=[('permission', 'Permission Slip'), ('report', 'Report')], max_length=20, verbose_name='Kind')),
+                ('template', models.CharField(blank=True, max_length=255, verbose_name='Template')),
+                ('template_version', models.CharField(blank=True, max_length=40, verbose_name='Template Version')),
+                ('font_family', models.CharField(blank=True, max_length=30, verbose_name='Font Family')),
+                ('render_mode', models.CharField(blank=True, max_length=20, verbose_name='Render Mode')),
+                ('output_profile', models.CharField(blank=True, max_length=20, verbose_name='Output Profile')),
+                ('cache_hit', models.BooleanField(default=False, verbose_name='Cache Hit')),
+                ('fallback', models.BooleanField(default=False, verbose_name='Fallback')),
+                ('total_ms', models.FloatField(verbose_name='Total (ms)')),
+                ('stages', models.JSONField(blank=True, default=dict, verbose_name='Stages (ms)')),
+                ('size', models.PositiveIntegerField(blank=True, null=True, verbose_name='Size (bytes)')),
+                ('pages', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Pages')),
+                ('institute', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='institutes.institute', verbose_name='Institute')),
+            ],
+            options={
+                'verbose_name': 'PDF Render Record',
+                'verbose_name_plural': 'PDF Render Records',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['institute', 'created_at'], name='core_pdfrender_inst_created'), models.Index(fields=['template', 'created_at'], name='core_pdfrender_tmpl_created')],
+            },
+        ),
+    ]
@@ -1,4 +1,6 @@
 from django.db import models
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
 
 # Create your models here.
 from django.db import models
@@ -31,4 +33,52 @@ class BaseModel(models.Model):
     def restore(self):
         """دالة استعادة المحذوف"""
         self.is_deleted = False
-        self.save()
\ No newline at end of file
+        self.save()
+
+
+class PDFRenderRecord(models.Model):
+    """قياس رسمة PDF واحدة (core.telemetry) - بيتكتب على دفعات وبيتمسح بأمر purge_render_records"""
+
+    class Kind(models.TextChoices):
+        PERMISSION = 'permission', _('Permission Slip')
+        REPORT = 'report', _('Report')
+
+    created_at = models.DateTimeField(default=timezone.now, db_index=True, verbose_name=_('Created At'))
+    kind = models.CharField(max_length=20, choices=Kind.choices, verbose_name=_('Kind'))
+    institute = models.ForeignKey(
+        'institutes.Institute',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        # السجلات بتتكتب على دفعات بعد الرسم، فمعهد اتمسح في النص ميبوظش الدفعة كلها
+        db_constraint=False,
+        verbose_name=_('Institute')
+    )
+    # هوية القالب: "template:<pk>" لقالب المعهد، أو مسار ملف القالب (القالب الاحتياطي والتقارير)
+    template = models.CharField(max_length=255, blank=True, verbose_name=_('Template'))
+    template_version = models.CharField(max_length=40, blank=True, verbose_name=_('Template Version'))
+    font_family = models.CharField(max_length=30, blank=True, verbose_name=_('Font Family'))
+    render_mode = models.CharField(max_length=20, blank=True, verbose_name=_('Render Mode'))
+    output_profile = models.CharField(max_length=20, blank=True, verbose_name=_('Output Profile'))
+    # القالب المترجم أو الطبقة الثابتة جت من الكاش
+    cache_hit = models.BooleanField(default=False, verbose_name=_('Cache Hit'))
+    # قالب المعهد فشل والملف اترسم بالقالب الاحتياطي (generate_default_pdf)
+    fallback = models.BooleanField(default=False, verbose_name=_('Fallback'))
+    total_ms = models.FloatField(verbose_name=_('Total (ms)'))
+    # زمن كل مرحلة بالـ ms: context / compile / render / layout / write
+    stages = models.JSONField(default=dict, blank=True, verbose_name=_('Stages (ms)'))
+    size = models.PositiveIntegerField(null=True, blank=True, verbose_name=_('Size (bytes)'))
+    pages = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name=_('Pages'))
+
+    class Meta:
+        verbose_name = _('PDF Render Record')
+        verbose_name_plural = _('PDF Render Records')
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['institute', 'created_at'], name='core_pdfrender_inst_created'),
+            models.Index(fields=['template', 'created_at'], name='core_pdfrender_tmpl_created'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.template or "-"} {self.total_ms:.0f}ms'
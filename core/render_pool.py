@@ -0,0 +1,295 @@
+"""
+Pool عمليات منفصلة (processes) لرسم ملفات PDF بعيداً عن threads الـ gunicorn
+
+- كل عملية رسم (job) بتتنفذ في process منفصل عنده django جاهز، فرسم تقيل ما بيمسكش الـ GIL
+  ولا thread الطلب، وتسريب الذاكرة من WeasyPrint بيفضل محصور في عمليات الرسم.
+- كل job ليه مهلة (PDF_RENDER_TIMEOUT) - لو عدّاها الـ process بيتقتل ويتعمل غيره، و RenderTimeout
+  بيترمي: قالب بطيء كل مرة مش ضغط مؤقت، فالـ View بيرجع 500 من غير Retry-After (timeout_response).
+- الـ process بيتجدد بعد عدد jobs معين (PDF_RENDER_MAX_JOBS) أو لو الذاكرة (RSS) عدّت
+  PDF_RENDER_MAX_RSS_MB.
+- لو كل العمليات مشغولة أكتر من PDF_RENDER_QUEUE_TIMEOUT ثانية بنرمي RenderPoolBusy، والـ View
+  بيرجع 503 مع Retry-After بدل ما يفضل الطلب مستني.
+- الـ pool بيتعمل في كل worker من gunicorn، فعدد عمليات الرسم الفعلي = workers × PDF_RENDER_POOL_SIZE
+  (وكل واحدة محمّل فيها django).
+- PDF_RENDER_POOL_SIZE = 0 معناها الرسم بيحصل في نفس الـ process (الافتراضي مع DEBUG والاختبارات،
+  وعلى السيرفر الافتراضي 1).
+- run_sandboxed_job: job واحد في process جديد خالص بحد للذاكرة (RLIMIT_AS) ومهلة - لرسم محتوى
+  مش موثوق (زي قالب لسه بيتحفظ) من غير ما يأثر على عمليات الرسم الأساسية.
+"""
+import atexit
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger('edu_system')
+
+
+class RenderPoolError(Exception):
+    """خطأ أثناء تنفيذ job في الـ pool"""
+
+
+class RenderPoolBusy(RenderPoolError):
+    """كل عمليات الرسم مشغولة (الطابور مليان) - المفروض العميل يعيد المحاولة"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RenderTimeout(RenderPoolError):
+    """الـ job عدّى المهلة واتقتل - الإعادة هتاخد نفس الوقت، فمفيش Retry-After"""
+
+
+def _current_rss():
+    """الذاكرة الحالية للـ process بالـ bytes"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _worker_main(conn):
+    """حلقة عملية الرسم: تستقبل (مسار الدالة، المعاملات) وترجع (النتيجة، الذاكرة الحالية)"""
+    import django
+    django.setup()
+    from django.db import close_old_connections
+    from core.telemetry import flush_render_records
+
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+        if job is None:
+            break
+
+        func_path, args = job
+        try:
+            result = ('ok', import_string(func_path)(*args))
+        except Exception as e:
+            result = ('error', f'{type(e).__name__}: {e}')
+        close_old_connections()
+
+        try:
+            conn.send((result, _current_rss()))
+        except (OSError, ValueError):
+            break
+
+    # multiprocessing مبيشغلش atexit في الـ process الفرعي، فقياسات الرسم المتجمعة بتتكتب هنا
+    flush_render_records()
+
+
+class _Worker:
+    def __init__(self, mp_context):
+        self.conn, child_conn = mp_context.Pipe()
+        self.process = mp_context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+
+    def stop(self, graceful=True):
+        if graceful and self.process.is_alive():
+            try:
+                self.conn.send(None)
+            except (OSError, ValueError):
+                pass
+            self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join(timeout=2)
+        self.conn.close()
+
+
+class RenderPool:
+    def __init__(self, size, timeout, max_jobs, max_rss_mb, queue_timeout, start_method='spawn'):
+        self.size = size
+        self.timeout = timeout
+        self.max_jobs = max_jobs
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self.queue_timeout = queue_timeout
+        self._mp_context = multiprocessing.get_context(start_method)
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._started = 0
+        self._closed = False
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._started < self.size:
+                self._started += 1
+                spawn = True
+            else:
+                spawn = False
+
+        if spawn:
+            try:
+                return _Worker(self._mp_context)
+            except Exception:
+                with self._lock:
+                    self._started -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.queue_timeout)
+        except queue.Empty:
+            raise RenderPoolBusy('All PDF render workers are busy', retry_after=self.retry_after)
+
+    def _discard(self, worker, graceful=True):
+        worker.stop(graceful=graceful)
+        with self._lock:
+            self._started -= 1
+
+    def _release(self, worker, rss):
+        worker.jobs += 1
+        if self._closed or worker.jobs >= self.max_jobs or rss > self.max_rss:
+            logger.info(
+                f'Recycling PDF render worker pid={worker.process.pid} '
+                f'(jobs={worker.jobs}, rss={rss // (1024 * 1024)}MB)'
+            )
+            self._discard(worker)
+        else:
+            self._idle.put(worker)
+
+    @property
+    def retry_after(self):
+        return max(1, int(self.timeout))
+
+    def run(self, func_path, *args):
+        """ينفذ الدالة (بمسارها النصي) في عملية رسم ويرجع نتيجتها"""
+        worker = self._acquire()
+
+        try:
+            worker.conn.send((func_path, args))
+            if not worker.conn.poll(self.timeout):
+                logger.error(f'PDF render job {func_path}{args} timed out after {self.timeout}s, killing worker')
+                self._discard(worker, graceful=False)
+                raise RenderTimeout(f'PDF render timed out after {self.timeout}s')
+            (status, payload), rss = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            self._discard(worker, graceful=False)
+            raise RenderPoolError(f'PDF render worker died: {e}')
+
+        self._release(worker, rss)
+
+        if status != 'ok':
+            raise RenderPoolError(payload)
+        return payload
+
+    def shutdown(self):
+        self._closed = True
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(worker)
+
+
+def _sandbox_main(conn, func_path, args, max_memory):
+    """عملية الـ sandbox: حد الذاكرة قبل تحميل django، وبعدين job واحد بس"""
+    if max_memory:
+        try:
+            import resource
+            resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+        except (ImportError, ValueError, OSError):
+            pass
+
+    try:
+        import django
+        django.setup()
+        result = ('ok', import_string(func_path)(*args))
+    except MemoryError:
+        result = ('error', 'MemoryError: memory limit exceeded')
+    except Exception as e:
+        result = ('error', f'{type(e).__name__}: {e}')
+
+    try:
+        conn.send(result)
+    except (OSError, ValueError):
+        pass
+    conn.close()
+
+
+def run_sandboxed_job(func_path, *args, timeout, max_memory_mb=0, start_method='spawn'):
+    """
+    ينفذ job واحد في process جديد بمهلة (ثانية) وحد ذاكرة (MB، 0 = من غير حد). لو المهلة خلصت
+    الـ process بيتقتل و RenderTimeout بيترمي، وأي خطأ تاني (منه تعدي الذاكرة) RenderPoolError.
+    """
+    mp_context = multiprocessing.get_context(start_method)
+    parent_conn, child_conn = mp_context.Pipe(duplex=False)
+    process = mp_context.Process(
+        target=_sandbox_main, args=(child_conn, func_path, args, max_memory_mb * 1024 * 1024), daemon=True
+    )
+    process.start()
+    child_conn.close()
+
+    try:
+        if not parent_conn.poll(timeout):
+            logger.warning(f'Sandboxed job {func_path} timed out after {timeout}s, killing pid={process.pid}')
+            raise RenderTimeout(f'Sandboxed render timed out after {timeout}s')
+        status, payload = parent_conn.recv()
+    except EOFError:
+        process.join(timeout=2)
+        raise RenderPoolError(f'Sandboxed job {func_path} died (exit code {process.exitcode})')
+    finally:
+        if process.is_alive():
+            process.kill()
+        process.join(timeout=2)
+        parent_conn.close()
+
+    if status != 'ok':
+        raise RenderPoolError(payload)
+    return payload
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_render_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = RenderPool(
+                    size=settings.PDF_RENDER_POOL_SIZE,
+                    timeout=settings.PDF_RENDER_TIMEOUT,
+                    max_jobs=settings.PDF_RENDER_MAX_JOBS,
+                    max_rss_mb=settings.PDF_RENDER_MAX_RSS_MB,
+                    queue_timeout=settings.PDF_RENDER_QUEUE_TIMEOUT,
+                )
+                atexit.register(_pool.shutdown)
+    return _pool
+
+
+def run_render_job(func_path, *args):
+    """نقطة الدخول: ينفذ الـ job في الـ pool، أو في نفس الـ process لو الـ pool مقفول (size = 0)"""
+    if settings.PDF_RENDER_POOL_SIZE <= 0:
+        return import_string(func_path)(*args)
+    return get_render_pool().run(func_path, *args)
+
+
+def busy_response(exc):
+    """رد 503 موحد لما الـ pool يكون مشغول"""
+    response = HttpResponse('الخادم مشغول حالياً بإصدار ملفات أخرى، برجاء إعادة المحاولة بعد لحظات.', status=503)
+    response['Retry-After'] = str(exc.retry_after)
+    return response
+
+
+def timeout_response(exc):
+    """رد 500 موحد لرسمة عدّت المهلة - من غير Retry-After عشان العميل ميعيدش على طول"""
+    logger.error(f'PDF render gave up: {exc}')
+    return HttpResponse('تعذر إنشاء الملف في الوقت المحدد، برجاء التواصل مع المعهد.', status=500)
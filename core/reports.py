@@ -0,0 +1,276 @@
+"""
+تقارير PDF الجدولية الكبيرة (العملاء، الدورات، الدبلومات، المعاهد) بـ reportlab platypus
+
+التقرير ممكن يوصل لعشرات الآلاف من الصفوف، ورسمه كـ HTML واحد بـ WeasyPrint بياخد دقايق وجيجات
+من الذاكرة (الـ HTML وشجرة الـ layout لكل الصفوف في الذاكرة مرة واحدة). هنا:
+- الصفوف بتتقري على دفعات (queryset.iterator بحجم PDF_REPORT_CHUNK_SIZE)، وكل دفعة بتبقى جدول
+  platypus صغير بيتقسم على الصفحات ويترسم ويتساب قبل ما الدفعة اللي بعدها تتقري، فالصفوف وجداولها
+  مبتفضلش في الذاكرة. اللي بيفضل هو محتوى الصفحات المرسومة: reportlab بيحتفظ بكل الصفحات لحد
+  save() في الآخر، فالذاكرة لسه بتزيد مع عدد الصفحات (بس أقل بكتير من WeasyPrint).
+- هيدر الصفحة (اللوجو، العنوان، التاريخ، رؤوس الأعمدة، رقم الصفحة) بيترسم على كل صفحة (onPage)،
+  والجداول نفسها صفوف بيانات بس بعرض أعمدة ثابت، فالصفحات كلها متطابقة.
+- النص العربي بيتوصل (arabic_reshaper) ويترتب للعرض من اليمين للشمال (python-bidi) وبيترسم بخط
+  Cairo، وأول عمود على اليمين.
+- الملف بيتكتب في ملف مؤقت على الديسك وبيرجع FileResponse (streaming) بدل bytes في الذاكرة. التقرير
+  بيتبني كله قبل ما الرد يبدأ - مفيش أي byte بيوصل للعميل قبل آخر صفحة، فالـ streaming هنا للإرسال
+  بس مش للرسم.
+"""
+import functools
+import logging
+import os
+import tempfile
+from itertools import islice
+
+from arabic_reshaper import reshape
+from bidi import get_display
+from django.conf import settings
+from django.http import FileResponse
+from django.utils import timezone
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib.units import cm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import BaseDocTemplate, Frame, PageTemplate, Table, TableStyle
+
+from core.fonts import font_path
+from core.telemetry import note, render_stage, track_render
+
+logger = logging.getLogger('edu_system')
+
+REPORT_FONT = 'Cairo'
+REPORT_FONT_BOLD = 'Cairo-Bold'
+REPORT_FONT_FILES = {
+    REPORT_FONT: 'Cairo-Regular.ttf',
+    REPORT_FONT_BOLD: 'Cairo-Bold.ttf',
+}
+
+LOGO_PATH = os.path.join(settings.BASE_DIR, 'static', 'images', 'logo.png')
+
+FONT_SIZE = 9
+HEADER_FONT_SIZE = 10
+MARGIN = 1 * cm
+# ارتفاع الهيدر (اللوجو والعنوان) وصف رؤوس الأعمدة اللي بيترسموا فوق الجدول في كل صفحة
+BANNER_HEIGHT = 2.2 * cm
+COLUMNS_HEADER_HEIGHT = 0.8 * cm
+FOOTER_HEIGHT = 0.6 * cm
+
+ELLIPSIS = '…'
+
+
+@functools.lru_cache(maxsize=None)
+def register_report_fonts():
+    """تسجيل خطوط Cairo في reportlab (مرة واحدة لكل process)"""
+    for name, filename in REPORT_FONT_FILES.items():
+        pdfmetrics.registerFont(TTFont(name, font_path(filename)))
+
+
+def rtl(text):
+    """النص جاهز للرسم في reportlab: الحروف العربية متوصلة ومترتبة للعرض من اليمين للشمال"""
+    text = '' if text is None else str(text)
+    if not text:
+        return text
+    return get_display(reshape(text))
+
+
+def fit_text(text, width, font=REPORT_FONT, size=FONT_SIZE):
+    """rtl(text) مقصوص من آخره (بـ …) لحد ما يكفي العرض - القص على النص الأصلي قبل ترتيب العرض"""
+    text = '' if text is None else str(text)
+    display = rtl(text)
+    if pdfmetrics.stringWidth(display, font, size) <= width:
+        return display
+
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if pdfmetrics.stringWidth(rtl(text[:middle].rstrip() + ELLIPSIS), font, size) <= width:
+            low = middle
+        else:
+            high = middle - 1
+    return rtl(text[:low].rstrip() + ELLIPSIS)
+
+
+class ReportColumn:
+    """
+    عمود في التقرير.
+    value: اسم attribute في الصف (لو method بتتنادي، زي get_status_display) أو دالة بتاخد الصف.
+    width: العرض النسبي للعمود من عرض الصفحة.
+    """
+
+    def __init__(self, title, value, width=1, align='CENTER'):
+        self.title = title
+        self.value = value
+        self.width = width
+        self.align = align
+
+    def get_value(self, obj):
+        if callable(self.value):
+            value = self.value(obj)
+        else:
+            value = getattr(obj, self.value)
+            if callable(value):
+                value = value()
+        return '-' if value in (None, '') else value
+
+
+class _LazyFlowables(list):
+    """
+    قائمة flowables بتتملي من generator كل ما تفضى - BaseDocTemplate.build بيشتغل على list، فالدفعة
+    اللي بعدها (من الـ queryset) مش بتتقري غير لما الجداول اللي قبلها تترسم.
+    """
+
+    def __init__(self, chunks):
+        super().__init__()
+        self._chunks = iter(chunks)
+
+    def __len__(self):
+        if not super().__len__():
+            self.extend(next(self._chunks, ()))
+        return super().__len__()
+
+
+class TabularReport:
+    """تقرير PDF جدولي - rows: queryset (بيتقري بـ iterator على دفعات) أو أي iterable"""
+
+    def __init__(self, title, columns, rows, user=None, orientation='portrait', color='#2980b9',
+                 chunk_size=None):
+        register_report_fonts()
+        self.title = title
+        self.columns = columns
+        self.rows = rows
+        self.user = user
+        self.color = colors.HexColor(color)
+        self.chunk_size = chunk_size or settings.PDF_REPORT_CHUNK_SIZE
+        self.pagesize = landscape(A4) if orientation == 'landscape' else A4
+
+        page_width, page_height = self.pagesize
+        self.table_width = page_width - 2 * MARGIN
+        total = sum(column.width for column in columns)
+        # الأعمدة بتترسم من اليمين للشمال: أول عمود في القائمة هو آخر عمود في الجدول
+        self.col_widths = [self.table_width * column.width / total for column in reversed(columns)]
+        self.table_style = TableStyle([
+            ('FONTNAME', (0, 0), (-1, -1), REPORT_FONT),
+            ('FONTSIZE', (0, 0), (-1, -1), FONT_SIZE),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('LINEBELOW', (0, 0), (-1, -1), 0.5, colors.HexColor('#eeeeee')),
+            ('ROWBACKGROUNDS', (0, 0), (-1, -1), [colors.white, colors.HexColor('#f9f9f9')]),
+            *(
+                ('ALIGN', (index, 0), (index, -1), column.align)
+                for index, column in enumerate(reversed(columns))
+            ),
+        ])
+        self.created_at = timezone.localtime()
+        self.row_count = 0
+
+    def _iter_rows(self):
+        if hasattr(self.rows, 'iterator'):
+            return self.rows.iterator(chunk_size=self.chunk_size)
+        return iter(self.rows)
+
+    def _row(self, obj):
+        cells = []
+        for column, width in zip(reversed(self.columns), self.col_widths):
+            # 6 = الـ padding الافتراضي للخلية من الناحيتين
+            cells.append(fit_text(column.get_value(obj), width - 12))
+        return cells
+
+    def _tables(self):
+        rows = self._iter_rows()
+        while True:
+            chunk = [self._row(obj) for obj in islice(rows, self.chunk_size)]
+            if not chunk:
+                break
+            self.row_count += len(chunk)
+            yield [Table(chunk, colWidths=self.col_widths, style=self.table_style)]
+
+        if not self.row_count:
+            empty = Table([[rtl('لا توجد بيانات')]], colWidths=[self.table_width])
+            empty.setStyle(TableStyle([
+                ('FONTNAME', (0, 0), (-1, -1), REPORT_FONT),
+                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ]))
+            yield [empty]
+
+    def _draw_page(self, canv, doc):
+        page_width, page_height = self.pagesize
+        left, right = MARGIN, page_width - MARGIN
+        top = page_height - MARGIN
+        canv.saveState()
+
+        if os.path.exists(LOGO_PATH):
+            canv.drawImage(
+                LOGO_PATH, left, top - BANNER_HEIGHT + 0.3 * cm, width=2.5 * cm, height=BANNER_HEIGHT - 0.5 * cm,
+                preserveAspectRatio=True, anchor='w', mask='auto',
+            )
+        canv.setFont(REPORT_FONT_BOLD, 14)
+        canv.drawCentredString(page_width / 2, top - 1.1 * cm, rtl(self.title))
+        canv.setFont(REPORT_FONT, 8)
+        canv.drawRightString(right, top - 0.8 * cm, rtl(f'التاريخ: {self.created_at:%Y-%m-%d}'))
+        if self.user is not None:
+            canv.drawRightString(right, top - 1.3 * cm, rtl(f'المستخدم: {self.user.username}'))
+        canv.setStrokeColor(self.color)
+        canv.setLineWidth(2)
+        canv.line(left, top - BANNER_HEIGHT, right, top - BANNER_HEIGHT)
+
+        header_bottom = top - BANNER_HEIGHT - COLUMNS_HEADER_HEIGHT - 0.1 * cm
+        canv.setFillColor(self.color)
+        canv.rect(left, header_bottom, self.table_width, COLUMNS_HEADER_HEIGHT, stroke=0, fill=1)
+        canv.setFillColor(colors.white)
+        canv.setFont(REPORT_FONT_BOLD, HEADER_FONT_SIZE)
+        x = left
+        for column, width in zip(reversed(self.columns), self.col_widths):
+            title = fit_text(column.title, width - 12, REPORT_FONT_BOLD, HEADER_FONT_SIZE)
+            canv.drawCentredString(x + width / 2, header_bottom + 0.27 * cm, title)
+            x += width
+
+        canv.setFillColor(colors.grey)
+        canv.setFont(REPORT_FONT, 8)
+        canv.drawCentredString(page_width / 2, MARGIN / 2, rtl(f'صفحة {doc.page}'))
+        canv.restoreState()
+
+    def write(self, target):
+        """يرسم التقرير في target (مسار أو file object) ويرجع عدد الصفحات، وبيتسجل في قياسات الرسم"""
+        institute_id = getattr(self.user, 'institute_id', None)
+        with track_render('report', template=self.title[:255], institute_id=institute_id):
+            with render_stage('write'):
+                pages = self._build(target)
+            if isinstance(target, (str, os.PathLike)):
+                size = os.path.getsize(target)
+            else:
+                size = target.tell()
+            note(pages=pages, size=size)
+        return pages
+
+    def _build(self, target):
+        page_width, page_height = self.pagesize
+        frame_top = page_height - MARGIN - BANNER_HEIGHT - COLUMNS_HEADER_HEIGHT - 0.1 * cm
+        frame = Frame(
+            MARGIN, MARGIN + FOOTER_HEIGHT, self.table_width, frame_top - MARGIN - FOOTER_HEIGHT,
+            leftPadding=0, rightPadding=0, topPadding=0, bottomPadding=0,
+        )
+        doc = BaseDocTemplate(
+            target, pagesize=self.pagesize, title=self.title,
+            author=self.user.username if self.user is not None else '',
+            leftMargin=MARGIN, rightMargin=MARGIN, topMargin=MARGIN, bottomMargin=MARGIN,
+        )
+        doc.addPageTemplates([PageTemplate(id='report', frames=[frame], onPage=self._draw_page)])
+        doc.build(_LazyFlowables(self._tables()))
+        return doc.page
+
+    def response(self, filename):
+        """
+        FileResponse (streaming) للتقرير من ملف مؤقت بيتمسح أول ما الرد يخلص. التقرير كله بيترسم
+        (وصفحاته في ذاكرة reportlab لحد save) قبل ما الرد يرجع، والإرسال بس اللي بيبقى على أجزاء.
+        """
+        output = tempfile.TemporaryFile(suffix='.pdf')
+        try:
+            pages = self.write(output)
+        except Exception:
+            output.close()
+            raise
+        output.seek(0)
+        logger.info(
+            f'Report "{filename}" generated: {self.row_count} rows, {pages} pages'
+            + (f' by {self.user.username}' if self.user is not None else '')
+        )
+        return FileResponse(output, content_type='application/pdf', filename=f'{filename}.pdf')
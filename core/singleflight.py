@@ -0,0 +1,136 @@
+"""
+Single-flight: الطلبات المتزامنة لنفس الرسم بتستنى رسمة واحدة وبتاخد نتيجتها
+
+لما الطالب يدوس "تحميل" كذا مرة، أو موظف وطالب يفتحوا نفس الإذن في نفس اللحظة، كل طلب كان
+بيبدأ رسم WeasyPrint لوحده لنفس الملف. هنا:
+- single_flight: جوه الـ process جدول بالعمليات الشغالة (مفتاح -> رسمة)؛ أول طلب بيرسم (leader)
+  والباقي بيستنوا نفس الرسمة وبياخدوا نفس النتيجة (أو نفس الخطأ، زي RenderPoolBusy).
+- worker_lock: قفل بين الـ workers (gunicorn processes) على نفس السيرفر بملف + flock. اللي بياخد
+  القفل بعد ما حد تاني خلص المفروض يراجع الكاش (الملف على الديسك) قبل ما يرسم.
+- الاتنين ليهم مهلة (PDF_SINGLE_FLIGHT_TIMEOUT): لو الرسمة الأصلية علّقت، المستني بيرسم بنفسه
+  بدل ما الطلب يفضل مستني.
+
+ملفات القفل عددها ثابت (LOCK_STRIPES) والمفتاح بيتوزع عليها بالـ hash، فمفيش ملفات بتتراكم.
+PDF_RENDER_LOCK_DIR لازم يكون مشترك بين كل الـ workers (الافتراضي مجلد مؤقت في /tmp).
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows - مفيش قفل بين الـ workers، الـ single-flight جوه الـ process بس
+    fcntl = None
+
+logger = logging.getLogger('edu_system')
+
+LOCK_STRIPES = 1024
+
+# فترة إعادة المحاولة على قفل الملف (ثانية)
+LOCK_POLL_INTERVAL = 0.05
+
+
+class _Flight:
+    """رسمة شغالة لمفتاح واحد - المستنيين بيستنوا done"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def single_flight(key, func, timeout=None):
+    """
+    ينفذ func() مرة واحدة لكل الطلبات المتزامنة على نفس key في الـ process ويرجع نتيجتها.
+    لو الرسمة الشغالة مخلصتش في timeout ثانية المستني بينفذ func() بنفسه.
+    """
+    timeout = settings.PDF_SINGLE_FLIGHT_TIMEOUT if timeout is None else timeout
+
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+        else:
+            flight.waiters += 1
+
+    if not leader:
+        if not flight.done.wait(timeout):
+            logger.warning(f'Single-flight wait timed out after {timeout}s for {key}, running again')
+            return func()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    try:
+        flight.result = func()
+        return flight.result
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            if _flights.get(key) is flight:
+                del _flights[key]
+        if flight.waiters:
+            logger.debug(f'Single-flight {key} shared with {flight.waiters} waiting requests')
+        flight.done.set()
+
+
+def _lock_path(key):
+    directory = settings.PDF_RENDER_LOCK_DIR or os.path.join(tempfile.gettempdir(), 'edu_system-locks')
+    os.makedirs(directory, exist_ok=True)
+    stripe = int(hashlib.sha1(key.encode('utf-8')).hexdigest()[:8], 16) % LOCK_STRIPES
+    return os.path.join(directory, f'{stripe:04d}.lock')
+
+
+@contextmanager
+def worker_lock(key, timeout=None):
+    """
+    قفل بين الـ workers لمفتاح واحد. بيرجع (yield) True لو اضطر يستنى حد تاني (يعني الكاش ممكن
+    يكون اتملى)، و False لو القفل كان فاضي. لو المهلة خلصت الكود بيكمل من غير قفل.
+    """
+    timeout = settings.PDF_SINGLE_FLIGHT_TIMEOUT if timeout is None else timeout
+    if fcntl is None:
+        yield False
+        return
+
+    try:
+        lock_file = open(_lock_path(key), 'a+b')
+    except OSError as e:
+        logger.warning(f'Could not open render lock for {key}: {e}')
+        yield False
+        return
+
+    with lock_file:
+        waited = False
+        locked = False
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                locked = True
+                break
+            except BlockingIOError:
+                waited = True
+                if time.monotonic() >= deadline:
+                    logger.warning(f'Render lock wait timed out after {timeout}s for {key}, running unlocked')
+                    break
+                time.sleep(LOCK_POLL_INTERVAL)
+
+        try:
+            yield waited
+        finally:
+            if locked:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,156 @@
+"""
+قياسات رسم ملفات PDF (المشاهد والتقارير) - سجل لكل رسمة في جدول PDFRenderRecord
+
+- track_render: بيلف الرسمة كلها ويسجل الزمن الإجمالي وهوية القالب/الخط.
+- render_stage: زمن مرحلة واحدة (context / compile / render / layout / write) جوه الرسمة الحالية.
+- note: أي معلومة تانية عن الرسمة الحالية (cache_hit، fallback، pages، size ...).
+  الاتنين بيشتغلوا بس جوه track_render (على نفس الـ thread)، وبرّاه مبيعملوش حاجة - فنفس الدوال
+  تنفع للمعاينة وحماية القالب من غير ما يتسجلوا.
+- record_render: سجل جاهز من غير ما يلف كود (مثلاً PDF اتقرا من الديسك من غير رسم).
+- السجلات بتتجمع في الذاكرة وبتتكتب بـ bulk_create كل PDF_TELEMETRY_BATCH_SIZE سجل أو كل
+  PDF_TELEMETRY_FLUSH_INTERVAL ثانية - بعد commit الـ transaction المفتوحة (لو فيه) مش جواها،
+  وأي مفتاح من note() مش حقل في PDFRenderRecord بيتشال بدل ما يوقع الدفعة كلها.
+- السجلات الأقدم من PDF_TELEMETRY_RETENTION_DAYS بتتمسح بأمر purge_render_records (cron) مش في الطلب.
+"""
+import atexit
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+logger = logging.getLogger('edu_system')
+
+_local = threading.local()
+_buffer = []
+_buffer_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+def _current():
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def track_render(kind, **fields):
+    """
+    يسجل رسمة واحدة. الرسمات المتداخلة (مثلاً القالب الاحتياطي جوه رسم قالب المعهد) بتتحسب
+    على الرسمة الخارجية.
+    """
+    if not settings.PDF_TELEMETRY_ENABLED or _current() is not None:
+        yield
+        return
+
+    trace = _local.trace = {'kind': kind, 'stages': {}, 'created_at': timezone.now(), **fields}
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _local.trace = None
+        trace['total_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        _record(trace)
+
+
+@contextmanager
+def render_stage(name):
+    """زمن مرحلة في الرسمة الحالية (بيتجمع لو المرحلة اتكررت)"""
+    trace = _current()
+    if trace is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - started) * 1000
+        trace['stages'][name] = round(trace['stages'].get(name, 0) + elapsed, 3)
+
+
+def note(**fields):
+    """يضيف معلومات للرسمة الحالية لو فيه واحدة"""
+    trace = _current()
+    if trace is not None:
+        trace.update(fields)
+
+
+def record_render(kind, total_ms, **fields):
+    """يسجل رسمة خلصت من غير track_render (بيتجاهل لو جوه رسمة تانية)"""
+    if not settings.PDF_TELEMETRY_ENABLED or _current() is not None:
+        return
+    _record({
+        'kind': kind, 'stages': {}, 'created_at': timezone.now(), 'total_ms': round(total_ms, 3), **fields
+    })
+
+
+def _record(trace):
+    with _buffer_lock:
+        _buffer.append(trace)
+        due = (
+            len(_buffer) >= settings.PDF_TELEMETRY_BATCH_SIZE
+            or time.monotonic() - _last_flush >= settings.PDF_TELEMETRY_FLUSH_INTERVAL
+        )
+    if due:
+        # مش جوه transaction الطلب: لو اترجعت السجلات متضيعش، ولو اتعملت مبتطولش الأقفال بتاعتها
+        # (برّه أي atomic بتتنفذ على طول)
+        transaction.on_commit(flush_render_records)
+
+
+@lru_cache(maxsize=None)
+def _record_fields():
+    from .models import PDFRenderRecord
+
+    fields = set()
+    for field in PDFRenderRecord._meta.concrete_fields:
+        fields.update((field.name, field.attname))
+    return frozenset(fields)
+
+
+def _build_record(trace):
+    from .models import PDFRenderRecord
+
+    fields = _record_fields()
+    unknown = set(trace) - fields
+    if unknown:
+        logger.debug(f'Ignoring unknown PDF render record fields: {sorted(unknown)}')
+    return PDFRenderRecord(**{name: value for name, value in trace.items() if name in fields})
+
+
+def flush_render_records():
+    """يكتب السجلات المتجمعة في الجدول - بيرجع عدد السجلات المكتوبة"""
+    global _last_flush
+    from .models import PDFRenderRecord
+
+    with _buffer_lock:
+        pending = _buffer[:]
+        _buffer.clear()
+        _last_flush = time.monotonic()
+
+    if not pending:
+        return 0
+
+    try:
+        PDFRenderRecord.objects.bulk_create([_build_record(trace) for trace in pending])
+    except (DatabaseError, ValueError) as e:
+        logger.warning(f'Could not write {len(pending)} PDF render records: {e}')
+        return 0
+    return len(pending)
+
+
+def purge_render_records(days=None):
+    """يمسح السجلات الأقدم من days (الافتراضي PDF_TELEMETRY_RETENTION_DAYS) - بيرجع عددها"""
+    from .models import PDFRenderRecord
+
+    if days is None:
+        days = settings.PDF_TELEMETRY_RETENTION_DAYS
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted, _ = PDFRenderRecord.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
+
+
+atexit.register(flush_render_records)
@@ -2,9 +2,38 @@
 Tests for Core App
 اختبارات التطبيق الأساسي
 """
-from django.test import TestCase, RequestFactory
+import base64
+import io
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase, SimpleTestCase, RequestFactory, override_settings
+from django.core.files.base import ContentFile
+from django.utils import timezone
+from PIL import Image
 from django.contrib.auth import get_user_model
+from fontTools.ttLib import TTFont
+from reportlab.pdfbase import pdfmetrics
 
+from core.assets import AssetCache
+from core.fonts import build_font_face_css, font_path, subset_font_b64
+from core.images import DERIVATIVE_DIR, build_derivative, page_pixels
+from core.url_fetcher import local_url_fetcher
+from core.reports import FONT_SIZE, REPORT_FONT, ReportColumn, TabularReport, fit_text, rtl
+from core.utils import get_pdf_response
+from core.render_pool import RenderPool, RenderPoolBusy, RenderPoolError, RenderTimeout, run_sandboxed_job
+from core.singleflight import single_flight, worker_lock
+from core import telemetry
+from core.models import PDFRenderRecord
 from core.mixins import (
     AdminRequiredMixin, EmployeeRequiredMixin,
     InstituteScopedMixin, SearchMixin, FilterMixin
@@ -282,3 +311,409 @@ class BaseModelTests(TestCase):
         self.assertEqual(Client.objects.filter(national_id='TEST004').count(), 0)
         # all_objects includes deleted
         self.assertEqual(Client.all_objects.filter(national_id='TEST004').count(), 1)
+
+
+class AssetCacheTests(SimpleTestCase):
+    """اختبارات كاش ملفات الصور والخطوط (Base64)"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'stamp.png')
+        with open(self.path, 'wb') as f:
+            f.write(b'stamp-v1')
+        self.cache = AssetCache(max_bytes=1024)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_hit_after_first_read(self):
+        """اختبار إن القراءة التانية من الذاكرة"""
+        first = self.cache.get_b64(self.path)
+        self.assertEqual(self.cache.get_b64(self.path), first)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_modified_file_is_reencoded(self):
+        """اختبار إن تعديل الملف بيطلع مفتاح جديد"""
+        first = self.cache.get_b64(self.path)
+        with open(self.path, 'wb') as f:
+            f.write(b'stamp-version-2')
+        self.assertNotEqual(self.cache.get_b64(self.path), first)
+        self.assertEqual(self.cache.stats()['entries'], 1)
+
+    def test_missing_file(self):
+        """اختبار إن الملف غير الموجود بيرجع نص فاضي"""
+        self.assertEqual(self.cache.get_b64(os.path.join(self.tmp_dir, 'missing.png')), '')
+        self.assertEqual(self.cache.get_data_uri(''), '')
+
+    def test_evicts_least_recently_used(self):
+        """اختبار إن الحد الأقصى للحجم بيشيل الأقدم استخداماً"""
+        cache = AssetCache(max_bytes=20)
+        other = os.path.join(self.tmp_dir, 'sig.png')
+        with open(other, 'wb') as f:
+            f.write(b'signature')
+        cache.get_b64(self.path)
+        cache.get_b64(other)
+        self.assertEqual(cache.evictions, 1)
+        self.assertLessEqual(cache.stats()['bytes'], 20)
+
+
+class FontSubsetTests(SimpleTestCase):
+    """اختبارات تقليص خطوط PDF"""
+
+    def test_subset_smaller_and_keeps_arabic(self):
+        """اختبار إن الخط المقلص أصغر ولسه فيه الحروف العربية واللاتينية"""
+        path = font_path('Cairo-Regular.ttf')
+        subset_bytes = base64.b64decode(subset_font_b64(path))
+        self.assertLess(len(subset_bytes), os.path.getsize(path))
+
+        cmap = TTFont(io.BytesIO(subset_bytes)).getBestCmap()
+        for char in 'بسمA1':
+            self.assertIn(ord(char), cmap)
+
+    def test_font_face_css_only_for_custom_fonts(self):
+        """اختبار إن Arial مش محتاج @font-face"""
+        self.assertEqual(build_font_face_css('arial'), '')
+        self.assertIn("font-family: 'Cairo'", build_font_face_css('cairo'))
+
+
+class RenderPoolTests(SimpleTestCase):
+    """اختبارات pool عمليات الرسم المنفصلة"""
+
+    def setUp(self):
+        self.pool = RenderPool(size=1, timeout=2, max_jobs=2, max_rss_mb=2048, queue_timeout=0.2)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_runs_in_separate_process_and_recycles(self):
+        """اختبار إن الـ job بيتنفذ في process تاني وبيتجدد بعد max_jobs"""
+        first = self.pool.run('os.getpid')
+        self.assertNotEqual(first, os.getpid())
+        self.assertEqual(self.pool.run('os.getpid'), first)
+        self.assertNotEqual(self.pool.run('os.getpid'), first)
+
+    def test_timeout_kills_worker(self):
+        """اختبار إن الـ job اللي بيعدي المهلة بيرمي RenderTimeout (مش Busy) والـ process بيتقتل"""
+        with self.assertRaises(RenderTimeout) as ctx:
+            self.pool.run('time.sleep', 5)
+        self.assertNotIsInstance(ctx.exception, RenderPoolBusy)
+        self.assertEqual(self.pool._started, 0)
+
+    def test_queue_saturation_is_busy(self):
+        """اختبار إن الطابور المليان بس هو اللي بيرمي RenderPoolBusy مع Retry-After"""
+        worker = self.pool._acquire()
+        try:
+            with self.assertRaises(RenderPoolBusy) as ctx:
+                self.pool.run('os.getpid')
+            self.assertEqual(ctx.exception.retry_after, 2)
+        finally:
+            self.pool._release(worker, 0)
+
+    def test_job_error(self):
+        """اختبار إن الخطأ جوه الـ job بيوصل كـ RenderPoolError"""
+        with self.assertRaises(RenderPoolError):
+            self.pool.run('json.loads', '{bad')
+
+    def test_sandboxed_job(self):
+        """اختبار الـ job المعزول: process جديد، مهلة، وحد ذاكرة"""
+        self.assertNotEqual(run_sandboxed_job('os.getpid', timeout=30), os.getpid())
+
+        with self.assertRaises(RenderTimeout):
+            run_sandboxed_job('time.sleep', 30, timeout=1)
+
+        with self.assertRaises(RenderPoolError) as ctx:
+            run_sandboxed_job('os.urandom', 1024 * 1024 * 1024, timeout=30, max_memory_mb=1024)
+        self.assertIn('MemoryError', str(ctx.exception))
+
+
+class SingleFlightTests(SimpleTestCase):
+    """اختبارات دمج الطلبات المتزامنة لنفس الرسم"""
+
+    def _run_concurrently(self, func, count=4):
+        results, errors = [], []
+
+        def call():
+            try:
+                results.append(single_flight('test-key', func, timeout=5))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_concurrent_calls_share_one_run(self):
+        """اختبار إن الطلبات المتزامنة بتاخد نتيجة رسمة واحدة"""
+        calls = []
+
+        def render():
+            calls.append(1)
+            time.sleep(0.3)
+            return b'%PDF-shared'
+
+        results, errors = self._run_concurrently(render)
+        self.assertEqual((len(calls), errors), (1, []))
+        self.assertEqual(results, [b'%PDF-shared'] * 4)
+
+    def test_error_shared_and_key_released(self):
+        """اختبار إن الخطأ بيوصل لكل المستنيين والمفتاح بيتساب للطلب اللي بعده"""
+        def render():
+            time.sleep(0.3)
+            raise RenderPoolBusy('busy', retry_after=3)
+
+        results, errors = self._run_concurrently(render)
+        self.assertEqual(results, [])
+        self.assertTrue(all(isinstance(e, RenderPoolBusy) for e in errors))
+        self.assertEqual(single_flight('test-key', lambda: b'%PDF-retry', timeout=5), b'%PDF-retry')
+
+    def test_worker_lock_reports_wait_and_times_out(self):
+        """اختبار إن قفل الـ workers بيقول لو استنى، وبيكمل من غير قفل بعد المهلة"""
+        lock_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, lock_dir, ignore_errors=True)
+
+        with override_settings(PDF_RENDER_LOCK_DIR=lock_dir):
+            with worker_lock('test-key', timeout=1) as waited:
+                self.assertFalse(waited)
+                outcome = []
+                # flock مربوط بالملف المفتوح، ففتحة تانية في thread تاني بتتصرف زي worker تاني
+                thread = threading.Thread(target=lambda: outcome.append(self._try_lock()))
+                thread.start()
+                thread.join()
+            self.assertEqual(outcome, [True])
+
+    def _try_lock(self):
+        with worker_lock('test-key', timeout=0.2) as waited:
+            return waited
+
+
+class RenderTelemetryTests(TestCase):
+    """اختبارات قياسات رسم ملفات PDF"""
+
+    def setUp(self):
+        telemetry.flush_render_records()
+        PDFRenderRecord.objects.all().delete()
+
+    def test_nested_render_counts_once(self):
+        """اختبار إن المراحل بتتجمع والرسمة المتداخلة بتتحسب على الخارجية، وبرّا أي رسمة مفيش تسجيل"""
+        with telemetry.render_stage('layout'):
+            telemetry.note(pages=5)
+
+        with telemetry.track_render('report', template='clients/report.html'):
+            with telemetry.render_stage('layout'):
+                pass
+            with telemetry.track_render('report', template='inner.html'):
+                with telemetry.render_stage('layout'):
+                    telemetry.note(fallback=True)
+        self.assertEqual(telemetry.flush_render_records(), 1)
+
+        record = PDFRenderRecord.objects.get()
+        self.assertEqual((record.template, record.fallback, record.pages), ('clients/report.html', True, None))
+        self.assertEqual(list(record.stages), ['layout'])
+
+    def test_unknown_note_fields_do_not_drop_batch(self):
+        """اختبار إن مفتاح في note() مش حقل في الجدول بيتشال بس، وباقي الدفعة بتتكتب"""
+        with telemetry.track_render('report', template='a.html'):
+            telemetry.note(pages=2, unexpected='x')
+        with telemetry.track_render('report', template='b.html'):
+            pass
+        self.assertEqual(telemetry.flush_render_records(), 2)
+        self.assertEqual(PDFRenderRecord.objects.get(template='a.html').pages, 2)
+
+    @override_settings(PDF_TELEMETRY_BATCH_SIZE=1)
+    def test_flush_waits_for_commit(self):
+        """اختبار إن الكتابة مبتحصلش جوه transaction الطلب وبتتنفذ بعد الـ commit"""
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with telemetry.track_render('report'):
+                pass
+            self.assertFalse(PDFRenderRecord.objects.exists())
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(PDFRenderRecord.objects.count(), 1)
+
+    def test_stored_pdf_read_recorded(self):
+        """اختبار إن record_render بيسجل من غير track_render، وجوه رسمة تانية بيتجاهل"""
+        with telemetry.track_render('report'):
+            telemetry.record_render('permission', 0.5, render_mode='stored', cache_hit=True)
+        telemetry.record_render('permission', 0.5, render_mode='stored', cache_hit=True, size=10)
+        self.assertEqual(telemetry.flush_render_records(), 2)
+        self.assertEqual(PDFRenderRecord.objects.filter(render_mode='stored', cache_hit=True, size=10).count(), 1)
+
+    @override_settings(PDF_TELEMETRY_RETENTION_DAYS=7)
+    def test_old_records_purged(self):
+        """اختبار إن أمر purge_render_records بيمسح السجلات الأقدم من مدة الاحتفاظ بس"""
+        old = PDFRenderRecord.objects.create(kind='report', total_ms=1, created_at=timezone.now() - timedelta(days=8))
+        recent = PDFRenderRecord.objects.create(kind='report', total_ms=1)
+
+        call_command('purge_render_records', stdout=StringIO())
+        self.assertFalse(PDFRenderRecord.objects.filter(pk=old.pk).exists())
+        self.assertTrue(PDFRenderRecord.objects.filter(pk=recent.pk).exists())
+
+        call_command('purge_render_records', days=0, stdout=StringIO())
+        self.assertFalse(PDFRenderRecord.objects.exists())
+
+
+class RenderImageTests(TestCase):
+    """اختبارات نسخ صور المعهد المجهزة للطباعة"""
+
+    def _image_bytes(self, size, mode='RGB', fmt='JPEG', exif=False):
+        image = Image.new(mode, size, 'red')
+        buffer = io.BytesIO()
+        kwargs = {}
+        if exif:
+            exif_data = Image.Exif()
+            exif_data[0x010F] = 'PhoneMaker'
+            kwargs['exif'] = exif_data.tobytes()
+        image.save(buffer, fmt, **kwargs)
+        return buffer.getvalue()
+
+    def test_logo_downscaled_without_metadata(self):
+        """اختبار إن اللوجو بيتصغر لمقاس الطباعة ومن غير EXIF"""
+        data, ext = build_derivative(self._image_bytes((4000, 3000), exif=True), 'logo')
+        self.assertEqual(ext, 'jpg')
+        with Image.open(io.BytesIO(data)) as image:
+            self.assertLessEqual(max(image.size), 300)
+            self.assertFalse(image.getexif())
+
+    def test_transparent_stamp_stays_png(self):
+        """اختبار إن الختم الشفاف بيفضل PNG بالشفافية"""
+        data, ext = build_derivative(self._image_bytes((1200, 1200), 'RGBA', 'PNG'), 'stamp_image')
+        self.assertEqual(ext, 'png')
+        with Image.open(io.BytesIO(data)) as image:
+            self.assertEqual(image.mode, 'RGBA')
+
+    def test_background_fits_page(self):
+        """اختبار إن الخلفية بتتصغر لمقاس الصفحة بالظبط وبتبقى JPEG"""
+        data, ext = build_derivative(self._image_bytes((5000, 7000), 'RGBA', 'PNG'), 'background_img', 'A4', 'landscape')
+        self.assertEqual(ext, 'jpg')
+        with Image.open(io.BytesIO(data)) as image:
+            self.assertEqual(image.size, page_pixels('A4', 'landscape'))
+
+    def test_derivatives_built_on_institute_save(self):
+        """اختبار إن حفظ المعهد بيعمل النسخ المجهزة ويمسح القديمة"""
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+
+        with override_settings(MEDIA_ROOT=media_root):
+            institute = Institute(
+                name='Images Institute', code='IMG001', license_number='IMGLIC',
+                address='Test', city='Test', region='Test', phone='1234567890',
+            )
+            institute.logo.save('logo.jpg', ContentFile(self._image_bytes((3000, 3000))), save=False)
+            institute.save()
+
+            directory = os.path.join(media_root, DERIVATIVE_DIR, str(institute.pk))
+            self.assertEqual(len(os.listdir(directory)), 1)
+
+            institute.logo.save('logo2.jpg', ContentFile(self._image_bytes((2000, 2000))), save=False)
+            institute.save()
+            files = os.listdir(directory)
+            self.assertEqual(len(files), 1)
+            with Image.open(os.path.join(directory, files[0])) as image:
+                self.assertLessEqual(max(image.size), 300)
+
+
+class LocalURLFetcherTests(TestCase):
+    """اختبارات الـ url_fetcher المحلي لـ WeasyPrint"""
+
+    def setUp(self):
+        self.logo_path = os.path.join(settings.BASE_DIR, 'static', 'images', 'logo.png')
+        # أي محاولة اتصال شبكة أثناء الاختبار تفشل فوراً
+        patcher = mock.patch.object(socket.socket, 'connect', side_effect=AssertionError('outbound network'))
+        self.connect = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_static_url_read_from_disk(self):
+        """اختبار إن رابط static كامل بيتقري من الديسك"""
+        response = local_url_fetcher('http://testserver/static/images/logo.png')
+        with open(self.logo_path, 'rb') as f:
+            self.assertEqual(response.read(), f.read())
+        self.connect.assert_not_called()
+
+    def test_media_and_file_urls_confined(self):
+        """اختبار إن media و file:// مسموحين جوه المجلدات بس"""
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        with open(os.path.join(media_root, 'stamp.png'), 'wb') as f:
+            f.write(b'stamp')
+
+        with override_settings(MEDIA_ROOT=media_root):
+            self.assertEqual(local_url_fetcher('https://example.org/media/stamp.png').read(), b'stamp')
+            self.assertEqual(local_url_fetcher(f'file://{media_root}/stamp.png').read(), b'stamp')
+            with self.assertRaises(ValueError):
+                local_url_fetcher('http://testserver/media/../../etc/passwd')
+            with self.assertRaises(ValueError):
+                local_url_fetcher('file:///etc/passwd')
+
+    def test_external_url_refused(self):
+        """اختبار إن أي رابط خارجي بيترفض من غير اتصال"""
+        with self.assertRaises(ValueError):
+            local_url_fetcher('https://example.com/tracker.png')
+        self.connect.assert_not_called()
+
+    def test_report_renders_without_outbound_http(self):
+        """اختبار إن تقرير PDF بيترسم من غير أي اتصال HTTP (اللوجو من الديسك)"""
+        user = User.objects.create_user(username='reporter', password='x', role=User.Role.ADMIN)
+        request = RequestFactory().get('/clients/export/pdf/', HTTP_HOST='localhost')
+        request.user = user
+
+        with mock.patch('urllib.request.OpenerDirector.open', side_effect=AssertionError('urlopen')) as urlopen:
+            response = get_pdf_response(request, 'clients/clients_pdf_template.html',
+                                        {'clients': [], 'title': 'Report'}, 'report')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content.startswith(b'%PDF'))
+        self.connect.assert_not_called()
+        urlopen.assert_not_called()
+
+
+class TabularReportTests(SimpleTestCase):
+    """اختبارات تقارير PDF الجدولية (core.reports)"""
+
+    columns = [
+        ReportColumn('الاسم', 'name', width=3, align='RIGHT'),
+        ReportColumn('الكود', lambda row: row.code),
+        ReportColumn('الحالة', 'get_status'),
+    ]
+
+    def _rows(self, count):
+        row = type('Row', (), {'get_status': lambda self: 'نشط'})
+        for i in range(count):
+            obj = row()
+            obj.name, obj.code = f'عميل رقم {i}', f'C{i}'
+            yield obj
+
+    def test_arabic_shaped_for_display(self):
+        """اختبار إن النص العربي بيتوصل (Presentation Forms) ويترتب من اليمين للشمال"""
+        display = rtl('محمد 2024')
+        self.assertTrue(display.startswith('2024'))
+        self.assertTrue(all('\uFE70' <= ch <= '\uFEFF' for ch in display.replace('2024', '').strip()))
+        self.assertEqual(rtl(None), '')
+
+    def test_fit_text_truncates(self):
+        """اختبار إن النص الطويل بيتقص بـ … على عرض العمود"""
+        text = 'اسم طويل جداً ' * 20
+        fitted = fit_text(text, 100)
+        self.assertLessEqual(pdfmetrics.stringWidth(fitted, REPORT_FONT, FONT_SIZE), 100)
+        self.assertIn('…', fitted)
+        self.assertEqual(fit_text('قصير', 100), rtl('قصير'))
+
+    @override_settings(PDF_REPORT_CHUNK_SIZE=40)
+    def test_rows_consumed_in_chunks(self):
+        """اختبار إن الصفوف بتتقري على دفعات أثناء الرسم مش كلها مرة واحدة"""
+        consumed = []
+        report = TabularReport('تقرير', self.columns, (consumed.append(1) or row for row in self._rows(500)))
+        tables = report._tables()
+        next(tables)
+        self.assertEqual(len(consumed), 40)
+
+        output = io.BytesIO()
+        pages = TabularReport('تقرير', self.columns, self._rows(500)).write(output)
+        self.assertGreater(pages, 5)
+        self.assertTrue(output.getvalue().startswith(b'%PDF'))
+
+    def test_empty_report(self):
+        """اختبار إن التقرير من غير صفوف بيطلع صفحة واحدة"""
+        output = io.BytesIO()
+        self.assertEqual(TabularReport('تقرير', self.columns, []).write(output), 1)
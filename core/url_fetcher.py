@@ -0,0 +1,97 @@
+"""
+url_fetcher محلي لكل استدعاءات WeasyPrint
+
+التقارير كانت بتبعت logo_url و base_url كروابط http كاملة (request.build_absolute_uri)، فـ WeasyPrint
+كان بينزل اللوجو وأي ملف static تاني من nginx/gunicorn نفسهم - يعني worker تاني محجوز لكل تقرير،
+وأحياناً deadlock لما كل الـ workers مشغولة. هنا:
+- أي رابط تحت STATIC_URL بيتقري من STATIC_ROOT (أو staticfiles finders لو collectstatic مااتعملش).
+- أي رابط تحت MEDIA_URL بيتقري من MEDIA_ROOT.
+- file:// مسموح بس لو الملف جوه مجلدات الـ static أو الـ media (القوالب بيكتبها المستخدمين).
+- data: بيتفك عادي (مفيش شبكة).
+- أي رابط تاني (http خارجي، ftp، ...) بيترفض - WeasyPrint بيتجاهل المورد ويكمل الرسم.
+- محتوى الملفات بيتخزن في كاش على مستوى العملية (core.assets.AssetCache).
+"""
+import logging
+import mimetypes
+import os
+from urllib.parse import unquote, urlsplit
+from urllib.request import url2pathname
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from weasyprint.urls import URLFetcher, URLFetcherResponse
+
+from core.assets import AssetCache
+
+logger = logging.getLogger('edu_system')
+
+fetch_cache = AssetCache()
+
+
+def _url_prefix(url):
+    return '/' + str(url).strip('/') + '/'
+
+
+def _inside(path, root):
+    if not root:
+        return False
+    root = os.path.realpath(root)
+    return os.path.commonpath([os.path.realpath(path), root]) == root
+
+
+def allowed_roots():
+    static_dirs = [d[1] if isinstance(d, (list, tuple)) else d for d in settings.STATICFILES_DIRS]
+    return [settings.STATIC_ROOT, settings.MEDIA_ROOT, *static_dirs]
+
+
+def resolve_local_path(url):
+    """المسار المحلي المقابل للرابط، أو None لو الرابط مش لملف static/media"""
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+
+    if scheme == 'file':
+        path = url2pathname(parts.path)
+        return path if any(_inside(path, root) for root in allowed_roots()) else None
+
+    if scheme not in ('http', 'https'):
+        return None
+
+    path = unquote(parts.path)
+    static_prefix = _url_prefix(settings.STATIC_URL)
+    media_prefix = _url_prefix(settings.MEDIA_URL)
+
+    if path.startswith(media_prefix):
+        candidate = os.path.join(settings.MEDIA_ROOT, path[len(media_prefix):])
+        return candidate if _inside(candidate, settings.MEDIA_ROOT) else None
+
+    if path.startswith(static_prefix):
+        relative = path[len(static_prefix):]
+        candidate = os.path.join(settings.STATIC_ROOT, relative) if settings.STATIC_ROOT else ''
+        if candidate and _inside(candidate, settings.STATIC_ROOT) and os.path.isfile(candidate):
+            return candidate
+        return finders.find(relative)
+
+    return None
+
+
+class LocalURLFetcher(URLFetcher):
+    """URLFetcher بيقرا الموارد من الديسك مباشرة وبيرفض أي طلب شبكة"""
+
+    def fetch(self, url, headers=None):
+        if url.startswith('data:'):
+            return super().fetch(url, headers)
+
+        path = resolve_local_path(url)
+        if not path:
+            logger.warning(f'Blocked non-local PDF resource fetch: {url[:200]}')
+            raise ValueError(f'Non-local URL not allowed in PDF rendering: {url[:200]}')
+
+        data = fetch_cache.get_bytes(path)
+        if data is None:
+            raise FileNotFoundError(f'PDF resource not found: {url[:200]}')
+
+        mime_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        return URLFetcherResponse(url, data, {'Content-Type': mime_type})
+
+
+local_url_fetcher = LocalURLFetcher()
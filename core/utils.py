@@ -1,7 +1,17 @@
+import re
+from urllib.parse import quote
+
 from weasyprint import HTML
 from django.template.loader import render_to_string
 from django.http import HttpResponse
 from django.conf import settings
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from core.telemetry import note, render_stage, track_render
+from core.url_fetcher import local_url_fetcher
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
 
 
 def get_pdf_response(request, template_path, context, filename):
@@ -9,12 +19,135 @@ def get_pdf_response(request, template_path, context, filename):
     context['logo_url'] = request.build_absolute_uri(settings.STATIC_URL + 'images/logo.png')
     context['user'] = request.user
 
-    html_string = render_to_string(template_path, context)
+    with track_render('report', template=template_path, institute_id=getattr(request.user, 'institute_id', None)):
+        with render_stage('render'):
+            html_string = render_to_string(template_path, context)
 
-    # تحويل لـ PDF
-    html = HTML(string=html_string, base_url=request.build_absolute_uri('/'))
-    pdf = html.write_pdf()
+        # تحويل لـ PDF
+        # الموارد (اللوجو وملفات static) بتتقري من الديسك مباشرة مش عبر HTTP (core.url_fetcher)
+        html = HTML(string=html_string, base_url=request.build_absolute_uri('/'), url_fetcher=local_url_fetcher)
+        with render_stage('layout'):
+            document = html.render()
+        with render_stage('write'):
+            pdf = document.write_pdf()
+        note(pages=len(document.pages), size=len(pdf))
 
     response = HttpResponse(pdf, content_type='application/pdf')
     response['Content-Disposition'] = f'inline; filename="{filename}.pdf"'
-    return response
\ No newline at end of file
+    return response
+
+
+# ==================== Conditional GET / Range ====================
+
+def mark_private_cacheable(response):
+    """
+    يستثني الرد من no-store اللي core.middleware.AuthenticationMiddleware بيحطه على كل الصفحات
+    المحمية: المتصفح يخزن الملف لنفسه بس (private) ولازم يسأل السيرفر قبل كل استخدام (no-cache)،
+    فالفتح التاني بيرجع 304 من غير تحميل ولا رسم.
+    """
+    response['Cache-Control'] = 'private, no-cache'
+    response.private_cache = True
+    return response
+
+
+def _set_validators(response, etag, last_modified):
+    if etag:
+        response['ETag'] = quote_etag(etag)
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return mark_private_cacheable(response)
+
+
+def conditional_not_modified(request, etag, last_modified):
+    """
+    يرجع 304 (أو 412 لـ If-Match) لو نسخة العميل لسه مطابقة لـ ETag / Last-Modified، وإلا None.
+    بيتنادى قبل أي قراءة أو رسم للملف.
+    """
+    headers = _set_validators(HttpResponse(), etag, last_modified)
+    response = get_conditional_response(
+        request,
+        etag=quote_etag(etag) if etag else None,
+        last_modified=int(last_modified.timestamp()) if last_modified else None,
+        response=headers,
+    )
+    if response is headers:
+        return None
+    response.private_cache = True
+    return response
+
+
+def _parse_range(range_header, size):
+    """
+    (start, end) لـ Range واحد صالح، أو None لو برا حجم الملف (416)، أو False لو الهيدر مش
+    مفهوم أو فيه أكتر من range (وقتها بنرجع الملف كامل - مسموح في HTTP)
+    """
+    match = _RANGE_RE.match(range_header.replace(' ', ''))
+    if not match or not any(match.groups()):
+        return False
+
+    start, end = match.groups()
+    if not start:
+        # bytes=-500 : آخر 500 byte
+        length = int(end)
+        if not length:
+            return None
+        return max(size - length, 0), size - 1
+
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        return None
+    return start, end
+
+
+def _if_range_passes(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if etag and if_range == quote_etag(etag):
+        return True
+    if_range_date = parse_http_date_safe(if_range)
+    return bool(last_modified and if_range_date and if_range_date == int(last_modified.timestamp()))
+
+
+def file_bytes_response(request, data, content_type, etag=None, last_modified=None,
+                        filename=None, as_attachment=False):
+    """
+    رد لملف جاهز في الذاكرة مع ETag / Last-Modified و Range (206 / 416) - للملفات المخزنة
+    زي PDF الأذونات، عشان المتصفح يقدر يكمل تحميل أو يجيب أجزاء من غير ما ينزل الملف كله
+    """
+    size = len(data)
+    byte_range = False
+    if request.META.get('HTTP_RANGE') and _if_range_passes(request, etag, last_modified):
+        byte_range = _parse_range(request.META['HTTP_RANGE'], size)
+
+    if byte_range is None:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+    elif byte_range:
+        start, end = byte_range
+        response = HttpResponse(data[start:end + 1], content_type=content_type, status=206)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    else:
+        response = HttpResponse(data, content_type=content_type)
+
+    response['Accept-Ranges'] = 'bytes'
+    if filename:
+        disposition = 'attachment' if as_attachment else 'inline'
+        response['Content-Disposition'] = f'{disposition}; filename="{filename}"'
+    return _set_validators(response, etag, last_modified)
+
+
+def x_accel_redirect_response(field_file, content_type, etag=None, last_modified=None,
+                              filename=None, as_attachment=False):
+    """
+    رد فاضي بهيدر X-Accel-Redirect لملف مخزن في MEDIA_ROOT: Django بيخلص التحقق من الصلاحيات
+    ونginx بيبعت الملف نفسه من الـ location الداخلي (MEDIA_X_ACCEL_PREFIX في nginx.conf)، فالـ
+    worker ميفضلش مربوط بالعميل طول التحميل. Range والـ 304 بيتعملوا في nginx.
+    """
+    response = HttpResponse(content_type=content_type)
+    response['X-Accel-Redirect'] = settings.MEDIA_X_ACCEL_PREFIX + quote(field_file.name)
+    if filename:
+        disposition = 'attachment' if as_attachment else 'inline'
+        response['Content-Disposition'] = f'{disposition}; filename="{filename}"'
+    return _set_validators(response, etag, last_modified)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 import os
+import sys
 from pathlib import Path
 from decouple import config, Csv
 
@@ -26,6 +27,9 @@ SECRET_KEY = config('SECRET_KEY', default='django-insecure-(-1f+&xi^w^ru+rq3acl*
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = config('DEBUG', default=False, cast=bool)
 
+# python manage.py test
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+
 # settings.py
 
 ALLOWED_HOSTS = config('ALLOWED_HOSTS', default='localhost,127.0.0.1', cast=Csv())
@@ -105,6 +109,18 @@ else:
     }
 
 
+# Cache
+# الافتراضي LocMem (كل process لوحده). لكاش مشترك بين الـ workers (معاينة القوالب) ينفع Redis/Memcached
+# بـ CACHE_BACKEND و CACHE_LOCATION، أو DatabaseCache بعد python manage.py createcachetable.
+# كاش البورتال (portal.catalog) مش معتمد على ده - بيتلغي في كل الـ workers بملفات PORTAL_CATALOG_STAMP_DIR
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -258,6 +274,71 @@ FILE_UPLOAD_MAX_MEMORY_SIZE = 5242880  # 5 MB
 
 # Pagination Settings
 PAGINATE_BY = 20
+
+# PDF Rendering Settings
+# عدد قوالب المعاهد المترجمة (django Template) المحفوظة في ذاكرة كل worker
+PDF_TEMPLATE_CACHE_SIZE = config('PDF_TEMPLATE_CACHE_SIZE', default=64, cast=int)
+# أقصى حجم (bytes) لكاش الخطوط والصور المضمّنة Base64 في ذاكرة كل worker
+PDF_ASSET_CACHE_MAX_BYTES = config('PDF_ASSET_CACHE_MAX_BYTES', default=64 * 1024 * 1024, cast=int)
+# Pool عمليات الرسم المنفصلة (core.render_pool) - 0 = الرسم في نفس الـ process. الـ pool بيتعمل في كل
+# worker من gunicorn، فعدد عمليات الرسم = workers × PDF_RENDER_POOL_SIZE (كل واحدة فيها django وممكن توصل
+# لـ PDF_RENDER_MAX_RSS_MB). الافتراضي 1 لكل worker على السيرفر (Docker و systemd)، و 0 في التطوير
+# والاختبارات (عمليات الرسم مبتشوفش transaction الاختبار)
+PDF_RENDER_POOL_SIZE = config('PDF_RENDER_POOL_SIZE', default=0 if DEBUG or TESTING else 1, cast=int)
+PDF_RENDER_TIMEOUT = config('PDF_RENDER_TIMEOUT', default=30, cast=int)
+PDF_RENDER_QUEUE_TIMEOUT = config('PDF_RENDER_QUEUE_TIMEOUT', default=5, cast=int)
+PDF_RENDER_MAX_JOBS = config('PDF_RENDER_MAX_JOBS', default=200, cast=int)
+PDF_RENDER_MAX_RSS_MB = config('PDF_RENDER_MAX_RSS_MB', default=512, cast=int)
+# رسم الـ PDF في الخلفية بمجرد إصدار الإذن (permissions.prerender)
+PDF_PRERENDER_ON_ISSUE = config('PDF_PRERENDER_ON_ISSUE', default=True, cast=bool)
+PDF_PRERENDER_THREADS = config('PDF_PRERENDER_THREADS', default=2, cast=int)
+# الطباعة المجمعة (permissions.batch): عدد الأذونات في كل مستند/مجموعة، وأقصى عدد في ملف PDF واحد
+PDF_BATCH_CHUNK_SIZE = config('PDF_BATCH_CHUNK_SIZE', default=20, cast=int)
+PDF_BATCH_MAX_PDF_SLIPS = config('PDF_BATCH_MAX_PDF_SLIPS', default=200, cast=int)
+# نسخ صور المعهد المجهزة للطباعة (core.images): دقة الطباعة وجودة JPEG
+PDF_IMAGE_DPI = config('PDF_IMAGE_DPI', default=150, cast=int)
+PDF_IMAGE_JPEG_QUALITY = config('PDF_IMAGE_JPEG_QUALITY', default=85, cast=int)
+# معاينة القالب أثناء التعديل (permissions.preview): مدة بقاء المعاينة في الكاش (ثانية)
+PDF_PREVIEW_CACHE_TIMEOUT = config('PDF_PREVIEW_CACHE_TIMEOUT', default=600, cast=int)
+# حماية تكلفة الرسم عند حفظ القالب (permissions.render_guard): رسم تجريبي في process منفصل بمهلة
+# وحد ذاكرة، والحفظ بيترفض لو القالب عدّى أي حد من الحدود. المهلة بتغطي رسمة التسخين والرسمة
+# المقاسة مع بعض، وحد الوقت (MAX_RENDER_MS) على الرسمة المقاسة بس
+PDF_TEMPLATE_GUARD_ENABLED = config('PDF_TEMPLATE_GUARD_ENABLED', default=True, cast=bool)
+PDF_TEMPLATE_GUARD_SANDBOX = config('PDF_TEMPLATE_GUARD_SANDBOX', default=True, cast=bool)
+PDF_TEMPLATE_GUARD_TIMEOUT = config('PDF_TEMPLATE_GUARD_TIMEOUT', default=20, cast=int)
+PDF_TEMPLATE_GUARD_MEMORY_MB = config('PDF_TEMPLATE_GUARD_MEMORY_MB', default=1024, cast=int)
+PDF_TEMPLATE_MAX_RENDER_MS = config('PDF_TEMPLATE_MAX_RENDER_MS', default=3000, cast=int)
+PDF_TEMPLATE_MAX_PAGES = config('PDF_TEMPLATE_MAX_PAGES', default=3, cast=int)
+PDF_TEMPLATE_MAX_BYTES = config('PDF_TEMPLATE_MAX_BYTES', default=2 * 1024 * 1024, cast=int)
+# وضع الطبقات (permissions.overlay): عدد الطبقات الثابتة (قوالب) المحفوظة في ذاكرة كل thread
+PDF_OVERLAY_CACHE_SIZE = config('PDF_OVERLAY_CACHE_SIZE', default=8, cast=int)
+# تقارير PDF الجدولية (core.reports): عدد الصفوف اللي بتتقري من قاعدة البيانات وتترسم في كل دفعة
+PDF_REPORT_CHUNK_SIZE = config('PDF_REPORT_CHUNK_SIZE', default=500, cast=int)
+# الطلبات المتزامنة لنفس الإذن (core.singleflight): أقصى انتظار (ثانية) لرسمة شغالة قبل ما الطلب يرسم
+# بنفسه، ومجلد ملفات القفل المشترك بين الـ workers (فاضي = مجلد مؤقت في /tmp)
+PDF_SINGLE_FLIGHT_TIMEOUT = config('PDF_SINGLE_FLIGHT_TIMEOUT', default=30, cast=int)
+PDF_RENDER_LOCK_DIR = config('PDF_RENDER_LOCK_DIR', default='')
+# إرسال ملفات PDF المخزنة عن طريق nginx (X-Accel-Redirect) بعد التحقق من الصلاحيات في Django.
+# يتفعل بس ورا nginx.conf (location داخلي بنفس الـ prefix)؛ من غيره Django بيبعت الملف بنفسه
+MEDIA_X_ACCEL_REDIRECT = config('MEDIA_X_ACCEL_REDIRECT', default=False, cast=bool)
+MEDIA_X_ACCEL_PREFIX = config('MEDIA_X_ACCEL_PREFIX', default='/protected-media/')
+# صلاحية رابط PDF المشهد في صفحة التأكيد بعد الإصدار من البورتال (ثانية)
+PORTAL_SLIP_LINK_MAX_AGE = config('PORTAL_SLIP_LINK_MAX_AGE', default=7 * 24 * 3600, cast=int)
+# مفاتيح idempotency للإصدار والتسجيل من البورتال (portal.idempotency): مدة تخزين أول رد ناجح (ثانية)
+PORTAL_IDEMPOTENCY_TTL = config('PORTAL_IDEMPOTENCY_TTL', default=24 * 3600, cast=int)
+# كاش الفروع والبرامج وأكواد الإحالة في البورتال (portal.catalog): في ذاكرة كل worker، وبيتلغي في
+# الكل بملف ختم نسخة في STAMP_DIR (لازم مشترك بين الـ workers، فاضي = مجلد في /tmp) مع أي تعديل.
+# المدة دي حد أقصى لعمره (تعديلات queryset.update() اللي مبتبعتش إشارات)
+PORTAL_CATALOG_CACHE_TIMEOUT = config('PORTAL_CATALOG_CACHE_TIMEOUT', default=300, cast=int)
+PORTAL_CATALOG_STAMP_DIR = config('PORTAL_CATALOG_STAMP_DIR', default='')
+# قياسات كل رسمة PDF (core.telemetry): بتتكتب في PDFRenderRecord على دفعات بعد commit الطلب،
+# والأقدم من RETENTION_DAYS بيتمسح بأمر purge_render_records (cron)
+PDF_TELEMETRY_ENABLED = config('PDF_TELEMETRY_ENABLED', default=True, cast=bool)
+PDF_TELEMETRY_BATCH_SIZE = config('PDF_TELEMETRY_BATCH_SIZE', default=50, cast=int)
+PDF_TELEMETRY_FLUSH_INTERVAL = config('PDF_TELEMETRY_FLUSH_INTERVAL', default=30, cast=int)
+PDF_TELEMETRY_RETENTION_DAYS = config('PDF_TELEMETRY_RETENTION_DAYS', default=30, cast=int)
+# أرقام الأذونات (permissions.numbering): عدد الأرقام اللي كل process بيحجزها من عداد السنة مرة واحدة
+PERMISSION_NUMBER_BLOCK_SIZE = config('PERMISSION_NUMBER_BLOCK_SIZE', default=50, cast=int)
 import warnings
 import logging
 # Default Auto Field
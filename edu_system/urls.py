@@ -9,6 +9,8 @@ from django.shortcuts import render
 from django.http import JsonResponse
 from django.db import connection
 
+from portal.catalog import catalog_stats
+
 
 def health_check(request):
     """Health check endpoint for Docker and monitoring."""
@@ -20,6 +22,8 @@ def health_check(request):
         return JsonResponse({
             'status': 'healthy',
             'database': 'connected',
+            # نسبة الإصابة في كاش البورتال للـ worker اللي رد (portal.catalog)
+            'portal_cache': catalog_stats(),
         }, status=200)
     except Exception as e:
         return JsonResponse({
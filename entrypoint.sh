@@ -20,6 +20,9 @@ echo "=========================================="
 echo "Applying database migrations..."
 python manage.py migrate --noinput
 
+# Cache table (only does something when CACHE_BACKEND is DatabaseCache)
+python manage.py createcachetable
+
 # Collect static files
 echo "Collecting static files..."
 python manage.py collectstatic --noinput --clear
@@ -13,6 +13,7 @@ urlpatterns = [
     # PDF Template
     path('<int:pk>/template/', views.PDFTemplateView.as_view(), name='pdf_template'),
     path('<int:pk>/template/edit/', views.PDFTemplateEditView.as_view(), name='pdf_template_edit'),
+    path('<int:pk>/template/preview/', views.PDFTemplatePreviewRenderView.as_view(), name='pdf_template_preview_render'),
     path('upload_data/', views.upload_data, name='upload_data'),
     path('export_excel/', views.export_excel, name='export_excel'),
     path('export_pdf/', views.export_institutes_pdf, name='export_pdf'),
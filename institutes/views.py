@@ -2,8 +2,9 @@ from django.http import HttpResponse
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView, View
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.urls import reverse_lazy
-from django.db.models import Q
-from django.shortcuts import redirect, render
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Q
+from django.shortcuts import get_object_or_404, redirect, render
 from django.contrib import messages
 import pandas as pd
 import logging
@@ -12,9 +13,13 @@ from core.mixins import (
     AdminRequiredMixin, InstituteScopedMixin, InstituteScopedDetailMixin,
     SearchMixin, FilterMixin, SoftDeleteMixin
 )
-from core.utils import get_pdf_response
+from core.render_pool import RenderPoolBusy, busy_response
+from core.reports import ReportColumn, TabularReport
 from core.pdf_presets import PDF_PRESETS
 from permissions.models import PermissionTemplate
+from permissions.preview import PreviewSuperseded, draft_from_data, get_template_preview
+from permissions.overlay import warn_overlay_unsupported
+from permissions.render_guard import check_template_render_cost
 from .models import Institute
 
 logger = logging.getLogger('edu_system')
@@ -174,14 +179,11 @@ class PDFTemplateEditView(AdminRequiredMixin, UpdateView):
     def post(self, request, *args, **kwargs):
         institute = self.get_object()
         
-        template, created = PermissionTemplate.objects.get_or_create(
-            institute=institute,
-            defaults={
-                'header_content': '',
-                'body_content': '',
-                'footer_content': ''
-            }
-        )
+        # القالب الجديد مش بيتحفظ غير بعد ما يعدّي حماية تكلفة الرسم
+        try:
+            template = institute.permission_template
+        except PermissionTemplate.DoesNotExist:
+            template = PermissionTemplate(institute=institute)
         
         template.header_content = request.POST.get('header_content', '')
         template.body_content = request.POST.get('body_content', '')
@@ -189,13 +191,64 @@ class PDFTemplateEditView(AdminRequiredMixin, UpdateView):
         template.custom_css = request.POST.get('custom_css', '')
         template.page_size = request.POST.get('page_size', 'A4')
         template.orientation = request.POST.get('orientation', 'portrait')
+        if request.POST.get('output_profile') in PermissionTemplate.OutputProfile.values:
+            template.output_profile = request.POST['output_profile']
+        if request.POST.get('render_mode') in PermissionTemplate.RenderMode.values:
+            template.render_mode = request.POST['render_mode']
+
+        try:
+            check_template_render_cost(template)
+        except ValidationError as e:
+            for error in e.messages:
+                messages.error(request, error)
+            # نرجع الفورم بالمسودة اللي اترفضت (مش محفوظة) عشان التعديلات ماتضيعش
+            self.object = institute
+            context = self.get_context_data()
+            context['template'] = template
+            return self.render_to_response(context)
+
         template.save()
         
         logger.info(f'PDF template for {institute.name} updated by {request.user.username}')
         messages.success(request, 'تم تحديث قالب PDF بنجاح')
+        warn_overlay_unsupported(request, template)
         return redirect('institutes:pdf_template', pk=institute.pk)
 
 
+class PDFTemplatePreviewRenderView(AdminRequiredMixin, View):
+    """معاينة PDF لمسودة القالب (محتوى الفورم الحالي) على إذن تجريبي - من غير حفظ"""
+
+    def post(self, request, pk):
+        institute = get_object_or_404(Institute, pk=pk)
+        try:
+            template_obj = institute.permission_template
+        except PermissionTemplate.DoesNotExist:
+            template_obj = None
+
+        draft = draft_from_data(request.POST, template_obj)
+        first_page = request.POST.get('first_page') in ('1', 'true', 'on')
+        try:
+            seq = int(request.POST.get('seq', 0))
+        except ValueError:
+            seq = 0
+
+        try:
+            pdf_bytes, cached = get_template_preview(institute, draft, request.user, seq=seq, first_page=first_page)
+        except PreviewSuperseded:
+            return HttpResponse('تم استبدال طلب المعاينة بطلب أحدث', status=409)
+        except RenderPoolBusy as e:
+            logger.warning(f'Template preview busy for institute {institute.pk}: {e}')
+            return busy_response(e)
+        except Exception as e:
+            logger.warning(f'Template preview failed for institute {institute.pk}: {e}')
+            return HttpResponse(f'خطأ في القالب: {e}', status=400, content_type='text/plain; charset=utf-8')
+
+        response = HttpResponse(pdf_bytes, content_type='application/pdf')
+        response['Content-Disposition'] = 'inline; filename="preview.pdf"'
+        response['X-Preview-Cache'] = 'hit' if cached else 'miss'
+        return response
+
+
 # ==================== Import/Export Views ====================
 
 def upload_data(request):
@@ -258,13 +311,18 @@ def export_excel(request):
 
 def export_institutes_pdf(request):
     """تصدير المعاهد لـ PDF"""
-    institutes = Institute.objects.all()
-    return get_pdf_response(
-        request,
-        'institutes/institutes_pdf_template.html',
-        {'institutes': institutes, 'title': 'تقرير المعاهد المسجلة'},
-        'institutes_report'
+    report = TabularReport(
+        'تقرير المعاهد المسجلة',
+        [
+            ReportColumn('اسم المعهد', 'name', width=3, align='RIGHT'),
+            ReportColumn('العنوان', 'address', width=3, align='RIGHT'),
+            ReportColumn('رقم الهاتف', 'phone', width=1.5),
+            ReportColumn('عدد البرامج', 'programs_count'),
+        ],
+        Institute.objects.annotate(programs_count=Count('diplomas')),
+        user=request.user, color='#8e44ad',
     )
+    return report.response('institutes_report')
 
 
 # ==================== Generate Templates for All Institutes ====================
@@ -282,9 +340,14 @@ class GenerateTemplatesView(AdminRequiredMixin, View):
             'presets': PDF_PRESETS,
         })
     
+    preset_fields = ('header_content', 'body_content', 'footer_content', 'custom_css', 'page_size', 'orientation')
+    
     def post(self, request):
         created_count = 0
         updated_count = 0
+        # نفس الـ preset بيتقاس (حماية تكلفة الرسم) مرة واحدة بس للدفعة كلها
+        preset_metrics = {}
+        preset_errors = {}
         
         for key, preset_key in request.POST.items():
             if not key.startswith('preset_'):
@@ -293,22 +356,30 @@ class GenerateTemplatesView(AdminRequiredMixin, View):
             institute_id = key.replace('preset_', '')
             preset = PDF_PRESETS.get(preset_key)
             
-            if not preset:
+            if not preset or preset_key in preset_errors:
                 continue
             
             try:
                 institute = Institute.objects.get(id=institute_id)
-                template, created = PermissionTemplate.objects.update_or_create(
-                    institute=institute,
-                    defaults={
-                        'header_content': preset['header_content'],
-                        'body_content': preset['body_content'],
-                        'footer_content': preset['footer_content'],
-                        'custom_css': preset['custom_css'],
-                        'page_size': preset['page_size'],
-                        'orientation': preset['orientation'],
-                    }
-                )
+                try:
+                    template = institute.permission_template
+                    created = False
+                except PermissionTemplate.DoesNotExist:
+                    template = PermissionTemplate(institute=institute)
+                    created = True
+                for field in self.preset_fields:
+                    setattr(template, field, preset[field])
+                
+                try:
+                    preset_metrics[preset_key] = check_template_render_cost(
+                        template, metrics=preset_metrics.get(preset_key)
+                    )
+                except ValidationError as e:
+                    preset_errors[preset_key] = e
+                    messages.error(request, f'القالب {preset_key} اترفض: {" - ".join(e.messages)}')
+                    continue
+                template.save()
+                
                 if created:
                     created_count += 1
                 else:
@@ -38,7 +38,7 @@ class PermissionSlipAdmin(admin.ModelAdmin):
             'fields': ('issue_date', 'expiry_date')
         }),
         (_('Files'), {
-            'fields': ('pdf_file',),
+            'fields': ('pdf_file', 'pdf_cache_key', 'pdf_size'),
             'classes': ('collapse',)
         }),
         (_('Notes'), {
@@ -47,7 +47,7 @@ class PermissionSlipAdmin(admin.ModelAdmin):
         }),
     )
     
-    readonly_fields = ['permission_number', 'issue_date', 'program_type']
+    readonly_fields = ['permission_number', 'issue_date', 'program_type', 'pdf_cache_key', 'pdf_size']
     
     def get_program(self, obj):
         return obj.get_program()
@@ -56,9 +56,10 @@ class PermissionSlipAdmin(admin.ModelAdmin):
 
 @admin.register(PermissionTemplate)
 class PermissionTemplateAdmin(admin.ModelAdmin):
-    list_display = ['institute', 'font_family', 'page_size', 'orientation', 'created_at']
-    list_filter = ['font_family', 'page_size', 'orientation']
+    list_display = ['institute', 'font_family', 'page_size', 'orientation', 'render_time_ms', 'render_pages', 'created_at']
+    list_filter = ['font_family', 'output_profile', 'render_mode', 'page_size', 'orientation']
     search_fields = ['institute__name']
+    readonly_fields = ['render_time_ms', 'render_pages', 'render_size', 'render_checked_at']
 
     fieldsets = (
         (_('Institute'), {
@@ -68,9 +69,12 @@ class PermissionTemplateAdmin(admin.ModelAdmin):
             'fields': ('header_content', 'body_content', 'footer_content')
         }),
         (_('Styling'), {
-            'fields': ('font_family', 'custom_css', 'page_size', 'orientation'),
+            'fields': ('font_family', 'output_profile', 'render_mode', 'custom_css', 'page_size', 'orientation'),
             'classes': ('collapse',)
         }),
+        (_('Render Cost'), {
+            'fields': ('render_time_ms', 'render_pages', 'render_size', 'render_checked_at'),
+        }),
     )
 
     class Media:
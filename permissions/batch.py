@@ -0,0 +1,155 @@
+"""
+الطباعة المجمعة: أذونات كتير في ملف واحد بدل طلب ورسم منفصل لكل إذن
+
+الصيغتين بيدمجوا (pypdf) ملف كل إذن من get_permission_pdf: المخزن على الديسك (permissions.pdf_cache)
+لو لسه صالح، وإلا بيترسم (في pool العمليات المنفصلة لو مفعّل) ويتخزن - فطباعة نفس الأذونات تاني
+مبترسمش حاجة، والصور والخطوط المتكررة (لوجو/خلفية/ختم نفس المعهد) بتتكتب مرة واحدة في كل ملف مدموج.
+
+- pdf: مستند واحد متعدد الصفحات. بيتبني كله في ملف مؤقت (build_batch_pdf) قبل ما الرد يبدأ، فأي
+  خطأ (الـ pool مشغول، رسم عدّى المهلة) بيرجع 503/500 بدل ملف مقطوع بعد هيدرز 200. الذاكرة فيها
+  bytes الملفات مش صفحات WeasyPrint بعد الـ layout، والعدد محدود بـ PDF_BATCH_MAX_PDF_SLIPS.
+- zip: بيتبعت للعميل أول بأول (streaming). كل مجموعة (PDF_BATCH_CHUNK_SIZE إذن) بتبقى مستند PDF
+  مدموج واحد جوه الـ ZIP، فالذاكرة ثابتة مهما كان عدد الأذونات، والمجموعة اللي فشلت بتتسجل في
+  errors.txt.
+"""
+import logging
+import tempfile
+import zipfile
+from io import BytesIO
+
+from django.conf import settings
+from pypdf import PdfReader, PdfWriter
+
+from .pdf_cache import get_permission_pdf
+
+logger = logging.getLogger('edu_system')
+
+BATCH_FORMATS = ('pdf', 'zip')
+
+STREAM_BLOCK_SIZE = 64 * 1024
+# الملف المدموج بيفضل في الذاكرة لحد الحجم ده وبعدها بيتنقل لملف على الديسك
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+BATCH_SELECT_RELATED = (
+    'client', 'institute', 'institute__registration_officer', 'issued_by', 'diploma', 'course'
+)
+
+
+def iter_chunks(queryset, chunk_size):
+    """يقسم الأذونات لمجموعات من غير ما يحمّل الـ queryset كله في الذاكرة"""
+    chunk = []
+    for permission in queryset.iterator(chunk_size=max(chunk_size, 100)):
+        chunk.append(permission)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def merge_permission_pdfs(permissions, target, pool=None):
+    """
+    يدمج ملفات الأذونات بالترتيب في target (file object) ويرجع عددهم - مبيكتبش حاجة لو مفيش.
+    get_permission_pdf ممكن يرمي RenderPoolBusy / RenderTimeout.
+    """
+    writer = PdfWriter()
+    count = 0
+    for permission in permissions:
+        writer.append(PdfReader(BytesIO(get_permission_pdf(permission, pool=pool))))
+        count += 1
+    if count:
+        writer.compress_identical_objects()
+        writer.write(target)
+    return count
+
+
+def build_batch_pdf(queryset, chunk_size=None, pool=None):
+    """
+    مستند PDF واحد لكل الأذونات (المفروض عددهم اتراجع قبلها مع PDF_BATCH_MAX_PDF_SLIPS) في ملف
+    مؤقت على أوله، أو None لو مفيش أذونات. أي خطأ بيترمي من هنا قبل أي رد.
+    """
+    chunk_size = chunk_size or settings.PDF_BATCH_CHUNK_SIZE
+    permissions = (permission for chunk in iter_chunks(queryset, chunk_size) for permission in chunk)
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    try:
+        count = merge_permission_pdfs(permissions, output, pool=pool)
+    except Exception:
+        output.close()
+        raise
+    if not count:
+        output.close()
+        return None
+    output.seek(0)
+    return output
+
+
+def iter_file(output):
+    """يقرا الملف على أجزاء ويقفله في الآخر"""
+    try:
+        while True:
+            block = output.read(STREAM_BLOCK_SIZE)
+            if not block:
+                break
+            yield block
+    finally:
+        output.close()
+
+
+def stream_batch_pdf(queryset, chunk_size=None, pool=None):
+    """build_batch_pdf على أجزاء (لأمر print_permissions)"""
+    output = build_batch_pdf(queryset, chunk_size=chunk_size, pool=pool)
+    if output is not None:
+        yield from iter_file(output)
+
+
+class _ZipStream:
+    """ملف للكتابة فقط: zipfile بيكتب فيه والـ generator بياخد اللي اتكتب أول بأول"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._offset = 0
+
+    def write(self, data):
+        self._buffer += data
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def stream_batch_zip(queryset, chunk_size=None, pool=None):
+    """
+    ZIP فيه مستند PDF مدموج لكل مجموعة أذونات، بيتبعت مجموعة بمجموعة.
+    لو مجموعة فشلت (الـ pool مشغول أو خطأ في الرسم) الملف بيكمل عادي، والمجموعات اللي فشلت
+    بتتسجل في errors.txt جوه الـ ZIP بدل ما التحميل كله يبوظ في النص.
+    """
+    chunk_size = chunk_size or settings.PDF_BATCH_CHUNK_SIZE
+    stream = _ZipStream()
+    errors = []
+
+    # الـ PDF مضغوط أصلاً، فمفيش فايدة من ضغط تاني غير استهلاك CPU
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for index, chunk in enumerate(iter_chunks(queryset, chunk_size), start=1):
+            name = f'{index:04d}_{chunk[0].permission_number}_{chunk[-1].permission_number}.pdf'
+            try:
+                merged = BytesIO()
+                merge_permission_pdfs(chunk, merged, pool=pool)
+                archive.writestr(name, merged.getvalue())
+            except Exception as e:
+                logger.error(f'Batch PDF chunk {name} failed: {e}')
+                errors.append(f'{name}: ' + ', '.join(p.permission_number for p in chunk))
+            yield stream.pop()
+
+        if errors:
+            archive.writestr('errors.txt', '\n'.join(errors))
+
+    yield stream.pop()
@@ -0,0 +1,155 @@
+"""
+فهرس الأهلية للإصدار (ActivePermissionIndex): صف لكل (عميل، معهد) عنده إذن نشط
+
+قرار الإصدار (ممنوع بسبب إذن في معهد تاني / عنده مشهد في نفس الفرع / متاح) بقى استعلام واحد
+على الفهرس بالعميل بدل استعلامين على جدول الأذونات. الفهرس بيتحدث في نفس الـ transaction مع
+حفظ الإذن (PermissionSlip.save: الإصدار، الإلغاء، الانتهاء، الحذف الناعم) ومع حذفه
+(permissions.signals). أمر rebuild_eligibility_index بيقارن الفهرس بجدول الأذونات ويصلحه.
+
+issue_permission: الفحص والحفظ قسم حرج واحد مقفول على العميل، فطلبين متزامنين لنفس الطالب
+(البورتال والموظف مثلاً) مينفعش يعدّوا الفحص الاتنين ويطلعوا إذنين نشطين.
+"""
+from django.db import connection, transaction
+from django.db.models import F
+
+from clients.models import Client
+from .models import ActivePermissionIndex, PermissionSlip
+from .numbering import release_permission_number
+
+
+def _active_permissions():
+    return PermissionSlip.objects.filter(status=PermissionSlip.Status.ACTIVE)
+
+
+def refresh_eligibility(client_id, institute_id):
+    """يحدّث صف (عميل، معهد) من جدول الأذونات: أحدث إذن نشط، أو يمسح الصف لو مفيش"""
+    permission_id = _active_permissions().filter(
+        client_id=client_id, institute_id=institute_id
+    ).order_by('-created_at', '-pk').values_list('pk', flat=True).first()
+
+    if permission_id is None:
+        ActivePermissionIndex.objects.filter(client_id=client_id, institute_id=institute_id).delete()
+    else:
+        ActivePermissionIndex.objects.update_or_create(
+            client_id=client_id, institute_id=institute_id, defaults={'permission_id': permission_id}
+        )
+
+
+def sync_permission_eligibility(permission):
+    """يحدّث الفهرس بعد حفظ أو حذف إذن - بما فيه الصف القديم لو الإذن اتنقل لعميل أو معهد تاني"""
+    current = (permission.client_id, permission.institute_id)
+
+    with transaction.atomic():
+        previous = set(
+            ActivePermissionIndex.objects.filter(permission_id=permission.pk).values_list('client_id', 'institute_id')
+        )
+        previous.discard(current)
+        # الصف القديم الأول عشان الإذن يتساب منه قبل ما يتسجل في الصف الجديد (OneToOne)
+        for client_id, institute_id in previous:
+            refresh_eligibility(client_id, institute_id)
+        refresh_eligibility(*current)
+
+
+def find_active_permissions(client, target_institute_id):
+    """
+    (blocking, existing) للعميل من الفهرس في استعلام واحد:
+    - blocking: أحدث إذن نشط في معهد غير المستهدف (بيمنع الإصدار)
+    - existing: الإذن النشط في نفس المعهد المستهدف
+    """
+    rows = ActivePermissionIndex.objects.filter(client=client).select_related(
+        'permission__institute', 'permission__issued_by', 'permission__referral_employee'
+    ).order_by('-permission__created_at')
+
+    blocking = existing = None
+    for row in rows:
+        if str(row.institute_id) == str(target_institute_id):
+            existing = row.permission
+        elif blocking is None:
+            blocking = row.permission
+    return blocking, existing
+
+
+def lock_client(client_id):
+    """
+    قفل العميل لحد نهاية الـ transaction الحالية: SELECT ... FOR UPDATE على صف العميل (Postgres).
+    SQLite مفيهاش قفل صفوف، فبنكتب على صف العميل كتابة مبتغيرش حاجة عشان الـ transaction تاخد قفل
+    الكتابة من أولها - وأي إصدار تاني بيستنى (busy timeout) لحد الـ commit.
+    """
+    if connection.features.has_select_for_update:
+        list(Client.all_objects.select_for_update().filter(pk=client_id).values_list('pk', flat=True))
+    else:
+        Client.all_objects.filter(pk=client_id).update(is_deleted=F('is_deleted'))
+
+
+def issue_permission(permission, lock=True):
+    """
+    يفحص أهلية العميل ويحفظ الإذن جوه قسم حرج مقفول على العميل، ويرجع (blocking, existing).
+    لو أي واحد فيهم موجود الإذن مبيتحفظش. القفل بيتساب مع الـ commit - قبل أي رسم للـ PDF
+    (schedule_permission_pdf بيشتغل بعد الـ commit). lock=False للمقارنة في bench_issuance بس.
+    """
+    allocated = not permission.permission_number
+    if allocated:
+        # الرقم من دفعة الـ process قبل الـ transaction (permissions.numbering) - مش جوه القفل،
+        # ولو الإصدار اترفض أو فشل بيرجع للدفعة عشان السلسلة متبقاش فيها فجوات
+        permission.permission_number = permission.generate_permission_number()
+
+    try:
+        with transaction.atomic():
+            if lock:
+                lock_client(permission.client_id)
+            blocking, existing = find_active_permissions(permission.client_id, permission.institute_id)
+            if blocking is None and existing is None:
+                permission.save()
+    except Exception:
+        if allocated:
+            _release_number(permission)
+        raise
+
+    if allocated and (blocking is not None or existing is not None):
+        _release_number(permission)
+    return blocking, existing
+
+
+def _release_number(permission):
+    release_permission_number(permission.permission_number)
+    permission.permission_number = ''
+    permission.pk = None
+
+
+def expected_index():
+    """{(client_id, institute_id): permission_id} محسوبة من جدول الأذونات مباشرة"""
+    expected = {}
+    rows = _active_permissions().order_by('created_at', 'pk').values_list('pk', 'client_id', 'institute_id')
+    for permission_id, client_id, institute_id in rows.iterator():
+        expected[(client_id, institute_id)] = permission_id
+    return expected
+
+
+def verify_index(fix=False):
+    """
+    يقارن الفهرس بجدول الأذونات ويرجع الفروق {'missing', 'stale', 'extra'} (قوايم أزواج).
+    fix=True بيصلح الصفوف الغلط بس من غير ما يعيد بناء الفهرس كله.
+    """
+    expected = expected_index()
+    actual = {
+        (client_id, institute_id): permission_id
+        for client_id, institute_id, permission_id in
+        ActivePermissionIndex.objects.values_list('client_id', 'institute_id', 'permission_id').iterator()
+    }
+
+    diff = {
+        'missing': sorted(pair for pair in expected if pair not in actual),
+        'stale': sorted(pair for pair in expected if pair in actual and actual[pair] != expected[pair]),
+        'extra': sorted(pair for pair in actual if pair not in expected),
+    }
+
+    if fix:
+        with transaction.atomic():
+            for pair in diff['extra'] + diff['stale']:
+                ActivePermissionIndex.objects.filter(client_id=pair[0], institute_id=pair[1]).delete()
+            ActivePermissionIndex.objects.bulk_create([
+                ActivePermissionIndex(client_id=pair[0], institute_id=pair[1], permission_id=expected[pair])
+                for pair in diff['missing'] + diff['stale']
+            ], batch_size=1000)
+
+    return diff
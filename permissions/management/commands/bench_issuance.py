@@ -0,0 +1,138 @@
+"""
+قياس إصدار الأذونات تحت ضغط متزامن، والتأكد إن مفيش طالب بيطلع له إذنين نشطين.
+
+الاستخدام:
+    python manage.py bench_issuance
+    python manage.py bench_issuance --clients 200 --threads 16
+    python manage.py bench_issuance --no-lock
+
+- بيبني بيانات وهمية (فرعين، دبلومة، عملاء) وبيمسحها في الآخر. الـ threads محتاجة تشوف البيانات
+  فمينفعش تتعمل جوه transaction بيترجع زي bench_pdf.
+- لكل عميل كل الـ threads بتحاول تصدر له إذن في نفس اللحظة (barrier)، نصهم من فرع ونصهم من
+  الفرع التاني - زي البورتال وموظف في فرع تاني مع بعض.
+- بيطبع عدد الأذونات اللي اتصدرت/اترفضت/فشلت، والإنتاجية (إصدار في الثانية) وزمن المحاولة p50/p95،
+  ولو أي عميل طلع له أكتر من إذن نشط الأمر بيخرج بخطأ.
+- --no-lock بيشغل نفس الفحص والحفظ من غير قفل العميل - للمقارنة بس (المتوقع يطلع تكرار).
+"""
+import threading
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+from django.db.models import Count
+
+from clients.models import Client
+from institutes.models import Institute
+from permissions.eligibility import issue_permission
+from permissions.models import PermissionSlip
+from programs.models import Diploma
+
+BENCH_CODE = 'BENCH-ISSUE'
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = 'قياس إنتاجية إصدار الأذونات المتزامن والتأكد من عدم تكرار الإذن النشط'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=50, help='عدد العملاء (جولة تزاحم لكل عميل)')
+        parser.add_argument('--threads', type=int, default=8, help='عدد المحاولات المتزامنة لكل عميل')
+        parser.add_argument('--no-lock', action='store_true', help='من غير قفل العميل (للمقارنة)')
+
+    def handle(self, *args, **options):
+        if options['threads'] < 2:
+            raise CommandError('--threads لازم يكون 2 أو أكتر')
+
+        Institute.objects.filter(code__startswith=BENCH_CODE).delete()
+        institutes, diploma, clients = self._build(options['clients'])
+        try:
+            stats = self._run(institutes, diploma, clients, options['threads'], not options['no_lock'])
+            duplicates = (
+                PermissionSlip.objects.filter(client__in=clients, status=PermissionSlip.Status.ACTIVE)
+                .values('client').annotate(active=Count('pk')).filter(active__gt=1).count()
+            )
+        finally:
+            Client.all_objects.filter(pk__in=[client.pk for client in clients]).delete()
+            diploma.delete()
+            Institute.objects.filter(pk__in=[institute.pk for institute in institutes]).delete()
+
+        latencies = stats['latencies']
+        attempts = len(latencies)
+        self.stdout.write(
+            f"{connection.vendor}: {len(clients)} clients x {options['threads']} threads "
+            f"({'no lock' if options['no_lock'] else 'locked'})"
+        )
+        self.stdout.write(
+            f"  issued={stats['issued']} rejected={stats['rejected']} errors={stats['errors']} "
+            f"duplicates={duplicates}"
+        )
+        self.stdout.write(
+            f"  {attempts / stats['elapsed']:.1f} attempts/s, {stats['issued'] / stats['elapsed']:.1f} issued/s, "
+            f"p50={_percentile(latencies, 50):.2f}ms p95={_percentile(latencies, 95):.2f}ms"
+        )
+
+        if duplicates and not options['no_lock']:
+            raise CommandError(f'{duplicates} clients ended up with more than one active permission')
+
+    def _build(self, count):
+        institutes = [
+            Institute.objects.create(
+                name=f'Bench Institute {index}', code=f'{BENCH_CODE}-{index}', license_number=f'{BENCH_CODE}-{index}',
+                address='Bench', city='Bench', region='Bench', phone='0000000000',
+            )
+            for index in range(2)
+        ]
+        diploma = Diploma.objects.create(
+            name='Bench Diploma', code=BENCH_CODE, start_date=date(2026, 1, 1), end_date=date(2027, 1, 1),
+        )
+        diploma.institutes.add(*institutes)
+        clients = Client.objects.bulk_create([
+            Client(
+                first_name='Bench', last_name=str(index), full_name=f'Bench {index}',
+                national_id=f'9{index:09d}', gender='male', birth_date=date(2000, 1, 1),
+                phone='0000000000', institute=institutes[0],
+            )
+            for index in range(count)
+        ])
+        return institutes, diploma, clients
+
+    def _run(self, institutes, diploma, clients, threads, lock):
+        stats = {'issued': 0, 'rejected': 0, 'errors': 0, 'latencies': []}
+        stats_lock = threading.Lock()
+        barrier = threading.Barrier(threads)
+
+        def work(index):
+            institute = institutes[index % 2]
+            try:
+                for client in clients:
+                    permission = PermissionSlip(
+                        client=client, institute=institute, diploma=diploma, expiry_date=diploma.end_date,
+                    )
+                    barrier.wait()
+                    started = time.perf_counter()
+                    try:
+                        blocking, existing = issue_permission(permission, lock=lock)
+                        outcome = 'rejected' if blocking or existing else 'issued'
+                    except DatabaseError:
+                        outcome = 'errors'
+                    elapsed = (time.perf_counter() - started) * 1000
+                    with stats_lock:
+                        stats[outcome] += 1
+                        stats['latencies'].append(elapsed)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=work, args=(index,)) for index in range(threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        stats['elapsed'] = time.perf_counter() - started
+        return stats
@@ -0,0 +1,496 @@
+"""
+قياس أداء رسم ملفات PDF (المشاهد والتقارير) مرحلة بمرحلة - للمقارنة بين الـ commits.
+
+الاستخدام:
+    python manage.py bench_pdf
+    python manage.py bench_pdf --iterations 30 --json bench.json
+    python manage.py bench_pdf --compare bench-main.json --max-regression 15
+    python manage.py bench_pdf --only tvtc --cold
+    python manage.py bench_pdf --only cairo --font-baseline
+
+- بيبني بيانات وهمية (معهد/عميل/دبلومة/إذن + صور) جوه transaction بيترجع (rollback) في الآخر،
+  والصور في MEDIA_ROOT مؤقت بيتمسح، فمفيش أي أثر على قاعدة البيانات أو الملفات.
+- الحالات: كل قالب في core.pdf_presets × كل خط (FontChoice) × مع/من غير خلفية، والقوالب اللي
+  تنفع بوضع الطبقات (permissions.overlay) ومعاها speedup_vs_full (p50 الرسم الكامل لنفس القالب
+  على p50 الطبقات)، والقالب الاحتياطي (generate_default_pdf)، وتقارير
+  core.utils.get_pdf_response وتقرير العملاء بـ core.reports بعدد صفوف كبير (--report-rows).
+- لكل حالة: زمن كل مرحلة (context / compile / render / layout / write) و p50/p95/p99،
+  وحجم الملف الناتج، وأقصى ذاكرة (peak RSS) للـ process لحد نهاية الحالة.
+- --font-baseline بيضيف لكل حالة بخط مضمّن (Cairo) نسخة "inline-fonts" بالطريقة القديمة قبل core.fonts
+  (الخط الكامل Base64 جوه HTML كل إذن و FontConfiguration جديد كل رسمة) - أرقام قبل/بعد في نفس التشغيلة.
+- --cold بيفضي كل الكاشات (القوالب المترجمة، الصور، الخطوط) قبل كل تكرار.
+- --compare بيقارن p50 الإجمالي بملف JSON سابق، ولو أي حالة أبطأ من --max-regression %
+  الأمر بيخرج بخطأ (ينفع في CI).
+"""
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import date
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.test import RequestFactory, override_settings
+from django.utils import timezone
+from weasyprint import HTML
+from weasyprint.text.fonts import FontConfiguration
+
+from clients.models import Client
+from core.assets import asset_cache
+from core.fonts import CUSTOM_FONT_FILES, clear_font_caches, font_path
+from core.reports import ReportColumn, TabularReport
+from core.pdf_presets import PDF_PRESETS
+from core.url_fetcher import local_url_fetcher
+from core.utils import get_pdf_response
+from institutes.models import Institute
+from permissions.models import PermissionSlip, PermissionTemplate
+from permissions.overlay import clear_static_layers, render_overlay_document, unsupported_reason
+from permissions.pdf import (
+    build_default_html, build_permission_context, clear_compiled_templates,
+    get_compiled_template, layout_permission_html, output_render_options, write_document_pdf,
+)
+from programs.models import Diploma
+
+REPORTS = {
+    'clients': 'clients/clients_pdf_template.html',
+}
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _inline_font_layout(html, font_family, render_options):
+    """layout بالطريقة القديمة: @font-face بالخط الكامل جوه HTML الإذن و FontConfiguration جديد كل مرة"""
+    faces = ''.join(
+        f"@font-face {{ font-family: '{font_family.capitalize()}'; font-weight: {weight}; "
+        f"src: url('data:font/ttf;base64,{asset_cache.get_b64(font_path(filename))}'); }}"
+        for weight, filename in CUSTOM_FONT_FILES.get(font_family, [])
+    )
+    html = html.replace('</head>', f'<style>{faces}</style></head>', 1)
+    return HTML(string=html, base_url=settings.BASE_DIR, url_fetcher=local_url_fetcher).render(
+        font_config=FontConfiguration(), **render_options
+    )
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def _summary(values):
+    return {
+        'p50': round(_percentile(values, 50), 3),
+        'p95': round(_percentile(values, 95), 3),
+        'p99': round(_percentile(values, 99), 3),
+        'mean': round(sum(values) / len(values), 3),
+    }
+
+
+def _peak_rss_mb():
+    # ru_maxrss بالـ KB على Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, timeout=5,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+
+def _clear_caches():
+    clear_compiled_templates()
+    asset_cache.clear()
+    clear_font_caches()
+    clear_static_layers()
+
+
+class Command(BaseCommand):
+    help = 'قياس أداء رسم ملفات PDF مرحلة بمرحلة مع نتيجة JSON للمقارنة بين الـ commits'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2, help='تكرارات مبدئية مش بتتحسب')
+        parser.add_argument('--report-rows', type=int, nargs='+', default=[500, 2000],
+                            help='عدد الصفوف في تقارير get_pdf_response')
+        parser.add_argument('--only', help='تشغيل الحالات اللي اسمها فيه النص ده بس')
+        parser.add_argument('--cold', action='store_true', help='تفضية كل الكاشات قبل كل تكرار')
+        parser.add_argument('--font-baseline', action='store_true',
+                            help='قياس الخطوط المضمّنة بالطريقة القديمة كمان (inline-fonts) للمقارنة')
+        parser.add_argument('--json', dest='json_path', help='مسار ملف JSON للنتيجة (أو - للـ stdout)')
+        parser.add_argument('--compare', help='ملف JSON سابق للمقارنة')
+        parser.add_argument('--max-regression', type=float, default=20.0,
+                            help='أقصى نسبة بطء مسموحة في p50 الإجمالي عند --compare')
+
+    # ==================== Synthetic data ====================
+
+    def _image(self, size, color, fmt='PNG'):
+        from PIL import Image
+        from io import BytesIO
+
+        buffer = BytesIO()
+        Image.new('RGB', size, color).save(buffer, fmt)
+        return ContentFile(buffer.getvalue(), name=f'bench.{fmt.lower()}')
+
+    def _build_fixtures(self):
+        User = get_user_model()
+        officer = User.objects.create_user(username='bench-officer', password=None, role=User.Role.EMPLOYEE)
+
+        institutes = {}
+        for with_background in (False, True):
+            suffix = 'bg' if with_background else 'plain'
+            institute = Institute(
+                name=f'معهد القياس {suffix}', code=f'BENCH-{suffix}', license_number=f'BENCH-{suffix}',
+                address='الرياض', city='الرياض', region='الرياض', phone='0500000000',
+                registration_officer=officer,
+            )
+            institute.signature_image.save('sig.png', self._image((400, 160), 'navy'), save=False)
+            institute.stamp_image.save('stamp.png', self._image((300, 300), 'darkred'), save=False)
+            if with_background:
+                institute.background_img.save('bg.jpg', self._image((2480, 3508), 'beige', 'JPEG'), save=False)
+            institute.save()
+            institutes[with_background] = institute
+
+        diploma = Diploma.objects.create(
+            name='دبلوم البرمجة', code='BENCH-DIP',
+            start_date=date(2026, 1, 1), end_date=date(2027, 1, 1),
+        )
+        permissions = {}
+        for with_background, institute in institutes.items():
+            diploma.institutes.add(institute)
+            client = Client.objects.create(
+                first_name='محمد', last_name='عبدالله', national_id=f'10000000{int(with_background)}',
+                gender='male', birth_date='1995-05-05', phone='0500000001', address='الرياض',
+                institute=institute, registered_by=officer,
+            )
+            permissions[with_background] = PermissionSlip.objects.create(
+                client=client, institute=institute, diploma=diploma, issued_by=officer,
+                expiry_date=date(2027, 1, 1),
+            )
+        return institutes, permissions
+
+    def _set_template(self, institute, preset, font, render_mode=PermissionTemplate.RenderMode.FULL):
+        PermissionTemplate.objects.update_or_create(
+            institute=institute,
+            defaults={
+                'font_family': font,
+                'render_mode': render_mode,
+                'header_content': preset['header_content'],
+                'body_content': preset['body_content'],
+                'footer_content': preset['footer_content'],
+                'custom_css': preset['custom_css'],
+                'page_size': preset['page_size'],
+                'orientation': preset['orientation'],
+            },
+        )
+        institute.refresh_from_db()
+
+    # ==================== Scenarios ====================
+
+    def _run(self, name, options, step):
+        """يشغل step (ترجع dict أزمنة المراحل بالـ ms + bytes الناتج) ويلخص النتيجة"""
+        if options['only'] and options['only'] not in name:
+            return None
+
+        for _ in range(options['warmup']):
+            step()
+
+        timings = {}
+        totals = []
+        size = 0
+        for _ in range(options['iterations']):
+            if options['cold']:
+                _clear_caches()
+            stages, data = step()
+            for stage, ms in stages.items():
+                timings.setdefault(stage, []).append(ms)
+            totals.append(sum(stages.values()))
+            size = len(data)
+
+        result = {
+            'name': name,
+            'stages': {stage: _summary(values) for stage, values in timings.items()},
+            'total': _summary(totals),
+            'size_bytes': size,
+            'peak_rss_mb': _peak_rss_mb(),
+        }
+        self.stdout.write(
+            f'{name:<32} p50={result["total"]["p50"]:>8.1f}ms  p95={result["total"]["p95"]:>8.1f}ms  '
+            f'p99={result["total"]["p99"]:>8.1f}ms  size={size // 1024}KB  rss={result["peak_rss_mb"]}MB  '
+            + '  '.join(f'{stage}={values["p50"]:.1f}' for stage, values in result['stages'].items())
+        )
+        return result
+
+    def _permission_step(self, permission_pk, inline_fonts=False):
+        layout = _inline_font_layout if inline_fonts else layout_permission_html
+
+        def step():
+            stages = {}
+            mark = time.perf_counter()
+
+            def lap(stage):
+                nonlocal mark
+                now = time.perf_counter()
+                stages[stage] = (now - mark) * 1000
+                mark = now
+
+            permission = PermissionSlip.objects.select_related(
+                'client', 'institute', 'institute__registration_officer', 'issued_by', 'diploma', 'course'
+            ).get(pk=permission_pk)
+            template_obj = permission.institute.permission_template
+            context = build_permission_context(permission)
+            lap('context')
+            template = get_compiled_template(template_obj)
+            lap('compile')
+            html = template.render(context)
+            lap('render')
+            document = layout(html, template_obj.font_family, output_render_options(template_obj))
+            lap('layout')
+            data = write_document_pdf(document)
+            lap('write')
+            return stages, data
+        return step
+
+    def _overlay_step(self, permission_pk):
+        def step():
+            stages = {}
+            start = time.perf_counter()
+            permission = PermissionSlip.objects.select_related(
+                'client', 'institute', 'institute__registration_officer', 'issued_by', 'diploma', 'course'
+            ).get(pk=permission_pk)
+            template_obj = permission.institute.permission_template
+            stages['context'] = (time.perf_counter() - start) * 1000
+
+            # الطبقة الثابتة بتترسم أول مرة بس (إلا مع --cold)، فالـ layout هنا هو طبقة الحقول المتغيرة
+            start = time.perf_counter()
+            document = render_overlay_document(permission, template_obj)
+            if document is None:
+                raise CommandError(f'القالب {template_obj.pk} مينفعش يترسم بالطبقات')
+            stages['layout'] = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            data = write_document_pdf(document)
+            stages['write'] = (time.perf_counter() - start) * 1000
+            return stages, data
+        return step
+
+    def _default_step(self, permission_pk):
+        def step():
+            stages = {}
+            start = time.perf_counter()
+            permission = PermissionSlip.objects.select_related(
+                'client', 'institute', 'issued_by', 'diploma', 'course'
+            ).get(pk=permission_pk)
+            stages['context'] = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            html = build_default_html(permission)
+            stages['render'] = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            document = HTML(
+                string=html, base_url=settings.BASE_DIR, url_fetcher=local_url_fetcher
+            ).render(**output_render_options())
+            stages['layout'] = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            data = write_document_pdf(document)
+            stages['write'] = (time.perf_counter() - start) * 1000
+            return stages, data
+        return step
+
+    def _report_step(self, template_path, rows, institute):
+        clients = [
+            Client(
+                first_name=f'عميل {i}', last_name='تجريبي', full_name=f'عميل {i} تجريبي',
+                national_id=f'{2000000000 + i}', phone='0500000000', institute=institute,
+                status='active', created_at=timezone.now(),
+            )
+            for i in range(rows)
+        ]
+        request = RequestFactory().get('/reports/bench/')
+        request.user = institute.registration_officer
+
+        def step():
+            # نفس مراحل core.utils.get_pdf_response بالظبط، مع قياس كل مرحلة لوحدها
+            context = {'clients': clients, 'title': 'تقرير القياس',
+                       'logo_url': request.build_absolute_uri(settings.STATIC_URL + 'images/logo.png'),
+                       'user': request.user}
+            stages = {}
+            start = time.perf_counter()
+            html = render_to_string(template_path, context)
+            stages['render'] = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            document = HTML(
+                string=html, base_url=request.build_absolute_uri('/'), url_fetcher=local_url_fetcher
+            ).render()
+            stages['layout'] = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            data = document.write_pdf()
+            stages['write'] = (time.perf_counter() - start) * 1000
+            return stages, data
+
+        return step, lambda: get_pdf_response(request, template_path, {'clients': clients, 'title': 'x'}, 'bench')
+
+    def _stream_report_step(self, rows, institute):
+        columns = [
+            ReportColumn('الاسم الكامل', 'full_name', width=3, align='RIGHT'),
+            ReportColumn('رقم الهوية', 'national_id', width=1.5),
+            ReportColumn('الهاتف', 'phone', width=1.5),
+            ReportColumn('المعهد', lambda client: client.institute.name, width=2.5, align='RIGHT'),
+            ReportColumn('الحالة', 'get_status_display'),
+        ]
+
+        def step():
+            # الصفوف بتتبني وقت القراءة زي queryset.iterator، فالذاكرة بتقيس الرسم بس
+            clients = (
+                Client(full_name=f'عميل {i} تجريبي', national_id=f'{2000000000 + i}', phone='0500000000',
+                       institute=institute, status='active')
+                for i in range(rows)
+            )
+            output = io.BytesIO()
+            start = time.perf_counter()
+            TabularReport('تقرير القياس', columns, clients, orientation='landscape').write(output)
+            return {'write': (time.perf_counter() - start) * 1000}, output.getvalue()
+
+        return step
+
+    # ==================== Main ====================
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations لازم يكون 1 أو أكتر')
+
+        media_root = tempfile.mkdtemp(prefix='bench-pdf-')
+        results = []
+        try:
+            # بيانات وهمية بتترجع، فقياسات الرسم (core.telemetry) مبتتسجلش
+            with override_settings(MEDIA_ROOT=media_root, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                                   PDF_TELEMETRY_ENABLED=False):
+                try:
+                    with transaction.atomic():
+                        self._bench(options, results)
+                        raise _Rollback
+                except _Rollback:
+                    pass
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+            _clear_caches()
+
+        report = {
+            'meta': {
+                'commit': _git_commit(),
+                'created_at': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'iterations': options['iterations'],
+                'warmup': options['warmup'],
+                'cold': options['cold'],
+            },
+            'scenarios': results,
+        }
+
+        if options['json_path'] == '-':
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+        elif options['json_path']:
+            with open(options['json_path'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'النتيجة اتحفظت في {options["json_path"]}'))
+
+        if options['compare']:
+            self._compare(report, options['compare'], options['max_regression'])
+
+    def _bench(self, options, results):
+        institutes, permissions = self._build_fixtures()
+
+        for preset_key, preset in PDF_PRESETS.items():
+            for font in PermissionTemplate.FontChoice.values:
+                for with_background in (False, True):
+                    institute = institutes[with_background]
+                    self._set_template(institute, preset, font)
+                    name = f'{preset_key}/{font}/{"bg" if with_background else "plain"}'
+                    result = self._run(name, options, self._permission_step(permissions[with_background].pk))
+                    if result:
+                        results.append(result)
+                    if options['font_baseline'] and font in CUSTOM_FONT_FILES:
+                        result = self._run(
+                            f'{name}/inline-fonts', options,
+                            self._permission_step(permissions[with_background].pk, inline_fonts=True),
+                        )
+                        if result:
+                            results.append(result)
+
+        for preset_key, preset in PDF_PRESETS.items():
+            institute = institutes[True]
+            self._set_template(
+                institute, preset, PermissionTemplate.FontChoice.ARIAL, PermissionTemplate.RenderMode.OVERLAY
+            )
+            if unsupported_reason(institute.permission_template):
+                continue
+            result = self._run(f'{preset_key}/overlay/bg', options, self._overlay_step(permissions[True].pk))
+            if result:
+                # نفس القالب بالرسم الكامل (نفس الخط والخلفية) من الحالات اللي فاتت
+                full = next((r for r in results if r['name'] == f'{preset_key}/arial/bg'), None)
+                if full and result['total']['p50']:
+                    result['speedup_vs_full'] = round(full['total']['p50'] / result['total']['p50'], 2)
+                    self.stdout.write(f'{"":<32} speedup_vs_full={result["speedup_vs_full"]}x (p50)')
+                results.append(result)
+
+        PermissionTemplate.objects.filter(institute__in=institutes.values()).delete()
+        result = self._run('default/plain', options, self._default_step(permissions[False].pk))
+        if result:
+            results.append(result)
+
+        for report_name, template_path in REPORTS.items():
+            for rows in options['report_rows']:
+                step, full_call = self._report_step(template_path, rows, institutes[False])
+                result = self._run(f'report/{report_name}/{rows}', options, step)
+                if result:
+                    start = time.perf_counter()
+                    full_call()
+                    result['get_pdf_response_ms'] = round((time.perf_counter() - start) * 1000, 3)
+                    results.append(result)
+
+        for rows in options['report_rows']:
+            result = self._run(f'report/clients-stream/{rows}', options, self._stream_report_step(rows, institutes[False]))
+            if result:
+                results.append(result)
+
+    def _compare(self, report, baseline_path, max_regression):
+        if not os.path.exists(baseline_path):
+            raise CommandError(f'ملف المقارنة "{baseline_path}" غير موجود')
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = {s['name']: s for s in json.load(f)['scenarios']}
+
+        regressions = []
+        self.stdout.write(f'\nمقارنة بـ {baseline_path}:')
+        for scenario in report['scenarios']:
+            before = baseline.get(scenario['name'])
+            if not before:
+                continue
+            old, new = before['total']['p50'], scenario['total']['p50']
+            change = (new - old) / old * 100 if old else 0.0
+            line = f'  {scenario["name"]:<32} {old:>8.1f}ms -> {new:>8.1f}ms ({change:+.1f}%)'
+            if change > max_regression:
+                regressions.append(scenario['name'])
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+
+        if regressions:
+            raise CommandError(f'بطء أكتر من {max_regression}% في: {", ".join(regressions)}')
@@ -0,0 +1,77 @@
+"""
+قياس وقت ترجمة قوالب PDF (django Template) مع وبدون كاش القوالب المترجمة.
+
+الاستخدام:
+    python manage.py bench_template_compile
+    python manage.py bench_template_compile --iterations 500 --font cairo
+
+- بيقارن 3 حالات لكل قالب جاهز في core.pdf_presets:
+  legacy   = الطريقة القديمة: الخطوط والخلفية base64 جوه نص القالب، وترجمة في كل رسم
+  uncached = نص القالب الجديد (من غير base64) بس مترجم في كل رسم
+  cached   = get_compiled_template - ترجمة مرة واحدة وبعدها من الكاش
+- مفيش أي كتابة في قاعدة البيانات (القوالب بتتبني في الذاكرة بس).
+"""
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template import Template
+from django.utils import timezone
+
+from core.assets import asset_cache
+from core.fonts import build_font_face_css
+from core.pdf_presets import PDF_PRESETS
+from permissions.models import PermissionTemplate
+from permissions.pdf import (
+    build_permission_template_source, build_background_css,
+    get_compiled_template, clear_compiled_templates,
+)
+
+
+class Command(BaseCommand):
+    help = 'قياس وقت ترجمة قوالب PDF لكل رسم مع وبدون الكاش'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--font', default=PermissionTemplate.FontChoice.CAIRO,
+                            choices=PermissionTemplate.FontChoice.values)
+
+    def _time(self, func, iterations):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        return (time.perf_counter() - start) * 1000 / iterations
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        font = options['font']
+
+        background_uri = asset_cache.get_data_uri(os.path.join(settings.BASE_DIR, 'static', 'images', 'ahley_bg.jpg'))
+        inline_assets = build_font_face_css(font) + build_background_css(background_uri)
+
+        for pk, (preset_key, preset) in enumerate(PDF_PRESETS.items(), start=1):
+            template_obj = PermissionTemplate(
+                pk=pk,
+                updated_at=timezone.now(),
+                font_family=font,
+                header_content=preset['header_content'],
+                body_content=preset['body_content'],
+                footer_content=preset['footer_content'],
+                custom_css=preset['custom_css'],
+                page_size=preset['page_size'],
+                orientation=preset['orientation'],
+            )
+            source = build_permission_template_source(template_obj)
+            legacy_source = source.replace('{{ background_css }}', inline_assets)
+
+            clear_compiled_templates()
+            legacy_ms = self._time(lambda: Template(legacy_source), iterations)
+            uncached_ms = self._time(lambda: Template(source), iterations)
+            cached_ms = self._time(lambda: get_compiled_template(template_obj), iterations)
+
+            self.stdout.write(
+                f'{preset_key:<10} source={len(legacy_source) // 1024}KB -> {len(source) // 1024}KB  '
+                f'legacy={legacy_ms:.3f}ms  uncached={uncached_ms:.3f}ms  cached={cached_ms:.4f}ms  '
+                f'saved/render={legacy_ms - cached_ms:.3f}ms'
+            )
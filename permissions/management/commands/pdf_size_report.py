@@ -0,0 +1,83 @@
+"""
+تقرير أحجام ملفات PDF الأذونات لكل معهد (من PermissionSlip.pdf_size اللي بيتسجل مع كل رسم).
+
+الاستخدام:
+    python manage.py pdf_size_report
+    python manage.py pdf_size_report --institute 3 --status active
+    python manage.py pdf_size_report --json
+
+- الأذونات اللي لسه ماترسمتش (pdf_size فاضي) مش داخلة في المتوسط، وعددها ظاهر في عمود pending.
+- profile: جودة الملف في قالب المعهد (PermissionTemplate.output_profile).
+"""
+import json
+
+from django.core.management.base import BaseCommand
+from django.db.models import Avg, Count, Max, Q, Sum
+
+from permissions.models import PermissionSlip, PermissionTemplate
+
+
+class Command(BaseCommand):
+    help = 'تقرير متوسط وإجمالي أحجام ملفات PDF الأذونات لكل معهد'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--institute', help='ID المعهد')
+        parser.add_argument('--status', choices=PermissionSlip.Status.values, help='حالة الأذونات')
+        parser.add_argument('--json', action='store_true', help='الناتج JSON بدل جدول')
+
+    def handle(self, *args, **options):
+        queryset = PermissionSlip.objects.all()
+        if options['institute']:
+            queryset = queryset.filter(institute_id=options['institute'])
+        if options['status']:
+            queryset = queryset.filter(status=options['status'])
+
+        rows = list(
+            queryset.values('institute_id', 'institute__name')
+            .annotate(
+                slips=Count('id'),
+                rendered=Count('id', filter=Q(pdf_size__isnull=False)),
+                avg_bytes=Avg('pdf_size'),
+                max_bytes=Max('pdf_size'),
+                total_bytes=Sum('pdf_size'),
+            )
+            .order_by('-avg_bytes', 'institute__name')
+        )
+        profiles = dict(
+            PermissionTemplate.objects.filter(institute_id__in=[row['institute_id'] for row in rows])
+            .values_list('institute_id', 'output_profile')
+        )
+
+        report = [
+            {
+                'institute_id': row['institute_id'],
+                'institute': row['institute__name'],
+                'profile': profiles.get(row['institute_id'], ''),
+                'slips': row['slips'],
+                'rendered': row['rendered'],
+                'pending': row['slips'] - row['rendered'],
+                'avg_bytes': round(row['avg_bytes'] or 0),
+                'max_bytes': row['max_bytes'] or 0,
+                'total_bytes': row['total_bytes'] or 0,
+            }
+            for row in rows
+        ]
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+            return
+
+        if not report:
+            self.stdout.write(self.style.WARNING('لا توجد أذونات مطابقة.'))
+            return
+
+        self.stdout.write(
+            f'{"institute":<30} {"profile":<10} {"rendered":>9} {"pending":>8} '
+            f'{"avg KB":>8} {"max KB":>8} {"total MB":>9}'
+        )
+        for row in report:
+            self.stdout.write(
+                f'{row["institute"][:30]:<30} {row["profile"]:<10} {row["rendered"]:>9} {row["pending"]:>8} '
+                f'{row["avg_bytes"] / 1024:>8.1f} {row["max_bytes"] / 1024:>8.1f} '
+                f'{row["total_bytes"] / 1024 / 1024:>9.2f}'
+            )
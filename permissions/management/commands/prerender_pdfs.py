@@ -0,0 +1,129 @@
+"""
+رسم ملفات PDF للأذونات الموجودة مسبقاً (backfill) بالتوازي.
+
+الاستخدام:
+    python manage.py prerender_pdfs
+    python manage.py prerender_pdfs --workers 4 --institute INS001
+    python manage.py prerender_pdfs --status active --limit 1000
+
+- الأمر آمن يتكرر ويكمل من مكان ما وقف (resumable): أي إذن ملفه متخزن بالفعل بنفس مفتاح
+  الكاش بيتخطى، فلو اتقطع في النص (Ctrl+C / restart) تشغيله تاني بيكمل الباقي بس.
+- الرسم بيحصل في pool عمليات منفصلة بعدد --workers (core.render_pool) عشان التوازي الحقيقي.
+- --force بيعيد رسم كل الأذونات المختارة حتى لو متخزنة.
+"""
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.db.models import Q
+
+from core.render_pool import RenderPool
+from institutes.models import Institute
+from permissions.models import PermissionSlip
+from permissions.pdf_cache import is_pdf_cached, get_permission_pdf, discard_cached_pdf
+
+
+class Command(BaseCommand):
+    help = 'رسم ملفات PDF للأذونات الموجودة مسبقاً بالتوازي (يكمل من مكان ما وقف)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='عدد عمليات الرسم المتوازية')
+        parser.add_argument('--institute', help='كود المعهد أو الـ ID')
+        parser.add_argument('--status', choices=PermissionSlip.Status.values, help='حالة الأذونات')
+        parser.add_argument('--limit', type=int, help='أقصى عدد أذونات يترسم في التشغيلة دي')
+        parser.add_argument('--progress-every', type=int, default=50)
+        parser.add_argument('--force', action='store_true', help='إعادة الرسم حتى لو الملف متخزن')
+
+    def _get_queryset(self, options):
+        queryset = PermissionSlip.objects.select_related(
+            'client', 'institute', 'institute__registration_officer', 'issued_by', 'diploma', 'course'
+        ).order_by('pk')
+
+        if options['institute']:
+            lookup = Q(code=options['institute'])
+            if options['institute'].isdigit():
+                lookup |= Q(pk=int(options['institute']))
+            institute = Institute.objects.filter(lookup).first()
+            if not institute:
+                raise CommandError(f'المعهد "{options["institute"]}" غير موجود')
+            queryset = queryset.filter(institute=institute)
+
+        if options['status']:
+            queryset = queryset.filter(status=options['status'])
+
+        return queryset
+
+    def _render(self, permission, pool, force):
+        try:
+            if force:
+                discard_cached_pdf(permission)
+                permission.pdf_file = ''
+            elif is_pdf_cached(permission):
+                return permission.pk, 'skipped', ''
+            get_permission_pdf(permission, pool=pool)
+            return permission.pk, 'rendered', ''
+        except Exception as e:
+            return permission.pk, 'failed', str(e)
+        finally:
+            close_old_connections()
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        queryset = self._get_queryset(options)
+        total = queryset.count()
+        if options['limit']:
+            total = min(total, options['limit'])
+            queryset = queryset[:options['limit']]
+
+        self.stdout.write(f'أذونات مختارة: {total} - عمليات رسم متوازية: {workers}')
+        if not total:
+            return
+
+        pool = RenderPool(
+            size=workers,
+            timeout=settings.PDF_RENDER_TIMEOUT,
+            max_jobs=settings.PDF_RENDER_MAX_JOBS,
+            max_rss_mb=settings.PDF_RENDER_MAX_RSS_MB,
+            queue_timeout=settings.PDF_RENDER_TIMEOUT * 2,
+        )
+        counts = {'rendered': 0, 'skipped': 0, 'failed': 0}
+        done = 0
+        started = time.monotonic()
+
+        def report(future):
+            nonlocal done
+            pk, result, error = future.result()
+            counts[result] += 1
+            done += 1
+            if error:
+                self.stdout.write(self.style.ERROR(f'  ! إذن {pk}: {error}'))
+            if done % options['progress_every'] == 0 or done == total:
+                rate = done / max(time.monotonic() - started, 0.001)
+                self.stdout.write(
+                    f'  {done}/{total} - رُسم {counts["rendered"]}، متخزن {counts["skipped"]}، '
+                    f'فشل {counts["failed"]} ({rate:.1f} إذن/ث)'
+                )
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # عدد محدود من الأذونات في الذاكرة في نفس الوقت مهما كان العدد الكلي
+                in_flight = set()
+                for permission in queryset.iterator(chunk_size=500):
+                    in_flight.add(executor.submit(self._render, permission, pool, options['force']))
+                    if len(in_flight) >= workers * 4:
+                        finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            report(future)
+                for future in as_completed(in_flight):
+                    report(future)
+        finally:
+            pool.shutdown()
+
+        style = self.style.SUCCESS if not counts['failed'] else self.style.WARNING
+        self.stdout.write(style(
+            f'تم: رُسم {counts["rendered"]}، تم تخطي {counts["skipped"]} (جاهز بالفعل)، فشل {counts["failed"]}.'
+        ))
+        if counts['failed']:
+            self.stdout.write('شغّل الأمر تاني لإعادة محاولة الأذونات اللي فشلت فقط.')
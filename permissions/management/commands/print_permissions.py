@@ -0,0 +1,77 @@
+"""
+طباعة مجمعة لأذونات كتير في ملف PDF واحد أو ZIP (نفس فلتر صفحة قائمة الأذونات).
+
+الاستخدام:
+    python manage.py print_permissions --output slips.pdf --institute 3 --status active
+    python manage.py print_permissions --output slips.zip --date-from 2026-01-01 --date-to 2026-01-31
+    python manage.py print_permissions --output slips.zip --search 2990 --chunk-size 50
+
+- الصيغة بتتحدد من امتداد --output (pdf أو zip) أو بـ --format.
+- ZIP فيه مستند PDF متعدد الصفحات لكل مجموعة (--chunk-size)، وبيتكتب على الديسك مجموعة بمجموعة
+  فالذاكرة ثابتة مهما كان عدد الأذونات. ملف PDF الواحد محدود بـ PDF_BATCH_MAX_PDF_SLIPS
+  إلا لو استخدمت --force.
+"""
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from permissions.batch import BATCH_FORMATS, BATCH_SELECT_RELATED, stream_batch_pdf, stream_batch_zip
+from permissions.models import PermissionSlip
+from permissions.utils import filter_permissions
+
+
+class Command(BaseCommand):
+    help = 'طباعة مجمعة لأذونات كتير في ملف PDF واحد أو ZIP'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', required=True, help='مسار الملف الناتج (.pdf أو .zip)')
+        parser.add_argument('--format', choices=BATCH_FORMATS, help='الصيغة (الافتراضي من امتداد الملف)')
+        parser.add_argument('--institute', help='ID المعهد')
+        parser.add_argument('--status', choices=PermissionSlip.Status.values, help='حالة الأذونات')
+        parser.add_argument('--date-from', help='من تاريخ إصدار (YYYY-MM-DD)')
+        parser.add_argument('--date-to', help='إلى تاريخ إصدار (YYYY-MM-DD)')
+        parser.add_argument('--search', help='بحث برقم الإذن أو اسم/رقم هوية العميل')
+        parser.add_argument('--chunk-size', type=int, default=settings.PDF_BATCH_CHUNK_SIZE,
+                            help='عدد الأذونات في كل مستند داخل الـ ZIP')
+        parser.add_argument('--force', action='store_true', help='تجاهل الحد الأقصى لملف PDF واحد')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        batch_format = options['format'] or os.path.splitext(output)[1].lstrip('.').lower()
+        if batch_format not in BATCH_FORMATS:
+            raise CommandError('حدد الصيغة بـ --format أو استخدم امتداد .pdf / .zip')
+
+        queryset = filter_permissions(
+            PermissionSlip.objects.select_related(*BATCH_SELECT_RELATED), options
+        ).order_by('pk')
+        total = queryset.count()
+        if not total:
+            self.stdout.write(self.style.WARNING('لا توجد أذونات مطابقة.'))
+            return
+
+        if batch_format == 'pdf' and total > settings.PDF_BATCH_MAX_PDF_SLIPS and not options['force']:
+            raise CommandError(
+                f'عدد الأذونات ({total}) أكبر من PDF_BATCH_MAX_PDF_SLIPS '
+                f'({settings.PDF_BATCH_MAX_PDF_SLIPS}) - استخدم ZIP أو --force'
+            )
+
+        chunk_size = max(1, options['chunk_size'])
+        self.stdout.write(f'طباعة {total} إذن ({batch_format}) إلى {output}...')
+        started = time.monotonic()
+
+        if batch_format == 'pdf':
+            blocks = stream_batch_pdf(queryset, chunk_size=chunk_size)
+        else:
+            blocks = stream_batch_zip(queryset, chunk_size=chunk_size)
+
+        size = 0
+        with open(output, 'wb') as f:
+            for block in blocks:
+                f.write(block)
+                size += len(block)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'تم: {total} إذن - {size / 1024:.0f}KB في {time.monotonic() - started:.1f} ثانية'
+        ))
@@ -0,0 +1,44 @@
+"""
+مراجعة فهرس الأهلية للإصدار (ActivePermissionIndex) مقابل جدول الأذونات وإصلاحه.
+
+الاستخدام:
+    python manage.py rebuild_eligibility_index
+    python manage.py rebuild_eligibility_index --check
+
+- الفهرس المتوقع بيتحسب من الأذونات النشطة مباشرة: أحدث إذن نشط لكل (عميل، معهد).
+- missing: زوج عنده إذن نشط ومش في الفهرس، stale: الفهرس بيشاور على إذن غير الأحدث،
+  extra: صف في الفهرس ملوش إذن نشط.
+- من غير --check الصفوف الغلط بس بتتصلح (في transaction واحدة). --check بيراجع بس وبيخرج
+  بخطأ لو فيه أي فرق (ينفع في cron / CI).
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from permissions.eligibility import verify_index
+
+# أقصى عدد أزواج بيتطبع لكل نوع فرق
+SAMPLE_SIZE = 10
+
+
+class Command(BaseCommand):
+    help = 'مراجعة فهرس الأهلية للإصدار مقابل جدول الأذونات وإصلاح الفروق'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='مراجعة فقط من غير إصلاح')
+
+    def handle(self, *args, **options):
+        diff = verify_index(fix=not options['check'])
+        total = sum(len(pairs) for pairs in diff.values())
+
+        for kind, pairs in diff.items():
+            if not pairs:
+                continue
+            sample = ', '.join(f'(client={client_id}, institute={institute_id})' for client_id, institute_id in pairs[:SAMPLE_SIZE])
+            more = f' ... و{len(pairs) - SAMPLE_SIZE} غيرهم' if len(pairs) > SAMPLE_SIZE else ''
+            self.stdout.write(f'  {kind}: {len(pairs)} - {sample}{more}')
+
+        if not total:
+            self.stdout.write(self.style.SUCCESS('الفهرس مطابق لجدول الأذونات.'))
+        elif options['check']:
+            raise CommandError(f'الفهرس فيه {total} فرق عن جدول الأذونات - شغّل الأمر من غير --check للإصلاح.')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'تم إصلاح {total} صف في الفهرس.'))
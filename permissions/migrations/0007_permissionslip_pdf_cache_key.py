@@ -0,0 +1,18 @@
+# Generated by Django 5.2.11 on 2026-10-18 16:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permissions', '0006_permissiontemplate_font_family'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='permissionslip',
+            name='pdf_cache_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='PDF Cache Key'),
+        ),
+    ]
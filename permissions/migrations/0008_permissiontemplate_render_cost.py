@@ -0,0 +1,33 @@
+# Generated by Django 5.2.11 on 2026-10-18 16:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permissions', '0007_permissionslip_pdf_cache_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='permissiontemplate',
+            name='render_checked_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Render Checked At'),
+        ),
+        migrations.AddField(
+            model_name='permissiontemplate',
+            name='render_pages',
+            field=models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Rendered Pages'),
+        ),
+        migrations.AddField(
+            model_name='permissiontemplate',
+            name='render_size',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Rendered Size (bytes)'),
+        ),
+        migrations.AddField(
+            model_name='permissiontemplate',
+            name='render_time_ms',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Render Time (ms)'),
+        ),
+    ]
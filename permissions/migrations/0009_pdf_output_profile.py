@@ -0,0 +1,23 @@
+# Generated by Django 5.2.11 on 2026-10-18 16:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permissions', '0008_permissiontemplate_render_cost'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='permissionslip',
+            name='pdf_size',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='PDF Size (bytes)'),
+        ),
+        migrations.AddField(
+            model_name='permissiontemplate',
+            name='output_profile',
+            field=models.CharField(choices=[('quality', 'High quality (original images)'), ('balanced', 'Balanced'), ('small', 'Small size (mobile)')], default='balanced', help_text='Trade-off between image quality and PDF size', max_length=20, verbose_name='Output Profile'),
+        ),
+    ]
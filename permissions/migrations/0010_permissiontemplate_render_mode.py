@@ -0,0 +1,18 @@
+# Generated by Django 5.2.11 on 2026-10-18 16:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permissions', '0009_pdf_output_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='permissiontemplate',
+            name='render_mode',
+            field=models.CharField(choices=[('full', 'Full render'), ('overlay', 'Static background + variable fields overlay')], default='full', help_text='Overlay mode renders the static layer once and stamps only the variable fields per permission', max_length=20, verbose_name='Render Mode'),
+        ),
+    ]
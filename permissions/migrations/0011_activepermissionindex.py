@@ -0,0 +1,46 @@
+# Generated by Django 5.2.11 on 2026-10-18 17:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_index(apps, schema_editor):
+    PermissionSlip = apps.get_model('permissions', 'PermissionSlip')
+    ActivePermissionIndex = apps.get_model('permissions', 'ActivePermissionIndex')
+
+    latest = {}
+    active = PermissionSlip.objects.filter(status='active', is_deleted=False).order_by('created_at', 'pk')
+    for permission_id, client_id, institute_id in active.values_list('pk', 'client_id', 'institute_id').iterator():
+        latest[(client_id, institute_id)] = permission_id
+
+    ActivePermissionIndex.objects.bulk_create([
+        ActivePermissionIndex(client_id=client_id, institute_id=institute_id, permission_id=permission_id)
+        for (client_id, institute_id), permission_id in latest.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0005_alter_client_sector'),
+        ('institutes', '0004_institute_registration_officer'),
+        ('permissions', '0010_permissiontemplate_render_mode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivePermissionIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='clients.client', verbose_name='Client')),
+                ('institute', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='institutes.institute', verbose_name='Institute')),
+                ('permission', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='eligibility_entry', to='permissions.permissionslip', verbose_name='Permission')),
+            ],
+            options={
+                'verbose_name': 'Active Permission Index',
+                'verbose_name_plural': 'Active Permission Index',
+                'constraints': [models.UniqueConstraint(fields=('client', 'institute'), name='unique_active_permission_per_institute')],
+            },
+        ),
+        migrations.RunPython(build_index, migrations.RunPython.noop),
+    ]
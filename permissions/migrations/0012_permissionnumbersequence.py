@@ -0,0 +1,24 @@
+# Generated by Django 5.2.11 on 2026-10-18 17:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permissions', '0011_activepermissionindex'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PermissionNumberSequence',
+            fields=[
+                ('year', models.PositiveSmallIntegerField(primary_key=True, serialize=False, verbose_name='Year')),
+                ('next_value', models.PositiveIntegerField(default=1, verbose_name='Next Value')),
+            ],
+            options={
+                'verbose_name': 'Permission Number Sequence',
+                'verbose_name_plural': 'Permission Number Sequences',
+            },
+        ),
+    ]
@@ -1,7 +1,6 @@
-from django.db import models
+from django.db import models, transaction
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
-import uuid
 
 from core.models import BaseModel
 from programs.models import StudyMode
@@ -91,6 +90,20 @@ class PermissionSlip(BaseModel):
         blank=True,
         verbose_name=_('PDF File')
     )
+    # مفتاح نسخة المدخلات اللي اترسم منها pdf_file (انظر permissions/pdf_cache.py)
+    pdf_cache_key = models.CharField(
+        max_length=64,
+        blank=True,
+        editable=False,
+        verbose_name=_('PDF Cache Key')
+    )
+    # حجم pdf_file بالـ bytes (لتقارير متوسط حجم الأذونات لكل معهد)
+    pdf_size = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name=_('PDF Size (bytes)')
+    )
     
     # الملاحظات
     notes = models.TextField(blank=True, verbose_name=_('Notes'))
@@ -161,13 +174,18 @@ class PermissionSlip(BaseModel):
         if not self.institute_id and self.client_id:
             self.institute = self.client.institute
 
-        super().save(*args, **kwargs)
+        # فهرس الأهلية (permissions.eligibility) بيتحدث في نفس الـ transaction مع الإذن
+        from .eligibility import sync_permission_eligibility
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            sync_permission_eligibility(self)
     
     def generate_permission_number(self):
-        """توليد رقم إذن فريد"""
-        year = timezone.now().year
-        unique_id = str(uuid.uuid4().int)[:6]
-        return f"PERM-{year}-{unique_id}"
+        """توليد رقم إذن فريد - تسلسل لكل سنة بدفعات محجوزة لكل process (permissions.numbering)"""
+        from .numbering import allocate_permission_number
+
+        return allocate_permission_number()
     
     def get_program(self):
         """الحصول على البرنامج (دبلومة أو دورة)"""
@@ -207,6 +225,15 @@ class PermissionTemplate(BaseModel):
         ARIAL = 'arial', _('Arial (افتراضي)')
         CAIRO = 'cairo', _('Cairo (عربي حديث)')
 
+    class RenderMode(models.TextChoices):
+        FULL = 'full', _('Full render')
+        OVERLAY = 'overlay', _('Static background + variable fields overlay')
+
+    class OutputProfile(models.TextChoices):
+        QUALITY = 'quality', _('High quality (original images)')
+        BALANCED = 'balanced', _('Balanced')
+        SMALL = 'small', _('Small size (mobile)')
+
     institute = models.OneToOneField(
         'institutes.Institute',
         on_delete=models.CASCADE,
@@ -246,6 +273,24 @@ class PermissionTemplate(BaseModel):
         help_text=_('Font used in the generated PDF')
     )
     
+    # طريقة الرسم: كامل لكل إذن، أو طبقة ثابتة مرة واحدة + الحقول المتغيرة فوقها (permissions.overlay)
+    render_mode = models.CharField(
+        max_length=20,
+        choices=RenderMode.choices,
+        default=RenderMode.FULL,
+        verbose_name=_('Render Mode'),
+        help_text=_('Overlay mode renders the static layer once and stamps only the variable fields per permission')
+    )
+    
+    # جودة/حجم ملف الـ PDF الناتج (permissions.pdf.PDF_OUTPUT_PROFILES)
+    output_profile = models.CharField(
+        max_length=20,
+        choices=OutputProfile.choices,
+        default=OutputProfile.BALANCED,
+        verbose_name=_('Output Profile'),
+        help_text=_('Trade-off between image quality and PDF size')
+    )
+    
     # الإعدادات
     page_size = models.CharField(
         max_length=20,
@@ -260,6 +305,12 @@ class PermissionTemplate(BaseModel):
         verbose_name=_('Orientation')
     )
     
+    # تكلفة الرسم المقاسة عند آخر حفظ (permissions.render_guard)
+    render_time_ms = models.PositiveIntegerField(null=True, blank=True, verbose_name=_('Render Time (ms)'))
+    render_pages = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name=_('Rendered Pages'))
+    render_size = models.PositiveIntegerField(null=True, blank=True, verbose_name=_('Rendered Size (bytes)'))
+    render_checked_at = models.DateTimeField(null=True, blank=True, verbose_name=_('Render Checked At'))
+    
     # التواريخ
     created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('Created At'))
     updated_at = models.DateTimeField(auto_now=True, verbose_name=_('Updated At'))
@@ -273,3 +324,52 @@ class PermissionTemplate(BaseModel):
     
     def __str__(self):
         return f"Template for {self.institute.name}"
+
+
+class ActivePermissionIndex(models.Model):
+    """
+    فهرس الأهلية للإصدار: صف لكل (عميل، معهد) عنده إذن نشط، بيشاور على أحدث إذن نشط فيهم.
+    بيتحدث مع كل حفظ أو حذف للإذن (permissions.eligibility) - مش بيتعدل يدوياً.
+    """
+    client = models.ForeignKey(
+        'clients.Client',
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name=_('Client')
+    )
+    institute = models.ForeignKey(
+        'institutes.Institute',
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name=_('Institute')
+    )
+    permission = models.OneToOneField(
+        PermissionSlip,
+        on_delete=models.CASCADE,
+        related_name='eligibility_entry',
+        verbose_name=_('Permission')
+    )
+
+    class Meta:
+        verbose_name = _('Active Permission Index')
+        verbose_name_plural = _('Active Permission Index')
+        constraints = [
+            models.UniqueConstraint(fields=['client', 'institute'], name='unique_active_permission_per_institute'),
+        ]
+
+    def __str__(self):
+        return f"{self.client_id} @ {self.institute_id} -> {self.permission_id}"
+
+
+class PermissionNumberSequence(models.Model):
+    """عداد أرقام الأذونات لكل سنة - الـ processes بتحجز منه دفعات (permissions.numbering)"""
+    year = models.PositiveSmallIntegerField(primary_key=True, verbose_name=_('Year'))
+    # أول رقم لسه محدش حجزه
+    next_value = models.PositiveIntegerField(default=1, verbose_name=_('Next Value'))
+
+    class Meta:
+        verbose_name = _('Permission Number Sequence')
+        verbose_name_plural = _('Permission Number Sequences')
+
+    def __str__(self):
+        return f"{self.year}: {self.next_value}"
@@ -0,0 +1,137 @@
+"""
+أرقام الأذونات المتسلسلة لكل سنة (PERM-YYYY-NNNNNN) من غير تصادم
+
+الرقم كان 6 أرقام عشوائية من UUID، وفرصة التكرار بتكبر مع عدد الأذونات في السنة (IntegrityError
+وقت الإصدار). دلوقتي فيه عداد لكل سنة في PermissionNumberSequence، وكل process بيحجز منه دفعة
+(PERMISSION_NUMBER_BLOCK_SIZE رقم) مرة واحدة ويوزعها من الذاكرة، فأغلب الإصدارات من غير أي
+استعلام. الحجز تحديث ذري (UPDATE next_value = next_value + N) فآمن بين الـ workers والـ containers.
+
+- الأرقام العشوائية القديمة في نفس السنة بتتخطى: كل دفعة بتتراجع على الأذونات الموجودة في استعلام واحد.
+- بعد fork (gunicorn --preload) الدفعة المحجوزة في الـ process الأب مبتتورثش.
+- لو الحجز جوه transaction خارجية، بيتحجز رقم واحد بس ومبيتخزنش: لو الـ transaction اترجعت
+  الرقم والإذن بيترجعوا مع بعض، فمفيش دفعة "محجوزة" في الذاكرة وملغية في قاعدة البيانات.
+- release: رقم اتحجز والإصدار اترفض (eligibility.issue_permission) بيرجع لأول الدفعة، فالسلسلة
+  مبيبقاش فيها فجوات من المحاولات المرفوضة.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger('edu_system')
+
+NUMBER_FORMAT = 'PERM-{year}-{value:06d}'
+
+# محاولات الحجز لو قاعدة البيانات مقفولة مؤقتاً (SQLite تحت ضغط كتابة)
+RESERVE_ATTEMPTS = 5
+RESERVE_BACKOFF = 0.05
+
+
+def format_permission_number(year, value):
+    return NUMBER_FORMAT.format(year=year, value=value)
+
+
+class PermissionNumberAllocator:
+    """بيوزع أرقام الأذونات من دفعات محجوزة لكل سنة - instance واحد لكل process (allocator)"""
+
+    def __init__(self, block_size=None):
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._blocks = {}
+        self._pid = os.getpid()
+
+    def allocate(self, year=None):
+        year = year or timezone.now().year
+
+        if connection.in_atomic_block:
+            while True:
+                values = self._reserve(year, 1)
+                if values:
+                    return format_permission_number(year, values[0])
+
+        with self._lock:
+            self._check_pid()
+            while True:
+                block = self._blocks.get(year)
+                if not block:
+                    size = self.block_size or settings.PERMISSION_NUMBER_BLOCK_SIZE
+                    block = self._blocks[year] = deque(self._reserve(year, size))
+                    if not block:
+                        continue
+                return format_permission_number(year, block.popleft())
+
+    def release(self, number):
+        """يرجّع رقم من allocate مااتستخدمش لأول دفعة سنته - أول إصدار بعده بياخده"""
+        if connection.in_atomic_block:
+            # الرقم ممكن يكون اتحجز جوه الـ transaction الخارجية (رقم واحد) ولو اترجعت هيتحجز تاني
+            return
+        try:
+            _, year, value = number.split('-')
+            year, value = int(year), int(value)
+        except (AttributeError, ValueError):
+            return
+
+        with self._lock:
+            self._check_pid()
+            self._blocks.setdefault(year, deque()).appendleft(value)
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._blocks = {}
+            self._pid = os.getpid()
+
+    def _reserve(self, year, size):
+        """يحجز [start, start + size) من عداد السنة ويرجعها من غير الأرقام المستخدمة (ممكن تبقى فاضية)"""
+        from .models import PermissionNumberSequence
+
+        for attempt in range(RESERVE_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    updated = PermissionNumberSequence.objects.filter(year=year).update(next_value=F('next_value') + size)
+                    if not updated:
+                        try:
+                            with transaction.atomic():
+                                PermissionNumberSequence.objects.create(year=year, next_value=1 + size)
+                        except IntegrityError:
+                            # process تاني عمل العداد في نفس اللحظة
+                            PermissionNumberSequence.objects.filter(year=year).update(next_value=F('next_value') + size)
+                    end = PermissionNumberSequence.objects.filter(year=year).values_list('next_value', flat=True).get()
+                break
+            except OperationalError as e:
+                if attempt == RESERVE_ATTEMPTS - 1:
+                    raise
+                logger.warning(f'Permission number reservation retry for {year}: {e}')
+                time.sleep(RESERVE_BACKOFF * (attempt + 1))
+
+        values = list(range(end - size, end))
+        return self._skip_taken(year, values)
+
+    def _skip_taken(self, year, values):
+        from .models import PermissionSlip
+
+        numbers = {format_permission_number(year, value): value for value in values}
+        taken = set(
+            PermissionSlip.all_objects.filter(permission_number__in=list(numbers)).values_list('permission_number', flat=True)
+        )
+        if taken:
+            logger.info(f'Skipped {len(taken)} permission numbers already used in {year}')
+        return [value for number, value in numbers.items() if number not in taken]
+
+
+allocator = PermissionNumberAllocator()
+
+
+def allocate_permission_number():
+    """رقم إذن جديد فريد (PERM-YYYY-NNNNNN)"""
+    return allocator.allocate()
+
+
+def release_permission_number(number):
+    """رقم من allocate_permission_number الإذن بتاعه متحفظش - يرجع للدفعة"""
+    allocator.release(number)
@@ -0,0 +1,345 @@
+"""
+وضع الرسم بالطبقات (PermissionTemplate.render_mode = overlay) للفروع اللي بتصدر أذونات كتير
+
+أغلب صفحة الإذن ثابتة لكل قالب (الهيدر، اللوجو، الخلفية، التوقيع، الختم، الفوتر)، واللي بيتغير
+بس شوية حقول (اسم العميل، الهوية، البرنامج، التواريخ، رقم الإذن). هنا:
+- الطبقة الثابتة: القالب بيترسم (layout) مرة واحدة لكل نسخة من القالب بقيم الإذن التجريبي
+  (permissions.preview) مخفية (visibility: hidden)، ومن الـ layout بناخد مكان وخط ولون كل حقل متغير.
+- لكل إذن: صفحة HTML صغيرة فيها الحقول المتغيرة بس في أماكنها (من غير صور ولا خلفية) بتترسم،
+  وصفحاتها بتتطبع فوق صفحات الطبقة الثابتة في نفس صفحة الـ PDF (OverlaidPage).
+- عرض كل حقل محدود بالمساحة اللي قدامه في السطر (لحد طرف العنصر اللي فيه)، ولو قيمة إذن طلعت
+  أطول من كده (اسم طويل مثلاً) الإذن ده بيترسم كامل عشان القالب يلفها زي ما هو مصمم.
+
+WeasyPrint مابيقراش ملفات PDF، فالطبقة الثابتة بتتخزن كصفحات جاهزة (layout) في ذاكرة كل thread
+مش كملف PDF، والدمج بيحصل وقت رسم الصفحة. النص العربي بيتشكل بنفس محرك WeasyPrint (pango).
+
+القوالب اللي فيها شروط/تكرار على بيانات الإذن، أو متغيرات جوه attributes أو CSS، مينفعش تترسم
+بالطبقات - unsupported_reason بيقول السبب، والرسم بيرجع للرسم الكامل تلقائياً.
+
+الدمج بيستخدم داخليات WeasyPrint مش API عام (Page._page_box لأماكن الحقول، ونسخ Page.__dict__
+و Page.paint في OverlaidPage)، فالإصدار مثبت في requirements.txt، ومع إصدار رئيسي غير
+TESTED_WEASYPRINT_MAJOR الوضع بيتقفل وكل القوالب بتترسم كامل لحد ما يتجرب.
+لكل إذن لسه فيه layout، بس لصفحة الحقول المتغيرة بس (من غير صور ولا خلفية ولا باقي القالب) -
+bench_pdf بيطبع الفرق عن الرسم الكامل لنفس القالب (speedup_vs_full).
+"""
+import logging
+import re
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib import messages
+from django.template import Context, Template
+from django.template.base import Node, TextNode, Variable, VariableNode
+from django.utils.html import escape
+from weasyprint import __version__ as WEASYPRINT_VERSION
+from weasyprint.document import Page
+from weasyprint.formatting_structure.boxes import BlockBox, BlockContainerBox, TextBox
+
+from core.telemetry import note
+from .pdf import (
+    build_permission_context, build_permission_template_source, layout_permission_html, output_render_options,
+    printed_date,
+)
+from .preview import build_sample_permission
+
+logger = logging.getLogger('edu_system')
+
+# متغيرات الـ context اللي بتتغير من إذن للتاني - أي حاجة تانية (المعهد، الصور، ...) ثابتة للقالب
+VARIABLE_ROOTS = frozenset(('permission', 'client', 'program', 'issued_by', 'today'))
+
+FIELD_ATTR = 'data-overlay-field'
+
+# الإصدار الرئيسي من WeasyPrint اللي داخلياته (Page._page_box / Page.paint) متجربة مع الوضع ده
+TESTED_WEASYPRINT_MAJOR = '68'
+
+_roots_re = re.compile(r'\b(?:%s)\b' % '|'.join(sorted(VARIABLE_ROOTS)))
+_tag_re = re.compile(r'<[^<>]*>')
+_template_code_re = re.compile(r'\{\{.*?\}\}|\{%.*?%\}', re.S)
+
+_UNSUPPORTED = object()
+
+_local = threading.local()
+
+
+def _node_roots(node):
+    """أسماء متغيرات الـ context اللي VariableNode بيعتمد عليها (المتغير نفسه وأي معاملات للفلاتر)"""
+    roots = set()
+    expression = node.filter_expression
+    if isinstance(expression.var, Variable) and expression.var.lookups:
+        roots.add(expression.var.lookups[0])
+    for _func, args in expression.filters:
+        for lookup, arg in args:
+            if lookup and arg.lookups:
+                roots.add(arg.lookups[0])
+    return roots
+
+
+def _is_variable(node):
+    return bool(_node_roots(node) & VARIABLE_ROOTS)
+
+
+def unsupported_reason(template_obj, template=None):
+    """سبب إن القالب مينفعش يترسم بالطبقات (نص للمستخدم)، أو None لو ينفع"""
+    if WEASYPRINT_VERSION.split('.')[0] != TESTED_WEASYPRINT_MAJOR:
+        return f'إصدار WeasyPrint {WEASYPRINT_VERSION} لسه متجربش مع وضع الطبقات'
+
+    if any(_roots_re.search(code) for code in _template_code_re.findall(template_obj.custom_css or '')):
+        return 'الـ CSS المخصص فيه متغيرات خاصة بالإذن'
+
+    for field in ('header_content', 'body_content', 'footer_content'):
+        for tag in _tag_re.findall(getattr(template_obj, field) or ''):
+            if any(_roots_re.search(code) for code in _template_code_re.findall(tag)):
+                return f'فيه متغير خاص بالإذن جوه attribute: {tag[:80]}'
+
+    template = template or Template(build_permission_template_source(template_obj))
+    for node in template.nodelist.get_nodes_by_type(Node):
+        if isinstance(node, (TextNode, VariableNode)):
+            continue
+        token = getattr(node, 'token', None)
+        if token is not None and _roots_re.search(token.contents):
+            return f'فيه شرط أو تكرار بيعتمد على بيانات الإذن: {{% {token.contents[:80]} %}}'
+    return None
+
+
+def warn_overlay_unsupported(request, template_obj):
+    """رسالة تحذير في صفحة القالب لو اختار وضع الطبقات والقالب مينفعش (هيترسم كامل)"""
+    if template_obj.render_mode != template_obj.RenderMode.OVERLAY:
+        return
+    reason = unsupported_reason(template_obj)
+    if reason:
+        messages.warning(request, f'وضع الطبقات مش هينفع مع القالب ده وهيترسم بالكامل: {reason}')
+
+
+def _css_color(color):
+    try:
+        red, green, blue = color.to('srgb').coordinates
+        return f'rgba({red * 255:.0f}, {green * 255:.0f}, {blue * 255:.0f}, {color.alpha:.3f})'
+    except (AttributeError, TypeError, ValueError):
+        return '#000'
+
+
+class StaticLayer:
+    """الطبقة الثابتة لنسخة من القالب: صفحاتها الجاهزة + مكان وشكل كل حقل متغير"""
+
+    def __init__(self, document, fields):
+        self.document = document
+        # [(VariableNode, رقم الصفحة, CSS الحقل)]
+        self.fields = fields
+
+    def overlay_html(self, context):
+        """HTML طبقة الحقول المتغيرة لإذن واحد - صفحة لكل صفحة في الطبقة الثابتة وبنفس المقاس"""
+        pages = [[] for _ in self.document.pages]
+        for index, (node, page_index, css) in enumerate(self.fields):
+            pages[page_index].append(
+                f'<div class="ov" {FIELD_ATTR}="{index}" style="{css}">{node.render(context)}</div>'
+            )
+
+        first = self.document.pages[0]
+        body = ''.join(
+            f'<div class="ov-page" style="width: {page.width}px; height: {page.height}px;">{"".join(items)}</div>'
+            for page, items in zip(self.document.pages, pages)
+        )
+        return f"""
+            <html>
+                <head>
+                    <meta charset="UTF-8">
+                    <style>
+                        @page {{ size: {first.width}px {first.height}px; margin: 0; }}
+                        body {{ margin: 0; }}
+                        .ov-page {{ position: relative; overflow: hidden; page-break-after: always; }}
+                        .ov-page:last-child {{ page-break-after: auto; }}
+                        .ov {{ position: absolute; white-space: nowrap; overflow: hidden; }}
+                    </style>
+                </head>
+                <body>{body}</body>
+            </html>
+            """
+
+
+def _walk(box, container=None):
+    """(box, أقرب block فيه) لكل box في الشجرة - absolute/float بيبقوا جوه placeholder"""
+    box = getattr(box, '_box', box)
+    yield box, container
+    if isinstance(box, BlockContainerBox):
+        container = box
+    for child in getattr(box, 'children', ()):
+        yield from _walk(child, container)
+
+
+def _field_width(box, container):
+    """المساحة من بداية الحقل لحد طرف الـ block اللي فيه في اتجاه الكتابة (مش أقل من عرض القيمة التجريبية)"""
+    if container is None:
+        return box.width
+    left = container.content_box_x()
+    if box.style['direction'] == 'rtl':
+        available = box.position_x + box.width - left
+    else:
+        available = left + container.width - box.position_x
+    return max(available, box.width)
+
+
+def _overflowing_field(document):
+    """رقم أول حقل قيمته أعرض من المساحة المتاحة له في طبقة الحقول المتغيرة، أو None"""
+    for page in document.pages:
+        for box, _ in _walk(page._page_box):
+            if not isinstance(box, BlockBox) or box.element is None or box.element.get(FIELD_ATTR) is None:
+                continue
+            texts = [child for child in box.descendants() if isinstance(child, TextBox)]
+            if not texts:
+                continue
+            width = max(t.position_x + t.width for t in texts) - min(t.position_x for t in texts)
+            if width > box.width + 0.5:
+                return box.element.get(FIELD_ATTR)
+    return None
+
+
+def _field_css(box, page, width):
+    style = box.style
+    families = ', '.join(f'"{escape(family)}"' for family in style['font_family'])
+    css = [
+        f'top: {box.position_y}px', f'width: {width}px', f'height: {box.height}px', f'line-height: {box.height}px',
+        f'font-family: {families}', f'font-size: {style["font_size"]}px',
+        f'font-weight: {style["font_weight"]}', f'font-style: {style["font_style"]}',
+        f'color: {_css_color(style["color"])}', f'direction: {style["direction"]}',
+    ]
+    if style['direction'] == 'rtl':
+        # النص العربي بيبدأ من اليمين، فالحقل متثبت من طرفه اليمين وبيكبر ناحية الشمال
+        css += [f'right: {page.width - box.position_x - box.width}px', 'text-align: right']
+    else:
+        css += [f'left: {box.position_x}px', 'text-align: left']
+    return '; '.join(css)
+
+
+def build_static_layer(template_obj):
+    """يرسم الطبقة الثابتة ويرجع StaticLayer، أو None لو القالب مينفعش يترسم بالطبقات"""
+    template = Template(build_permission_template_source(template_obj))
+    reason = unsupported_reason(template_obj, template)
+    if reason:
+        logger.info(f'Overlay mode not supported for template {template_obj.pk}: {reason}')
+        return None
+
+    fields = [node for node in template.nodelist.get_nodes_by_type(VariableNode) if _is_variable(node)]
+    for index, node in enumerate(fields):
+        node.render = _marker_render(node, index)
+
+    sample = build_sample_permission(template_obj.institute)
+    html = template.render(build_permission_context(sample, template_obj))
+    document = layout_permission_html(html, template_obj.font_family, output_render_options(template_obj))
+
+    found = {}
+    for page_index, page in enumerate(document.pages):
+        for box, container in _walk(page._page_box):
+            if not isinstance(box, TextBox) or box.element is None:
+                continue
+            index = box.element.get(FIELD_ATTR)
+            if index is None:
+                continue
+            if index in found:
+                logger.info(f'Overlay mode not supported for template {template_obj.pk}: field {index} wraps')
+                return None
+            found[index] = (page_index, _field_css(box, page, _field_width(box, container)))
+
+    layer_fields = []
+    for index, node in enumerate(fields):
+        del node.render
+        if str(index) in found:
+            layer_fields.append((node, *found[str(index)]))
+    return StaticLayer(document, layer_fields)
+
+
+def _marker_render(node, index):
+    original = node.render
+
+    def render(context):
+        # قيمة الإذن التجريبي مخفية: بتحجز مكانها في الـ layout من غير ما تتطبع في الطبقة الثابتة
+        value = original(context) or '&nbsp;'
+        return f'<span {FIELD_ATTR}="{index}" style="visibility: hidden; white-space: nowrap;">{value}</span>'
+
+    return render
+
+
+def static_layer_key(template_obj):
+    institute = template_obj.institute
+    return (
+        template_obj.pk, template_obj.updated_at, template_obj.font_family, template_obj.output_profile,
+        institute.pk, institute.updated_at, institute.registration_officer_id,
+        settings.PDF_IMAGE_DPI, settings.PDF_IMAGE_JPEG_QUALITY,
+    )
+
+
+def get_static_layer(template_obj):
+    """الطبقة الثابتة من كاش الـ thread (LRU)، أو بيرسمها. صفحات WeasyPrint وخطوطها مش thread-safe"""
+    layers = getattr(_local, 'layers', None)
+    if layers is None:
+        layers = _local.layers = OrderedDict()
+
+    key = static_layer_key(template_obj)
+    layer = layers.get(key)
+    if layer is not None:
+        layers.move_to_end(key)
+        if layer is not _UNSUPPORTED:
+            note(cache_hit=True)
+        return None if layer is _UNSUPPORTED else layer
+
+    layer = build_static_layer(template_obj)
+    for stale_key in [k for k in layers if k[0] == template_obj.pk]:
+        del layers[stale_key]
+    layers[key] = _UNSUPPORTED if layer is None else layer
+    while len(layers) > settings.PDF_OVERLAY_CACHE_SIZE:
+        layers.popitem(last=False)
+    return layer
+
+
+def clear_static_layers():
+    layers = getattr(_local, 'layers', None)
+    if layers is not None:
+        layers.clear()
+
+
+class OverlaidPage(Page):
+    """صفحة الطبقة الثابتة ومطبوع فوقها صفحة الحقول المتغيرة"""
+
+    def __init__(self, static_page, overlay_page):
+        # نفس مقاس وروابط الصفحة الثابتة من غير layout جديد
+        self.__dict__.update(static_page.__dict__)
+        self._static_page = static_page
+        self._overlay_page = overlay_page
+
+    def paint(self, stream, scale=1):
+        self._static_page.paint(stream, scale)
+        self._overlay_page.paint(stream, scale)
+
+
+def render_overlay_document(permission, template_obj):
+    """
+    رسم الإذن بالطبقات كـ Document، أو None لو القالب مينفعش (والمفروض الرسم الكامل يكمل).
+    أي خطأ بيترمي زي ما هو عشان generate_permission_pdf يرجع للرسم الكامل.
+    """
+    layer = get_static_layer(template_obj)
+    if layer is None:
+        return None
+
+    institute = permission.institute
+    context = Context({
+        'permission': permission,
+        'client': permission.client,
+        'institute': institute,
+        'program': permission.get_program(),
+        'issued_by': permission.issued_by,
+        'today': printed_date(permission),
+        'registration_officer': institute.registration_officer,
+    })
+    overlay = layout_permission_html(
+        layer.overlay_html(context), template_obj.font_family, output_render_options(template_obj)
+    )
+    if len(overlay.pages) != len(layer.document.pages):
+        raise ValueError(f'Overlay has {len(overlay.pages)} pages, static layer {len(layer.document.pages)}')
+
+    field = _overflowing_field(overlay)
+    if field is not None:
+        logger.info(f'Overlay field {field} overflows for permission {permission.permission_number}, using full render')
+        return None
+
+    pages = [OverlaidPage(static, over) for static, over in zip(layer.document.pages, overlay.pages)]
+    return overlay.copy(pages)
@@ -0,0 +1,315 @@
+"""
+توليد ملفات PDF للأذونات - القالب الخاص بكل معهد مع قالب احتياطي قياسي
+"""
+import logging
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from django.conf import settings
+from django.template import Context, Template
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+from weasyprint import HTML
+
+from core.assets import asset_cache
+from core.fonts import FONT_STACKS, get_font_resources
+from core.images import get_render_image_path
+from core.telemetry import note, render_stage, track_render
+from core.url_fetcher import local_url_fetcher
+from .models import PermissionTemplate
+
+logger = logging.getLogger('edu_system')
+
+
+# ==================== Output Profiles ====================
+
+# خيارات WeasyPrint لكل profile (PermissionTemplate.output_profile). خيارات الصور بتتطبق وقت
+# الـ layout (WeasyPrint بيجهز الصور وقتها)، فبتتبعت لـ render() مش write_pdf()
+PDF_OUTPUT_PROFILES = {
+    PermissionTemplate.OutputProfile.QUALITY: {'optimize_images': False, 'jpeg_quality': None, 'dpi': None},
+    PermissionTemplate.OutputProfile.BALANCED: {'optimize_images': True, 'jpeg_quality': 85, 'dpi': 200},
+    PermissionTemplate.OutputProfile.SMALL: {'optimize_images': True, 'jpeg_quality': 60, 'dpi': 120},
+}
+
+# ثابتة لكل الـ profiles: خطوط subset بس، والـ PDF مضغوط (object streams من PDF 1.5)
+PDF_WRITE_OPTIONS = {'full_fonts': False, 'uncompressed_pdf': False, 'pdf_version': '1.7'}
+
+
+def output_render_options(template_obj=None):
+    """خيارات render() لـ profile القالب (أو الافتراضي لو مفيش قالب)"""
+    profile = getattr(template_obj, 'output_profile', None)
+    return PDF_OUTPUT_PROFILES.get(profile, PDF_OUTPUT_PROFILES[PermissionTemplate.OutputProfile.BALANCED])
+
+
+def write_document_pdf(document, target=None):
+    """كتابة Document لـ PDF بخيارات الضغط الموحدة"""
+    return document.write_pdf(target, **PDF_WRITE_OPTIONS)
+
+
+DEFAULT_TEMPLATE_PATH = 'permissions/default_permission.html'
+
+
+def build_default_html(permission):
+    """HTML القالب الاحتياطي القياسي للإذن"""
+    from django.template.loader import render_to_string
+    
+    context = {
+        'permission': permission,
+        'institute': permission.institute,
+        'client': permission.client,
+        'program': permission.get_program(),
+        'issued_by': permission.issued_by,
+        'logo_path': get_render_image_path(permission.institute, 'logo'),
+    }
+    
+    return render_to_string(DEFAULT_TEMPLATE_PATH, context)
+
+
+def render_default_document(permission):
+    """رسم القالب الاحتياطي القياسي كـ Document (صفحات WeasyPrint) من غير كتابة PDF"""
+    with render_stage('render'):
+        html = build_default_html(permission)
+    with render_stage('layout'):
+        return HTML(
+            string=html,
+            base_url=settings.BASE_DIR,
+            url_fetcher=local_url_fetcher
+        ).render(**output_render_options())
+
+
+def generate_default_pdf(permission):
+    """دالة احتياطية لإنتاج PDF قياسي"""
+    buffer = BytesIO()
+    document = render_default_document(permission)
+    with render_stage('write'):
+        write_document_pdf(document, buffer)
+    buffer.seek(0)
+    return buffer
+
+
+def get_b64(path):
+    """Helper to convert image to base64 - من كاش الملفات المشترك (core.assets)"""
+    return asset_cache.get_b64(path)
+
+
+# ==================== Compiled Template Cache ====================
+
+# القالب المترجم (django Template) لكل قالب معهد - مفتاحه (pk, updated_at, font_family)،
+# فأي تعديل على القالب أو الخط بيطلع مفتاح جديد تلقائياً. القيم المتغيرة (الخلفية/التوقيع/الختم)
+# بتتبعت في الـ context والخطوط كـ stylesheet جاهز (core.fonts)، مش جوه نص القالب، عشان نفس
+# النسخة المترجمة تنفع لكل الأذونات
+_compiled_templates = OrderedDict()
+_compiled_templates_lock = threading.Lock()
+
+
+def build_permission_template_source(template_obj):
+    """نص قالب Django الكامل للمشهد (من غير أي بيانات base64 جواه)"""
+    font_stack = FONT_STACKS.get(template_obj.font_family, FONT_STACKS['arial'])
+
+    return f"""
+        <html>
+            <head>
+                <meta charset="UTF-8">
+                <style>
+                    @page {{ size: {template_obj.page_size} {template_obj.orientation}; margin: 0; }}
+                    body {{ font-family: {font_stack}; direction: rtl; margin: 0; }}
+                    .page-container {{ padding: 1.5cm; box-sizing: border-box; }}
+                    {template_obj.custom_css}
+                    {{{{ background_css }}}}
+                </style>
+            </head>
+            <body>
+                {{{{ background_html }}}}
+                <div class="page-container">
+                    <header>{template_obj.header_content}</header>
+                    <main>{template_obj.body_content}</main>
+                    <footer>{template_obj.footer_content}</footer>
+                </div>
+            </body>
+        </html>
+        """
+
+
+def get_compiled_template(template_obj):
+    """يرجع القالب المترجم من الكاش (LRU محدود الحجم) أو يترجمه مرة واحدة ويخزنه"""
+    key = (template_obj.pk, template_obj.updated_at, template_obj.font_family)
+
+    with _compiled_templates_lock:
+        compiled = _compiled_templates.get(key)
+        if compiled is not None:
+            _compiled_templates.move_to_end(key)
+            note(cache_hit=True)
+            return compiled
+
+    compiled = Template(build_permission_template_source(template_obj))
+
+    with _compiled_templates_lock:
+        # نسخ أقدم من نفس القالب مبقاش ليها لازمة
+        for stale_key in [k for k in _compiled_templates if k[0] == template_obj.pk]:
+            del _compiled_templates[stale_key]
+        _compiled_templates[key] = compiled
+        while len(_compiled_templates) > settings.PDF_TEMPLATE_CACHE_SIZE:
+            _compiled_templates.popitem(last=False)
+
+    return compiled
+
+
+def clear_compiled_templates():
+    with _compiled_templates_lock:
+        _compiled_templates.clear()
+
+
+def build_background_css(background_uri):
+    """CSS علامة الخلفية - background_uri هو data: URI جاهز (core.assets.get_data_uri)"""
+    if not background_uri:
+        return ''
+    return f"""
+                    .bg-watermark {{
+                        position: fixed;
+                        top: 0; left: 0; right: 0; bottom: 0;
+                        width: 100%;
+                        height: 100%;
+                        background-image: url('{background_uri}');
+                        background-size: 100% 100%;
+                        background-position: center;
+                        background-repeat: no-repeat;
+                        z-index: -1;
+                    }}
+            """
+
+
+def _page_args(template_obj):
+    if template_obj is None:
+        return 'A4', 'portrait'
+    return template_obj.page_size, template_obj.orientation
+
+
+def get_render_image_b64(institute, field_name):
+    """Base64 للنسخة المجهزة للطباعة من صورة المعهد (core.images)، أو '' لو مش موجودة"""
+    return get_b64(get_render_image_path(institute, field_name))
+
+
+def printed_date(permission):
+    """
+    التاريخ المطبوع على الإذن ({{ today }}): تاريخ الإصدار المتخزن، فالملف المخزن (permission_pdf_key)
+    مبيتغيرش من يوم للتاني. الإذن التجريبي (المعاينة) لسه متحفظش فبياخد تاريخ النهارده.
+    """
+    return permission.issue_date or timezone.localdate()
+
+
+def build_permission_context(permission, template_obj=None):
+    """Context قالب المعهد: بيانات الإذن + صور المعهد المجهزة للطباعة base64 (من كاش الملفات)"""
+    institute = permission.institute
+
+    background_path = get_render_image_path(institute, 'background_img', *_page_args(template_obj))
+    background_uri = asset_cache.get_data_uri(background_path) if background_path else ''
+    sig_b64 = get_render_image_b64(institute, 'signature_image')
+    stamp_b64 = get_render_image_b64(institute, 'stamp_image')
+
+    return Context({
+        'permission': permission,
+        'client': permission.client,
+        'institute': institute,
+        'program': permission.get_program(),
+        'issued_by': permission.issued_by,
+        'today': printed_date(permission),
+        'sig_b64': sig_b64,
+        'stamp_b64': stamp_b64,
+        'registration_officer': institute.registration_officer,
+        'background_css': mark_safe(build_background_css(background_uri)),
+        'background_html': mark_safe('<div class="bg-watermark"></div>' if background_uri else ''),
+    })
+
+
+def layout_permission_html(html, font_family, render_options=None):
+    """WeasyPrint layout لـ HTML المشهد بالخطوط الجاهزة للقالب (core.fonts) وخيارات الـ profile"""
+    font_stylesheets, font_config = get_font_resources(font_family)
+    return HTML(
+        string=html,
+        base_url=settings.BASE_DIR,
+        url_fetcher=local_url_fetcher
+    ).render(stylesheets=font_stylesheets, font_config=font_config, **(render_options or output_render_options()))
+
+
+def render_permission_document(permission):
+    """رسم الإذن بقالب معهده كـ Document (صفحات WeasyPrint) - أو القالب الاحتياطي لو فشل"""
+
+    institute = permission.institute
+
+    try:
+        template_obj = institute.permission_template
+    except PermissionTemplate.DoesNotExist:
+        note(template=DEFAULT_TEMPLATE_PATH, render_mode='default')
+        return render_default_document(permission)
+
+    note(
+        template=f'template:{template_obj.pk}',
+        template_version=template_obj.updated_at.isoformat() if template_obj.updated_at else '',
+        font_family=template_obj.font_family,
+        output_profile=template_obj.output_profile,
+        render_mode=template_obj.render_mode,
+    )
+
+    if template_obj.render_mode == PermissionTemplate.RenderMode.OVERLAY:
+        from .overlay import render_overlay_document
+
+        try:
+            with render_stage('layout'):
+                document = render_overlay_document(permission, template_obj)
+        except Exception as e:
+            logger.error(f"Overlay PDF render failed for institute {institute.code}, using full render: {e}")
+            document = None
+        if document is not None:
+            return document
+        note(render_mode=PermissionTemplate.RenderMode.FULL)
+
+    with render_stage('context'):
+        context = build_permission_context(permission, template_obj)
+
+    try:
+        with render_stage('compile'):
+            compiled = get_compiled_template(template_obj)
+        with render_stage('render'):
+            final_html = compiled.render(context)
+        with render_stage('layout'):
+            document = layout_permission_html(
+                final_html, template_obj.font_family, output_render_options(template_obj)
+            )
+    except Exception as e:
+        logger.error(f"Custom PDF template failed for institute {institute.code}: {e}")
+        note(fallback=True)
+        return render_default_document(permission)
+
+    return document
+
+
+def generate_permission_pdf(permission):
+    """توليد PDF بناءً على قالب المعهد الخاص - كل رسمة بتتسجل في core.telemetry"""
+    with track_render('permission', institute_id=permission.institute_id):
+        document = render_permission_document(permission)
+
+        buffer = BytesIO()
+        try:
+            with render_stage('write'):
+                write_document_pdf(document, buffer)
+        except Exception as e:
+            logger.error(f"Writing PDF failed for permission {permission.permission_number}: {e}")
+            note(fallback=True)
+            buffer = generate_default_pdf(permission)
+        else:
+            note(pages=len(document.pages))
+
+        note(size=buffer.getbuffer().nbytes)
+        buffer.seek(0)
+        return buffer
+
+
+def render_permission_pdf_bytes(permission_pk):
+    """job لعمليات الرسم (core.render_pool): بيحمّل الإذن بالـ pk ويرجع bytes الـ PDF"""
+    from .models import PermissionSlip
+
+    permission = PermissionSlip.all_objects.select_related(
+        'client', 'institute', 'institute__registration_officer', 'issued_by', 'diploma', 'course'
+    ).get(pk=permission_pk)
+    return generate_permission_pdf(permission).getvalue()
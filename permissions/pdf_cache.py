@@ -0,0 +1,226 @@
+"""
+كاش ملفات PDF للأذونات على الديسك (content-addressed)
+
+كل إذن بيترسم مرة واحدة لكل "نسخة" من مدخلاته (الإذن نفسه، قالب المعهد، صور المعهد،
+الخط)، والملف الناتج بيتخزن في PermissionSlip.pdf_file. أي فتح تاني لنفس الإذن
+بيتقري من الديسك مباشرة بدل ما يعدي على WeasyPrint من جديد.
+"""
+import hashlib
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from core.models import PDFRenderRecord
+from core.render_pool import run_render_job
+from core.singleflight import single_flight, worker_lock
+from core.telemetry import record_render
+from institutes.models import Institute
+from .models import PermissionSlip, PermissionTemplate
+from .pdf import generate_permission_pdf
+
+logger = logging.getLogger('edu_system')
+
+# يتغير يدوياً لما طريقة الرسم نفسها تتغير (كود/ستايل) عشان كل الملفات القديمة تتعمل من جديد
+RENDERER_VERSION = '2'
+
+INSTITUTE_ASSET_FIELDS = ('logo', 'background_img', 'signature_image', 'stamp_image')
+
+# حقول المعهد اللي مبتظهرش في المشهد - تعديلها لوحدها ميغيرش مفتاح الكاش ولا بيمسح الملفات المخزنة
+INSTITUTE_NON_RENDERED_FIELDS = frozenset({'status', 'is_deleted', 'created_at', 'updated_at'})
+
+# render_mode لسجلات الملفات اللي اتقرت من الديسك من غير رسم (core.telemetry)
+STORED_RENDER_MODE = 'stored'
+
+
+def _file_fingerprint(field_file):
+    """بصمة ملف صورة: الاسم + وقت التعديل + الحجم (من غير ما نقرا محتواه)"""
+    if not field_file:
+        return ''
+    try:
+        stat = os.stat(field_file.path)
+    except (OSError, ValueError, NotImplementedError):
+        return field_file.name
+    return f'{field_file.name}:{stat.st_mtime_ns}:{stat.st_size}'
+
+
+def _updated(obj):
+    return obj.updated_at.isoformat() if obj is not None and obj.updated_at else ''
+
+
+def institute_render_fields():
+    """حقول المعهد اللي ممكن تظهر في المشهد (القالب الخاص يقدر يستخدم أي حقل)"""
+    return [field for field in Institute._meta.concrete_fields if field.name not in INSTITUTE_NON_RENDERED_FIELDS]
+
+
+def institute_field_value(institute, field):
+    """قيمة الحقل بنفس شكل قاعدة البيانات (الـ id للـ FK، اسم الملف للصور)"""
+    return field.get_prep_value(field.value_from_object(institute))
+
+
+def _get_template(institute):
+    try:
+        return institute.permission_template
+    except PermissionTemplate.DoesNotExist:
+        return None
+
+
+def permission_pdf_key(permission):
+    """
+    مفتاح الكاش: أي تغيير في الإذن أو قالب المعهد أو صوره أو الخط - أو في مسؤول التسجيل
+    ومصدر الإذن (أسماءهم بتظهر في المشهد) - بيطلع مفتاح جديد
+    """
+    institute = permission.institute
+    template_obj = _get_template(institute)
+
+    parts = [
+        RENDERER_VERSION,
+        permission.pk,
+        permission.status,
+        _updated(permission),
+        _updated(permission.client),
+        _updated(permission.get_program()),
+        *(institute_field_value(institute, field) for field in institute_render_fields()),
+        _updated(institute.registration_officer),
+        permission.issued_by_id or '',
+        _updated(permission.issued_by),
+        settings.PDF_IMAGE_DPI,
+        settings.PDF_IMAGE_JPEG_QUALITY,
+    ]
+    if template_obj is not None:
+        parts += [template_obj.pk, _updated(template_obj), template_obj.font_family, template_obj.output_profile]
+    parts += [_file_fingerprint(getattr(institute, field)) for field in INSTITUTE_ASSET_FIELDS]
+
+    return hashlib.sha256('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+def permission_pdf_last_modified(permission):
+    """آخر تعديل في أي حاجة داخلة في رسم الإذن (للـ Last-Modified) - الـ ETag هو المرجع الأساسي"""
+    objects = [
+        permission, permission.client, permission.get_program(),
+        permission.institute, _get_template(permission.institute),
+        permission.institute.registration_officer, permission.issued_by,
+    ]
+    dates = [obj.updated_at for obj in objects if obj is not None and getattr(obj, 'updated_at', None)]
+    return max(dates) if dates else None
+
+
+def permission_pdf_validators(permission):
+    """(ETag, Last-Modified) لملف PDF الإذن من غير ما نرسمه - الـ ETag هو مفتاح الكاش نفسه"""
+    return permission_pdf_key(permission), permission_pdf_last_modified(permission)
+
+
+def get_cached_pdf(permission, key):
+    """يرجع bytes الملف المخزن لو لسه مطابق للمفتاح، وإلا None"""
+    if not permission.pdf_file or permission.pdf_cache_key != key:
+        return None
+    try:
+        with permission.pdf_file.open('rb') as f:
+            return f.read()
+    except (OSError, ValueError):
+        logger.warning(f'Cached PDF missing on disk for permission {permission.permission_number}')
+        return None
+
+
+def store_pdf(permission, key, data):
+    """يخزن الملف الجديد ويمسح القديم - بـ update() مش save() عشان updated_at ميتغيرش (وإلا المفتاح يبوظ)"""
+    old_name = permission.pdf_file.name if permission.pdf_file else ''
+
+    try:
+        permission.pdf_file.save(f'{permission.permission_number}-{key[:16]}.pdf', ContentFile(data), save=False)
+    except OSError as e:
+        logger.error(f'Could not store PDF for permission {permission.permission_number}: {e}')
+        return
+
+    permission.pdf_cache_key = key
+    permission.pdf_size = len(data)
+    PermissionSlip.all_objects.filter(pk=permission.pk).update(
+        pdf_file=permission.pdf_file.name, pdf_cache_key=key, pdf_size=permission.pdf_size
+    )
+
+    if old_name and old_name != permission.pdf_file.name:
+        _delete_file(permission.pdf_file.storage, old_name)
+
+
+def is_pdf_cached(permission, key=None):
+    """هل الملف المخزن للإذن لسه صالح؟ (من غير ما نقراه)"""
+    key = key or permission_pdf_key(permission)
+    return bool(permission.pdf_file) and permission.pdf_cache_key == key and permission.pdf_file.storage.exists(
+        permission.pdf_file.name
+    )
+
+
+def get_permission_pdf(permission, pool=None, key=None):
+    """نقطة الدخول للـ Views: يرجع bytes الـ PDF من الكاش لو موجود، وإلا يرسمه ويخزنه"""
+    key = key or permission_pdf_key(permission)
+
+    started = time.perf_counter()
+    data = get_cached_pdf(permission, key)
+    if data is not None:
+        record_stored_hit(permission, (time.perf_counter() - started) * 1000)
+        return data
+
+    # الطلبات المتزامنة لنفس المفتاح (في نفس الـ process أو workers تانية) بتستنى رسمة واحدة
+    return single_flight(f'permission-pdf:{key}', lambda: _render_and_store(permission, key, pool))
+
+
+def record_stored_hit(permission, total_ms=0.0):
+    """يسجل في core.telemetry إن ملف الإذن اتبعت من الديسك (أو nginx) من غير رسم"""
+    record_render(
+        PDFRenderRecord.Kind.PERMISSION, total_ms, institute_id=permission.institute_id,
+        render_mode=STORED_RENDER_MODE, cache_hit=True, size=permission.pdf_size,
+    )
+
+
+def _render_and_store(permission, key, pool=None):
+    with worker_lock(f'permission-pdf:{key}') as waited:
+        if waited:
+            # worker تاني كان بيرسم نفس الإذن - غالباً خزّن الملف خلاص
+            permission.refresh_from_db(fields=['pdf_file', 'pdf_cache_key', 'pdf_size'])
+            data = get_cached_pdf(permission, key)
+            if data is not None:
+                return data
+
+        data = render_permission_pdf(permission, pool=pool)
+        store_pdf(permission, key, data)
+        return data
+
+
+def render_permission_pdf(permission, pool=None):
+    """رسم فعلي للـ PDF - في pool العمليات المنفصلة لو مفعّل (ممكن يرمي RenderPoolBusy)"""
+    job = 'permissions.pdf.render_permission_pdf_bytes'
+    if pool is not None:
+        return pool.run(job, permission.pk)
+    if settings.PDF_RENDER_POOL_SIZE <= 0:
+        return generate_permission_pdf(permission).getvalue()
+    return run_render_job(job, permission.pk)
+
+
+def _delete_file(storage, name):
+    try:
+        storage.delete(name)
+    except OSError as e:
+        logger.warning(f'Could not delete stale PDF {name}: {e}')
+
+
+def discard_cached_pdf(permission):
+    """مسح ملف PDF مخزن لإذن واحد (مثلاً بعد تغيير حالته)"""
+    if not permission.pdf_file:
+        return
+    _delete_file(permission.pdf_file.storage, permission.pdf_file.name)
+    PermissionSlip.all_objects.filter(pk=permission.pk).update(pdf_file='', pdf_cache_key='')
+
+
+def invalidate_institute_pdfs(institute_id):
+    """مسح كل ملفات PDF المخزنة لأذونات معهد معين (بعد تعديل القالب أو صور المعهد)"""
+    queryset = PermissionSlip.all_objects.filter(institute_id=institute_id).exclude(pdf_file='')
+    storage = PermissionSlip._meta.get_field('pdf_file').storage
+
+    for name in queryset.values_list('pdf_file', flat=True).iterator():
+        _delete_file(storage, name)
+
+    count = queryset.update(pdf_file='', pdf_cache_key='')
+    if count:
+        logger.info(f'Invalidated {count} cached permission PDFs for institute {institute_id}')
@@ -0,0 +1,67 @@
+"""
+رسم ملف PDF الإذن في الخلفية بمجرد إصداره
+
+بعد ما الإذن يتحفظ (on_commit) بنحط رسمه في طابور threads خلفي داخل نفس الـ process، فأول
+فتح للإذن بعد الإصدار بيلاقي الملف جاهز في PermissionSlip.pdf_file (انظر pdf_cache).
+الرسم نفسه بيروح لـ pool العمليات المنفصلة لو مفعّل (core.render_pool).
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger('edu_system')
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.PDF_PRERENDER_THREADS,
+                    thread_name_prefix='pdf-prerender',
+                )
+    return _executor
+
+
+def prerender_permission_pdf(permission_pk):
+    """يرسم ويخزن PDF إذن واحد (لو مش متخزن بالفعل بنفس المفتاح)"""
+    from .models import PermissionSlip
+    from .pdf_cache import get_permission_pdf
+
+    try:
+        permission = PermissionSlip.objects.select_related(
+            'client', 'institute', 'institute__registration_officer', 'issued_by', 'diploma', 'course'
+        ).filter(pk=permission_pk).first()
+        if permission is not None:
+            get_permission_pdf(permission)
+    except Exception as e:
+        logger.error(f'Background PDF render failed for permission {permission_pk}: {e}')
+    finally:
+        with _pending_lock:
+            _pending.discard(permission_pk)
+        close_old_connections()
+
+
+def _submit(permission_pk):
+    with _pending_lock:
+        if permission_pk in _pending:
+            return
+        _pending.add(permission_pk)
+    _get_executor().submit(prerender_permission_pdf, permission_pk)
+
+
+def schedule_permission_pdf(permission):
+    """يحجز رسم الـ PDF في الخلفية بعد نجاح الـ transaction الحالي"""
+    if not settings.PDF_PRERENDER_ON_ISSUE:
+        return
+    permission_pk = permission.pk
+    transaction.on_commit(lambda: _submit(permission_pk))
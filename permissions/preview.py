@@ -0,0 +1,163 @@
+"""
+معاينة قالب PDF وقت التعديل (صفحة تعديل القالب) من غير حفظ ومن غير إذن حقيقي
+
+- المسودة (محتوى الحقول الحالي في الفورم) بتترسم على إذن تجريبي ثابت في الذاكرة
+  (مش بيتحفظ في قاعدة البيانات) بنفس مسار الرسم الفعلي (permissions.pdf) وفي pool العمليات.
+- النتيجة بتتخزن في كاش Django بمفتاح بصمة المسودة (المحتوى + صور المعهد + إعدادات الصور)،
+  فرجوع المسودة لنسخة اتعرضت قبل كده مش بيعيد الرسم.
+- first_page: معاينة صفحة واحدة - الملف الراجع فيه الصفحة الأولى بس. الـ layout (أغلى مرحلة) بيتعمل
+  للمستند كله عشان تقسيم الصفحات يطلع زي الإذن الفعلي، فالتوفير في كتابة الملف وحجمه بس مش في الرسم.
+- كل محرر (مستخدم + معهد) بيرسم معاينة واحدة بس في نفس الوقت، وكل طلب معاه رقم تسلسلي (seq):
+  الطلب اللي وصل بعده طلب أحدث بيتلغي قبل ما يترسم (superseded)، فالكتابة السريعة مش بتملا
+  عمليات الرسم بمعاينات محدش هيشوفها.
+"""
+import hashlib
+import logging
+import time
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template import Template
+
+from core.render_pool import RenderPoolBusy, run_render_job
+from .models import PermissionSlip, PermissionTemplate
+from .pdf import (
+    build_permission_context, build_permission_template_source, layout_permission_html, output_render_options,
+    write_document_pdf,
+)
+
+logger = logging.getLogger('edu_system')
+
+DRAFT_FIELDS = ('header_content', 'body_content', 'footer_content', 'custom_css', 'page_size', 'orientation',
+                'font_family', 'output_profile')
+
+PREVIEW_CACHE_PREFIX = 'pdf-preview'
+
+# فترة إعادة المحاولة على قفل المحرر (ثانية)
+LOCK_POLL_INTERVAL = 0.1
+
+
+class PreviewSuperseded(Exception):
+    """وصل طلب معاينة أحدث لنفس المحرر - الطلب ده مبقاش له لازمة"""
+
+
+def draft_from_data(data, template_obj=None):
+    """المسودة (dict) من بيانات الفورم - الحقول الناقصة من القالب المحفوظ أو القيم الافتراضية"""
+    defaults = {
+        'header_content': '', 'body_content': '', 'footer_content': '', 'custom_css': '',
+        'page_size': 'A4', 'orientation': 'portrait', 'font_family': PermissionTemplate.FontChoice.ARIAL,
+        'output_profile': PermissionTemplate.OutputProfile.BALANCED,
+    }
+    if template_obj is not None:
+        defaults.update({field: getattr(template_obj, field) for field in DRAFT_FIELDS})
+
+    draft = {field: data.get(field, defaults[field]) for field in DRAFT_FIELDS}
+    if draft['font_family'] not in PermissionTemplate.FontChoice.values:
+        draft['font_family'] = defaults['font_family']
+    if draft['output_profile'] not in PermissionTemplate.OutputProfile.values:
+        draft['output_profile'] = defaults['output_profile']
+    return draft
+
+
+def preview_key(institute, draft, first_page=False):
+    """بصمة المعاينة: المسودة + آخر تعديل للمعهد (صوره) + إعدادات نسخ الصور"""
+    parts = [
+        institute.pk, institute.updated_at.isoformat() if institute.updated_at else '',
+        settings.PDF_IMAGE_DPI, settings.PDF_IMAGE_JPEG_QUALITY, int(bool(first_page)),
+        *(draft[field] for field in DRAFT_FIELDS),
+    ]
+    digest = hashlib.sha256('\x1f'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return f'{PREVIEW_CACHE_PREFIX}:{digest}'
+
+
+def build_sample_permission(institute):
+    """إذن تجريبي في الذاكرة (مش بيتحفظ) ببيانات ثابتة لكل متغيرات القالب"""
+    from accounts.models import User
+    from clients.models import Client
+    from programs.models import Diploma
+
+    today = date.today()
+    client = Client(
+        first_name='محمد', last_name='أحمد', full_name='محمد أحمد عبد الله',
+        national_id='1000000000', gender=Client.Gender.MALE, birth_date=date(2000, 1, 1),
+        phone='0500000000', address='الرياض', institute=institute,
+    )
+    diploma = Diploma(
+        name='دبلومة تجريبية', code='PREVIEW', duration_months=12,
+        start_date=today, end_date=today + timedelta(days=365),
+    )
+    issued_by = User(username='preview', first_name='موظف', last_name='تجريبي')
+
+    return PermissionSlip(
+        permission_number='PRM-PREVIEW', client=client, institute=institute, diploma=diploma,
+        program_type='diploma', issued_by=issued_by, issue_date=today,
+        expiry_date=today + timedelta(days=365), status=PermissionSlip.Status.ACTIVE,
+    )
+
+
+def render_preview_document(institute_pk, draft):
+    """رسم المسودة على الإذن التجريبي كـ Document - أي خطأ في القالب بيترمي زي ما هو (مفيش قالب احتياطي)"""
+    from institutes.models import Institute
+
+    institute = Institute.objects.select_related('registration_officer').get(pk=institute_pk)
+    template_obj = PermissionTemplate(institute=institute, **draft)
+    context = build_permission_context(build_sample_permission(institute), template_obj)
+
+    # القالب المترجم مش بيتخزن في كاش القوالب (get_compiled_template) لأن المسودة مالهاش pk
+    html = Template(build_permission_template_source(template_obj)).render(context)
+    return layout_permission_html(html, template_obj.font_family, output_render_options(template_obj))
+
+
+def render_preview_pdf_bytes(institute_pk, draft, first_page=False):
+    """job لعمليات الرسم (core.render_pool): المسودة على الإذن التجريبي -> bytes الـ PDF (صفحة واحدة لو first_page)"""
+    document = render_preview_document(institute_pk, draft)
+    if first_page and len(document.pages) > 1:
+        document = document.copy(document.pages[:1])
+    return write_document_pdf(document)
+
+
+def _editor_keys(user, institute):
+    base = f'{PREVIEW_CACHE_PREFIX}:editor:{user.pk}:{institute.pk}'
+    return f'{base}:seq', f'{base}:lock'
+
+
+def _is_superseded(seq_key, seq):
+    latest = cache.get(seq_key)
+    return latest is not None and latest > seq
+
+
+def get_template_preview(institute, draft, user, seq=0, first_page=False):
+    """
+    يرجع (bytes الـ PDF، من الكاش ولا لأ). بيرمي PreviewSuperseded لو وصل طلب أحدث لنفس المحرر
+    قبل ما الرسم يبدأ، و RenderPoolBusy لو المحرر فضل مستني الرسم السابق أكتر من
+    PDF_RENDER_QUEUE_TIMEOUT.
+    """
+    key = preview_key(institute, draft, first_page)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached, True
+
+    seq_key, lock_key = _editor_keys(user, institute)
+    timeout = settings.PDF_PREVIEW_CACHE_TIMEOUT
+    if _is_superseded(seq_key, seq):
+        raise PreviewSuperseded()
+    cache.set(seq_key, seq, timeout)
+
+    deadline = time.monotonic() + settings.PDF_RENDER_QUEUE_TIMEOUT
+    while not cache.add(lock_key, seq, settings.PDF_RENDER_TIMEOUT):
+        if _is_superseded(seq_key, seq):
+            raise PreviewSuperseded()
+        if time.monotonic() >= deadline:
+            raise RenderPoolBusy('Template preview is still rendering', retry_after=1)
+        time.sleep(LOCK_POLL_INTERVAL)
+
+    try:
+        if _is_superseded(seq_key, seq):
+            raise PreviewSuperseded()
+        data = run_render_job('permissions.preview.render_preview_pdf_bytes', institute.pk, draft, first_page)
+    finally:
+        cache.delete(lock_key)
+
+    cache.set(key, data, timeout)
+    return data, False
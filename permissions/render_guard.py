@@ -0,0 +1,113 @@
+"""
+حماية تكلفة الرسم عند حفظ قالب PDF
+
+القالب HTML/CSS حر، فقالب تقيل واحد (جداول ضخمة، nesting عميق، CSS معقد) بيبطّأ كل أذونات المعهد.
+قبل الحفظ القالب بيترسم تجريبياً على الإذن التجريبي (permissions.preview) في process منفصل جديد
+بمهلة وحد ذاكرة (core.render_pool.run_sandboxed_job)، والقياسات (وقت الرسم، عدد الصفحات، حجم
+الملف) بتتسجل على القالب. وقت الرسم بيتقاس على رسمة تانية بعد رسمة تسخين، لأن أول رسمة في process
+جديد فيها subset الخطوط وتجهيز FontConfiguration/Pango وتحميل Django - ودي مش تكلفة القالب نفسه.
+لو القالب عدّى أي حد من PDF_TEMPLATE_MAX_* أو فشل في الرسم الحفظ بيترفض برسالة واضحة.
+
+PDF_TEMPLATE_GUARD_SANDBOX = False معناها القياس بيحصل في نفس الـ process (للتطوير والاختبارات)،
+ووقتها مفيش حد ذاكرة.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from core.render_pool import RenderPoolError, RenderTimeout, run_sandboxed_job
+from .pdf import write_document_pdf
+from .preview import DRAFT_FIELDS, render_preview_document
+
+logger = logging.getLogger('edu_system')
+
+MEASURE_JOB = 'permissions.render_guard.measure_template_render'
+
+
+def measure_template_render(institute_pk, draft):
+    """job الـ sandbox: يرسم المسودة مرة للتسخين، ويرجع {render_ms, pages, size} للرسمة التانية"""
+    write_document_pdf(render_preview_document(institute_pk, draft))
+
+    started = time.perf_counter()
+    document = render_preview_document(institute_pk, draft)
+    pdf_bytes = write_document_pdf(document)
+    return {
+        'render_ms': round((time.perf_counter() - started) * 1000),
+        'pages': len(document.pages),
+        'size': len(pdf_bytes),
+    }
+
+
+def _measure(institute_pk, draft):
+    if not settings.PDF_TEMPLATE_GUARD_SANDBOX:
+        return import_string(MEASURE_JOB)(institute_pk, draft)
+    return run_sandboxed_job(
+        MEASURE_JOB, institute_pk, draft,
+        timeout=settings.PDF_TEMPLATE_GUARD_TIMEOUT,
+        max_memory_mb=settings.PDF_TEMPLATE_GUARD_MEMORY_MB,
+    )
+
+
+def _limit_errors(metrics):
+    errors = []
+    if metrics['render_ms'] > settings.PDF_TEMPLATE_MAX_RENDER_MS:
+        errors.append(
+            f'وقت رسم الإذن {metrics["render_ms"]}ms أكبر من الحد المسموح '
+            f'({settings.PDF_TEMPLATE_MAX_RENDER_MS}ms)'
+        )
+    if metrics['pages'] > settings.PDF_TEMPLATE_MAX_PAGES:
+        errors.append(
+            f'الإذن طالع {metrics["pages"]} صفحات والحد الأقصى {settings.PDF_TEMPLATE_MAX_PAGES}'
+        )
+    if metrics['size'] > settings.PDF_TEMPLATE_MAX_BYTES:
+        errors.append(
+            f'حجم ملف الإذن {metrics["size"] // 1024}KB أكبر من الحد المسموح '
+            f'({settings.PDF_TEMPLATE_MAX_BYTES // 1024}KB)'
+        )
+    return errors
+
+
+def apply_render_metrics(template_obj, metrics):
+    template_obj.render_time_ms = metrics['render_ms']
+    template_obj.render_pages = metrics['pages']
+    template_obj.render_size = metrics['size']
+    template_obj.render_checked_at = timezone.now()
+
+
+def check_template_render_cost(template_obj, metrics=None):
+    """
+    يقيس تكلفة رسم القالب (قبل حفظه) ويسجلها على الـ instance من غير حفظ، أو يرمي ValidationError
+    لو عدّى الحدود أو فشل في الرسم. metrics: قياسات جاهزة (لنفس المحتوى) بدل الرسم من جديد.
+    يرجع القياسات، أو None لو الحماية مقفولة (PDF_TEMPLATE_GUARD_ENABLED).
+    """
+    if not settings.PDF_TEMPLATE_GUARD_ENABLED:
+        return None
+
+    if metrics is None:
+        draft = {field: getattr(template_obj, field) for field in DRAFT_FIELDS}
+        try:
+            metrics = _measure(template_obj.institute_id, draft)
+        except RenderTimeout:
+            raise ValidationError(
+                f'رسم القالب أخد أكتر من {settings.PDF_TEMPLATE_GUARD_TIMEOUT} ثانية - القالب تقيل جداً'
+            )
+        except RenderPoolError as e:
+            if 'MemoryError' in str(e):
+                raise ValidationError(
+                    f'رسم القالب عدّى حد الذاكرة ({settings.PDF_TEMPLATE_GUARD_MEMORY_MB}MB) - القالب تقيل جداً'
+                )
+            raise ValidationError(f'فشل رسم القالب: {e}')
+        except Exception as e:
+            raise ValidationError(f'فشل رسم القالب: {e}')
+
+    errors = _limit_errors(metrics)
+    if errors:
+        logger.warning(f'PDF template for institute {template_obj.institute_id} rejected: {metrics}')
+        raise ValidationError(errors)
+
+    apply_render_metrics(template_obj, metrics)
+    return metrics
@@ -1,11 +1,17 @@
 import logging
 
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.core.mail import EmailMultiAlternatives
 from django.template.loader import render_to_string
 # استيراد الموديل الصحيح للأذونات
-from .models import PermissionSlip
+from core.images import BACKGROUND_FIELD, IMAGE_SPECS, build_institute_derivatives
+from institutes.models import Institute
+from .eligibility import refresh_eligibility
+from .models import PermissionSlip, PermissionTemplate
+from .pdf_cache import (
+    discard_cached_pdf, institute_field_value, institute_render_fields, invalidate_institute_pdfs
+)
 
 logger = logging.getLogger('edu_system')
 
@@ -38,4 +44,76 @@ def send_auto_email(sender, instance, created, **kwargs):
             msg.send()
             logger.info(f'Permission email sent successfully to {to}')
         except Exception as e:
-            logger.error(f'Error sending permission email: {str(e)}')
\ No newline at end of file
+            logger.error(f'Error sending permission email: {str(e)}')
+
+
+# ==================== Eligibility Index ====================
+
+@receiver(post_delete, sender=PermissionSlip)
+def refresh_eligibility_on_delete(sender, instance, **kwargs):
+    # الحفظ بيحدّث الفهرس من PermissionSlip.save؛ الحذف النهائي (حتى من queryset) بيعدي من هنا
+    refresh_eligibility(instance.client_id, instance.institute_id)
+
+
+# ==================== PDF Cache Invalidation ====================
+
+@receiver(post_save, sender=PermissionSlip)
+def discard_stale_permission_pdf(sender, instance, created, **kwargs):
+    # أي save() للإذن (تغيير الحالة/الإلغاء/الحذف الناعم) بيغير updated_at فالملف المخزن بقى قديم
+    if not created:
+        discard_cached_pdf(instance)
+
+
+@receiver(post_save, sender=PermissionTemplate)
+def invalidate_pdfs_on_template_change(sender, instance, **kwargs):
+    invalidate_institute_pdfs(instance.institute_id)
+
+
+INSTITUTE_IMAGE_FIELDS = frozenset({*IMAGE_SPECS, BACKGROUND_FIELD})
+
+
+@receiver(pre_save, sender=Institute)
+def remember_institute_render_changes(sender, instance, update_fields=None, raw=False, **kwargs):
+    """
+    الحقول اللي بتظهر في المشهد واتغيرت في الحفظ ده (instance._render_changes) - None لو المعهد جديد
+    أو مقدرناش نعرف. تغيير الحالة أو حفظ من غير تعديل ميمسحش الملفات ولا يعيد الصور.
+    """
+    instance._render_changes = None
+    if raw or instance.pk is None:
+        return
+
+    fields = institute_render_fields()
+    if update_fields is not None:
+        fields = [field for field in fields if field.name in update_fields or field.attname in update_fields]
+        if not fields:
+            instance._render_changes = set()
+            return
+
+    previous = Institute.all_objects.filter(pk=instance.pk).values(*(field.attname for field in fields)).first()
+    if previous is None:
+        return
+    instance._render_changes = {
+        field.name for field in fields if previous[field.attname] != institute_field_value(instance, field)
+    }
+
+
+@receiver(post_save, sender=Institute)
+def invalidate_pdfs_on_institute_change(sender, instance, created, **kwargs):
+    # بيانات المعهد وصوره (اللوجو/الخلفية/التوقيع/الختم) جزء من كل مشهد صادر منه
+    changes = getattr(instance, '_render_changes', None)
+    if not created and (changes is None or changes):
+        invalidate_institute_pdfs(instance.pk)
+
+
+@receiver(post_save, sender=Institute)
+def build_render_images_on_institute_save(sender, instance, created, **kwargs):
+    # نسخ صور المعهد المجهزة للطباعة (مصغرة ومن غير metadata) بتتعمل مرة لما الصور تتغير بدل وقت الرسم
+    changes = getattr(instance, '_render_changes', None)
+    if not created and changes is not None and not changes & INSTITUTE_IMAGE_FIELDS:
+        return
+    try:
+        template_obj = instance.permission_template
+        page_size, orientation = template_obj.page_size, template_obj.orientation
+    except PermissionTemplate.DoesNotExist:
+        page_size, orientation = 'A4', 'portrait'
+    build_institute_derivatives(instance, page_size, orientation)
@@ -1,3 +1,932 @@
-from django.test import TestCase
+"""
+Tests for Permissions App
+اختبارات تطبيق الأذونات
+"""
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import zipfile
+from datetime import date
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+from PIL import Image
+from pypdf import PdfReader
+
+from core.models import PDFRenderRecord
+from core.render_pool import RenderPoolBusy
+from core.telemetry import flush_render_records
+from institutes.models import Institute
+from clients.models import Client
+from programs.models import Diploma
+from .models import ActivePermissionIndex, PermissionNumberSequence, PermissionSlip, PermissionTemplate
+from .utils import blocking_info
+from . import batch, eligibility, numbering, overlay, pdf, pdf_cache, prerender, preview, render_guard
+
+User = get_user_model()
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+class PermissionTestMixin:
+    """بيانات أساسية مشتركة لاختبارات الأذونات"""
+
+    def setUp(self):
+        self.institute = self.create_institute('TEST001', name='Test Institute')
+        self.employee = User.objects.create_user(
+            username='employee',
+            password='testpass123',
+            role=User.Role.EMPLOYEE,
+            institute=self.institute
+        )
+        self.client_obj = Client.objects.create(
+            first_name='Test',
+            last_name='Client',
+            national_id='1234567890',
+            gender='male',
+            birth_date='1990-01-01',
+            phone='0123456789',
+            address='Test',
+            institute=self.institute,
+            registered_by=self.employee
+        )
+        self.diploma = Diploma.objects.create(
+            name='Software Engineering',
+            code='SE2024',
+            start_date=date(2026, 1, 1),
+            end_date=date(2027, 1, 1),
+        )
+        self.diploma.institutes.add(self.institute)
+        self.permission = PermissionSlip.objects.create(
+            client=self.client_obj,
+            institute=self.institute,
+            diploma=self.diploma,
+            issued_by=self.employee,
+            expiry_date=date(2027, 1, 1),
+        )
+
+    def create_institute(self, code, name='Other Institute', **fields):
+        """فرع للاختبار بكود (ورقم ترخيص) مختلف"""
+        return Institute.objects.create(
+            name=name, code=code, license_number=f'LIC-{code}', address='Test', city='Test', region='Test',
+            phone='1234567890', **fields
+        )
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class PermissionPDFCacheTests(PermissionTestMixin, TestCase):
+    """اختبارات كاش ملفات PDF على الديسك"""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def _render(self):
+        with mock.patch.object(pdf_cache, 'generate_permission_pdf',
+                               return_value=BytesIO(b'%PDF-test')) as render:
+            data = pdf_cache.get_permission_pdf(self.permission)
+        return data, render.call_count
+
+    def test_second_request_served_from_disk(self):
+        """اختبار إن الفتح التاني لنفس الإذن ميعيدش الرسم"""
+        data, calls = self._render()
+        self.assertEqual(data, b'%PDF-test')
+        self.assertEqual(calls, 1)
+
+        self.permission.refresh_from_db()
+        self.assertTrue(self.permission.pdf_file)
+
+        data, calls = self._render()
+        self.assertEqual(data, b'%PDF-test')
+        self.assertEqual(calls, 0)
+
+    def test_disk_hit_recorded(self):
+        """اختبار إن قراءة الملف المخزن بتتسجل في قياسات الرسم كـ cache hit"""
+        self._render()
+        self.permission.refresh_from_db()
+        flush_render_records()
+        PDFRenderRecord.objects.all().delete()
+
+        self._render()
+        flush_render_records()
+        record = PDFRenderRecord.objects.get()
+        self.assertEqual((record.render_mode, record.cache_hit, record.size), ('stored', True, len(b'%PDF-test')))
+        self.assertEqual(record.institute_id, self.institute.pk)
+
+    def test_pdf_size_recorded(self):
+        """اختبار إن حجم الملف بيتسجل على الإذن ويظهر في تقرير الأحجام"""
+        self._render()
+        self.permission.refresh_from_db()
+        self.assertEqual(self.permission.pdf_size, len(b'%PDF-test'))
+
+        out = StringIO()
+        call_command('pdf_size_report', '--json', stdout=out)
+        row = json.loads(out.getvalue())[0]
+        self.assertEqual((row['institute_id'], row['rendered'], row['avg_bytes']), (self.institute.pk, 1, 9))
+
+    def test_status_change_invalidates(self):
+        """اختبار إن تغيير حالة الإذن بيمسح الملف المخزن"""
+        self._render()
+        self.permission.refresh_from_db()
+        self.permission.status = PermissionSlip.Status.CANCELLED
+        self.permission.save()
+
+        self.permission.refresh_from_db()
+        self.assertFalse(self.permission.pdf_file)
+        _, calls = self._render()
+        self.assertEqual(calls, 1)
+
+    def test_officer_and_issuer_changes_change_key(self):
+        """اختبار إن تعديل مسؤول التسجيل أو مصدر الإذن (الاسم بيظهر في المشهد) بيغير مفتاح الكاش"""
+        self.institute.registration_officer = self.employee
+        self.institute.save()
+        key = pdf_cache.permission_pdf_key(self.permission)
+
+        self.employee.first_name = 'Renamed'
+        self.employee.save()
+        self.permission.refresh_from_db()
+        self.assertNotEqual(pdf_cache.permission_pdf_key(self.permission), key)
+
+    def test_printed_date_is_issue_date(self):
+        """اختبار إن التاريخ المطبوع هو تاريخ الإصدار المتخزن مش يوم الرسم، فالملف المخزن مبيبقاش قديم"""
+        PermissionSlip.objects.filter(pk=self.permission.pk).update(issue_date=date(2026, 1, 5))
+        self.permission.refresh_from_db()
+        with mock.patch('django.utils.timezone.localdate', return_value=date(2026, 3, 1)):
+            context = pdf.build_permission_context(self.permission)
+        self.assertEqual(context['today'], date(2026, 1, 5))
+
+    def test_institute_save_invalidates_only_rendered_changes(self):
+        """اختبار إن حفظ المعهد من غير تعديل في بيانات المشهد ميمسحش الملفات ولا يعيد الصور"""
+        self._render()
+        with mock.patch('permissions.signals.build_institute_derivatives') as rebuild:
+            self.institute.status = Institute.Status.SUSPENDED
+            self.institute.save()
+            self.institute.save(update_fields=['status'])
+            self.permission.refresh_from_db()
+            self.assertTrue(self.permission.pdf_file)
+            _, calls = self._render()
+            self.assertEqual(calls, 0)
+
+            self.institute.name = 'Renamed Institute'
+            self.institute.save()
+            self.permission.refresh_from_db()
+            self.assertFalse(self.permission.pdf_file)
+        rebuild.assert_not_called()
+
+    def test_template_change_invalidates(self):
+        """اختبار إن تعديل قالب المعهد بيمسح ملفات أذوناته"""
+        self._render()
+        PermissionTemplate.objects.create(
+            institute=self.institute,
+            header_content='<h1>{{ institute.name }}</h1>',
+            body_content='{{ client.full_name }}',
+            footer_content='',
+        )
+
+        self.permission.refresh_from_db()
+        self.assertFalse(self.permission.pdf_file)
+        _, calls = self._render()
+        self.assertEqual(calls, 1)
+
+    def test_prerender_on_issue(self):
+        """اختبار إن الإصدار بيرسم الملف في الخلفية بعد الـ commit، وبعدها الفتح من الديسك"""
+        with mock.patch.object(prerender, '_submit', side_effect=prerender.prerender_permission_pdf), \
+                mock.patch.object(pdf_cache, 'generate_permission_pdf', return_value=BytesIO(b'%PDF-test')):
+            with self.captureOnCommitCallbacks(execute=True):
+                prerender.schedule_permission_pdf(self.permission)
+
+        self.permission.refresh_from_db()
+        self.assertTrue(pdf_cache.is_pdf_cached(self.permission))
+        _, calls = self._render()
+        self.assertEqual(calls, 0)
+
+    def test_waiting_worker_reads_stored_file(self):
+        """اختبار إن الطلب اللي استنى worker تاني بياخد الملف المخزن من غير ما يرسم تاني"""
+        self._render()
+        self.permission.refresh_from_db()
+        key = self.permission.pdf_cache_key
+        stale = PermissionSlip.objects.get(pk=self.permission.pk)
+        stale.pdf_file, stale.pdf_cache_key = '', ''
+
+        with mock.patch.object(pdf_cache, 'worker_lock') as lock, \
+                mock.patch.object(pdf_cache, 'generate_permission_pdf') as render:
+            lock.return_value.__enter__.return_value = True
+            data = pdf_cache.get_permission_pdf(stale, key=key)
+        self.assertEqual(data, b'%PDF-test')
+        render.assert_not_called()
+
+
+class CompiledTemplateCacheTests(PermissionTestMixin, TestCase):
+    """اختبارات كاش القوالب المترجمة"""
+
+    def setUp(self):
+        super().setUp()
+        pdf.clear_compiled_templates()
+        self.template = PermissionTemplate.objects.create(
+            institute=self.institute,
+            header_content='<h1>{{ institute.name }}</h1>',
+            body_content='{{ client.full_name }}',
+            footer_content='',
+        )
+
+    def test_compiled_once_per_version(self):
+        """اختبار إن القالب بيتترجم مرة واحدة لحد ما يتعدل"""
+        first = pdf.get_compiled_template(self.template)
+        self.assertIs(pdf.get_compiled_template(self.template), first)
+
+        self.template.body_content = '{{ client.national_id }}'
+        self.template.save()
+        self.assertIsNot(pdf.get_compiled_template(self.template), first)
+
+    def test_output_profile_options(self):
+        """اختبار إن profile القالب بيوصل لـ WeasyPrint (ضغط الصور) والكتابة بخطوط subset ومضغوطة"""
+        self.template.output_profile = PermissionTemplate.OutputProfile.SMALL
+        self.template.save()
+        self.institute.refresh_from_db()
+        with mock.patch.object(pdf, 'HTML') as html:
+            pdf.generate_permission_pdf(self.permission)
+
+        render_kwargs = html.return_value.render.call_args.kwargs
+        self.assertTrue(render_kwargs['optimize_images'])
+        self.assertEqual(render_kwargs['jpeg_quality'], 60)
+        write_kwargs = html.return_value.render.return_value.write_pdf.call_args.kwargs
+        self.assertFalse(write_kwargs['full_fonts'])
+        self.assertFalse(write_kwargs['uncompressed_pdf'])
+
+    def test_render_telemetry_recorded(self):
+        """اختبار إن كل رسمة بتتسجل بزمن المراحل والحجم وهوية القالب، والرسمة التانية من كاش القالب"""
+        flush_render_records()
+        # الكتابة بتستنى commit الـ transaction (هنا transaction الاختبار)
+        with override_settings(PDF_TELEMETRY_BATCH_SIZE=1), self.captureOnCommitCallbacks(execute=True):
+            pdf.generate_permission_pdf(self.permission)
+            pdf.generate_permission_pdf(self.permission)
+
+        first, second = PDFRenderRecord.objects.filter(institute=self.institute).order_by('created_at', 'pk')
+        self.assertEqual((first.kind, first.template, first.fallback), ('permission', f'template:{self.template.pk}', False))
+        self.assertTrue({'context', 'compile', 'render', 'layout', 'write'} <= set(first.stages))
+        self.assertEqual(first.pages, 1)
+        self.assertGreater(first.size, 0)
+        self.assertFalse(first.cache_hit)
+        self.assertTrue(second.cache_hit)
+
+    def test_dynamic_assets_not_in_source(self):
+        """اختبار إن الـ base64 (الخطوط والخلفية) مش جوه نص القالب"""
+        self.template.font_family = PermissionTemplate.FontChoice.CAIRO
+        source = pdf.build_permission_template_source(self.template)
+        self.assertNotIn('base64', source)
+        self.assertIn('{{ background_css }}', source)
+
+
+class EligibilityIndexTests(PermissionTestMixin, TestCase):
+    """اختبارات فهرس الأهلية للإصدار"""
+
+    def setUp(self):
+        super().setUp()
+        self.other_institute = self.create_institute('TEST009')
+
+    def test_blocked_existing_and_free(self):
+        """اختبار قرار الإصدار من الفهرس في استعلام واحد"""
+        with self.assertNumQueries(1):
+            blocking, existing = eligibility.find_active_permissions(self.client_obj, self.institute.pk)
+        self.assertEqual((blocking, existing), (None, self.permission))
+
+        blocking, existing = eligibility.find_active_permissions(self.client_obj, str(self.other_institute.pk))
+        self.assertEqual((blocking, existing), (self.permission, None))
+        self.assertEqual(blocking_info(blocking)['contact_name'], self.institute.name)
+
+    def test_index_follows_cancel_and_soft_delete(self):
+        """اختبار إن الإلغاء والحذف الناعم والحذف النهائي بيشيلوا الإذن من الفهرس"""
+        newer = PermissionSlip.objects.create(
+            client=self.client_obj, institute=self.institute, diploma=self.diploma,
+            issued_by=self.employee, expiry_date=date(2027, 1, 1),
+        )
+        self.assertEqual(eligibility.find_active_permissions(self.client_obj, self.institute.pk)[1], newer)
+
+        newer.status = PermissionSlip.Status.CANCELLED
+        newer.save()
+        self.assertEqual(eligibility.find_active_permissions(self.client_obj, self.institute.pk)[1], self.permission)
+
+        self.permission.soft_delete()
+        self.assertEqual(eligibility.find_active_permissions(self.client_obj, self.institute.pk), (None, None))
+
+        newer.status = PermissionSlip.Status.ACTIVE
+        newer.save()
+        newer.delete()
+        self.assertFalse(ActivePermissionIndex.objects.exists())
+
+    def test_issue_permission_locks_client_before_check(self):
+        """اختبار إن الإصدار بيقفل العميل قبل الفحص، وبيرفض من غير حفظ لو فيه إذن نشط"""
+        permission = PermissionSlip(
+            client=self.client_obj, institute=self.other_institute, diploma=self.diploma,
+            expiry_date=date(2027, 1, 1),
+        )
+        with CaptureQueriesContext(connection) as queries:
+            blocking, existing = eligibility.issue_permission(permission)
+
+        self.assertEqual((blocking, existing), (self.permission, None))
+        self.assertIsNone(permission.pk)
+        self.assertEqual(PermissionSlip.objects.count(), 1)
+        first_lock = next(i for i, q in enumerate(queries.captured_queries) if 'clients_client' in q['sql'])
+        first_check = next(
+            i for i, q in enumerate(queries.captured_queries) if 'permissions_activepermissionindex' in q['sql']
+        )
+        self.assertLess(first_lock, first_check)
+        self.assertEqual(permission.permission_number, '')
+
+        self.permission.status = PermissionSlip.Status.CANCELLED
+        self.permission.save()
+        self.assertEqual(eligibility.issue_permission(permission), (None, None))
+        self.assertEqual(eligibility.find_active_permissions(self.client_obj, self.other_institute.pk)[1], permission)
+
+    def test_rebuild_command_repairs_drift(self):
+        """اختبار إن أمر المراجعة بيكتشف الفروق ويصلحها"""
+        ActivePermissionIndex.objects.all().delete()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_eligibility_index', '--check', stdout=StringIO())
+
+        call_command('rebuild_eligibility_index', stdout=StringIO())
+        self.assertEqual(eligibility.verify_index(), {'missing': [], 'stale': [], 'extra': []})
+        self.assertEqual(ActivePermissionIndex.objects.get().permission, self.permission)
+
+
+class PermissionNumberTests(PermissionTestMixin, TestCase):
+    """اختبارات أرقام الأذونات المتسلسلة"""
+
+    def test_sequential_and_skips_legacy_numbers(self):
+        """اختبار إن الأرقام متسلسلة بنفس الشكل، والأرقام العشوائية القديمة في نفس السنة بتتخطى"""
+        self.assertRegex(self.permission.permission_number, r'^PERM-\d{4}-\d{6}$')
+
+        PermissionSlip.objects.create(
+            permission_number='PERM-2031-000002', client=self.client_obj, institute=self.institute,
+            diploma=self.diploma, issued_by=self.employee, expiry_date=date(2027, 1, 1),
+        )
+        allocator = numbering.PermissionNumberAllocator(block_size=10)
+        self.assertEqual(
+            [allocator.allocate(2031) for _ in range(3)],
+            ['PERM-2031-000001', 'PERM-2031-000003', 'PERM-2031-000004'],
+        )
+
+
+class PermissionNumberConcurrencyTests(TransactionTestCase):
+    """اختبار حجز الأرقام من workers متوازية"""
+
+    def test_released_number_reused(self):
+        """اختبار إن الرقم اللي الإصدار بتاعه اترفض بيرجع للدفعة ومبيسيبش فجوة"""
+        allocator = numbering.PermissionNumberAllocator(block_size=5)
+        first = allocator.allocate(2032)
+        second = allocator.allocate(2032)
+        allocator.release(second)
+        self.assertEqual([first, allocator.allocate(2032), allocator.allocate(2032)],
+                         ['PERM-2032-000001', 'PERM-2032-000002', 'PERM-2032-000003'])
+
+    def test_parallel_workers_never_collide(self):
+        """اختبار إن 4 workers (كل واحد بدفعاته) بيطلعوا 400 رقم من غير أي تكرار"""
+        workers, per_worker = 4, 100
+        results = [[] for _ in range(workers)]
+        errors = []
+
+        def work(index):
+            worker = numbering.PermissionNumberAllocator(block_size=10)
+            try:
+                for _ in range(per_worker):
+                    results[index].append(worker.allocate(2030))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work, args=(index,)) for index in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        numbers = [number for chunk in results for number in chunk]
+        self.assertEqual(errors, [])
+        self.assertEqual(len(numbers), workers * per_worker)
+        self.assertEqual(len(set(numbers)), len(numbers))
+        self.assertEqual(PermissionNumberSequence.objects.get(year=2030).next_value, workers * per_worker + 1)
+
+    @skipUnless(os.environ.get('RUN_STRESS_TESTS'), 'اختبار ضغط تقيل: RUN_STRESS_TESTS=1 لتشغيله')
+    def test_parallel_issuance_stress(self):
+        """اختبار إن 8 threads بيصدروا 10 آلاف إذن عبر issue_permission من غير IntegrityError ولا رقم مكرر"""
+        threads, per_thread = 8, 1250
+        institute = Institute.objects.create(
+            name='Stress Institute', code='STRESS', license_number='STRESS',
+            address='Test', city='Test', region='Test', phone='0000000000',
+        )
+        diploma = Diploma.objects.create(
+            name='Stress Diploma', code='STRESS', start_date=date(2026, 1, 1), end_date=date(2027, 1, 1),
+        )
+        diploma.institutes.add(institute)
+        clients = Client.objects.bulk_create([
+            Client(
+                first_name='Stress', last_name=str(index), full_name=f'Stress {index}',
+                national_id=f'8{index:09d}', gender='male', birth_date=date(2000, 1, 1),
+                phone='0000000000', institute=institute,
+            )
+            for index in range(threads * per_thread)
+        ])
+        results = [[] for _ in range(threads)]
+        errors = []
+
+        def work(index):
+            try:
+                for client in clients[index::threads]:
+                    permission = PermissionSlip(
+                        client=client, institute=institute, diploma=diploma, expiry_date=diploma.end_date,
+                    )
+                    blocking, existing = eligibility.issue_permission(permission)
+                    if blocking or existing:
+                        errors.append(('rejected', client.pk))
+                    else:
+                        results[index].append(permission.permission_number)
+            except IntegrityError as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=work, args=(index,)) for index in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        numbers = [number for chunk in results for number in chunk]
+        self.assertEqual(errors, [])
+        self.assertEqual(len(numbers), threads * per_thread)
+        self.assertEqual(len(set(numbers)), len(numbers))
+        self.assertEqual(PermissionSlip.objects.filter(institute=institute).count(), len(numbers))
+        self.assertEqual(
+            len(set(PermissionSlip.objects.filter(institute=institute).values_list('permission_number', flat=True))),
+            len(numbers),
+        )
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class BatchPrintTests(PermissionTestMixin, TestCase):
+    """اختبارات الطباعة المجمعة"""
+
+    def setUp(self):
+        super().setUp()
+        self.other_institute = self.create_institute('TEST002')
+        other_client = Client.objects.create(
+            first_name='Other',
+            last_name='Client',
+            national_id='1234567891',
+            gender='male',
+            birth_date='1990-01-01',
+            phone='0123456788',
+            address='Test',
+            institute=self.other_institute,
+        )
+        self.other_permission = PermissionSlip.objects.create(
+            client=other_client,
+            institute=self.other_institute,
+            diploma=self.diploma,
+            expiry_date=date(2027, 1, 1),
+        )
+        self.client.login(username='employee', password='testpass123')
+
+    def test_zip_respects_institute_scope(self):
+        """اختبار إن الـ ZIP فيه أذونات نطاق المستخدم بس"""
+        response = self.client.get(reverse('permissions:permission_batch_print'), {'format': 'zip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        names = archive.namelist()
+        self.assertEqual(len(names), 1)
+        self.assertIn(self.permission.permission_number, names[0])
+        self.assertNotIn(self.other_permission.permission_number, names[0])
+
+    def test_zip_chunks(self):
+        """اختبار إن كل مجموعة أذونات بتبقى ملف PDF واحد جوه الـ ZIP"""
+        queryset = PermissionSlip.objects.order_by('pk')
+        data = b''.join(batch.stream_batch_zip(queryset, chunk_size=1))
+        self.assertEqual(len(zipfile.ZipFile(BytesIO(data)).namelist()), 2)
+
+        data = b''.join(batch.stream_batch_zip(queryset, chunk_size=10))
+        self.assertEqual(len(zipfile.ZipFile(BytesIO(data)).namelist()), 1)
+
+    def test_pdf_merges_stored_slips(self):
+        """اختبار إن الـ PDF المجمع بيدمج ملفات الأذونات المخزنة من غير رسم تاني، صفحة لكل إذن بالترتيب"""
+        queryset = PermissionSlip.objects.select_related(*batch.BATCH_SELECT_RELATED).order_by('pk')
+        first = b''.join(batch.stream_batch_pdf(queryset))
+        for permission in queryset:
+            self.assertTrue(pdf_cache.is_pdf_cached(permission))
+
+        with mock.patch.object(pdf_cache, 'generate_permission_pdf') as render:
+            second = b''.join(batch.stream_batch_pdf(queryset))
+        render.assert_not_called()
+        self.assertEqual(len(PdfReader(BytesIO(second)).pages), 2)
+        self.assertEqual(len(PdfReader(BytesIO(first)).pages), 2)
+
+    def test_pdf_built_before_response(self):
+        """اختبار إن الـ PDF المجمع بيتبني قبل الرد: الحجم معروف، والـ pool المشغول 503 مش ملف مقطوع"""
+        url = reverse('permissions:permission_batch_print')
+        response = self.client.get(url, {'format': 'pdf'})
+        self.assertEqual(response.status_code, 200)
+        data = b''.join(response.streaming_content)
+        self.assertEqual(int(response['Content-Length']), len(data))
+        self.assertEqual(len(PdfReader(BytesIO(data)).pages), 1)
+
+        busy = RenderPoolBusy('busy', retry_after=3)
+        with mock.patch.object(batch, 'get_permission_pdf', side_effect=busy):
+            response = self.client.get(url, {'format': 'pdf'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '3')
+
+    def test_zip_chunk_failure_listed(self):
+        """اختبار إن مجموعة فشلت في الـ ZIP بتتسجل في errors.txt والباقي بيكمل"""
+        queryset = PermissionSlip.objects.order_by('pk')
+        real = pdf_cache.get_permission_pdf
+
+        def flaky(permission, **kwargs):
+            if permission.pk == self.other_permission.pk:
+                raise RenderPoolBusy('busy', retry_after=1)
+            return real(permission, **kwargs)
+
+        with mock.patch.object(batch, 'get_permission_pdf', side_effect=flaky):
+            archive = zipfile.ZipFile(BytesIO(b''.join(batch.stream_batch_zip(queryset, chunk_size=1))))
+        self.assertEqual(len(archive.namelist()), 2)
+        self.assertIn(self.other_permission.permission_number, archive.read('errors.txt').decode())
+
+    def test_pdf_over_limit_redirects(self):
+        """اختبار إن ملف PDF واحد فوق الحد الأقصى بيرجع للقائمة برسالة"""
+        with self.settings(PDF_BATCH_MAX_PDF_SLIPS=0):
+            response = self.client.get(reverse('permissions:permission_batch_print'), {'format': 'pdf'})
+        self.assertEqual(response.status_code, 302)
+
+    def test_filter_by_date_range(self):
+        """اختبار إن فلتر فترة الإصدار بيتطبق"""
+        response = self.client.get(reverse('permissions:permission_batch_print'), {
+            'format': 'pdf', 'date_from': '2000-01-01', 'date_to': '2000-01-31',
+        })
+        self.assertEqual(response.status_code, 302)
+
+        response = self.client.get(reverse('permissions:permission_batch_print'), {'format': 'pdf'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ConditionalPDFTests(PermissionTestMixin, TestCase):
+    """اختبارات ETag / 304 / Range لعرض وتحميل PDF الإذن"""
+
+    def setUp(self):
+        super().setUp()
+        self.client.login(username='employee', password='testpass123')
+        self.url = reverse('permissions:permission_download', args=[self.permission.pk])
+
+    def _get(self, **headers):
+        with mock.patch.object(pdf_cache, 'generate_permission_pdf',
+                               return_value=BytesIO(b'%PDF-test')) as render:
+            response = self.client.get(self.url, headers=headers)
+        return response, render.call_count
+
+    def test_if_none_match_returns_304_without_render(self):
+        """اختبار إن نفس الـ ETag بيرجع 304 من غير رسم والـ no-store مش موجود"""
+        response, _ = self._get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        etag = response['ETag']
+
+        with mock.patch.object(pdf_cache, 'get_cached_pdf') as read:
+            response, calls = self._get(if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(calls, 0)
+        read.assert_not_called()
+        self.assertEqual(response['ETag'], etag)
+
+    def test_etag_changes_with_permission(self):
+        """اختبار إن تعديل الإذن بيغير الـ ETag"""
+        response, _ = self._get()
+        etag = response['ETag']
+        self.permission.status = PermissionSlip.Status.CANCELLED
+        self.permission.save()
+
+        response, calls = self._get(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_range_request(self):
+        """اختبار طلب جزء من الملف (Range)"""
+        response, _ = self._get(range='bytes=0-3')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, b'%PDF')
+        self.assertEqual(response['Content-Range'], 'bytes 0-3/9')
+
+        response, _ = self._get(range='bytes=100-')
+        self.assertEqual(response.status_code, 416)
+
+    @override_settings(MEDIA_ROOT=MEDIA_ROOT, MEDIA_X_ACCEL_REDIRECT=True)
+    def test_stored_pdf_offloaded_to_nginx(self):
+        """اختبار إن الملف المخزن بيترد بـ X-Accel-Redirect من غير body، والرسم الأول بيرجع الملف نفسه"""
+        response, _ = self._get()
+        self.assertEqual(response.content, b'%PDF-test')
+        self.assertNotIn('X-Accel-Redirect', response)
+
+        response, calls = self._get()
+        self.assertEqual(calls, 0)
+        self.assertEqual(response.content, b'')
+        self.permission.refresh_from_db()
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.permission.pdf_file.name)
+        self.assertIn('attachment;', response['Content-Disposition'])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class TemplatePreviewTests(PermissionTestMixin, TestCase):
+    """اختبارات معاينة مسودة القالب في صفحة التعديل"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        User.objects.create_user(username='admin', password='testpass123', role=User.Role.ADMIN)
+        self.client.login(username='admin', password='testpass123')
+        self.url = reverse('institutes:pdf_template_preview_render', args=[self.institute.pk])
+        self.data = {
+            'header_content': '<h1>{{ institute.name }}</h1>',
+            'body_content': '{{ client.full_name }} - {{ permission.permission_number }}',
+            'footer_content': '',
+            'page_size': 'A4',
+            'orientation': 'portrait',
+        }
+
+    def _post(self, **extra):
+        with mock.patch.object(preview, 'render_preview_pdf_bytes', return_value=b'%PDF-preview') as render:
+            response = self.client.post(self.url, {**self.data, **extra})
+        return response, render.call_count
+
+    def test_preview_cached_by_draft(self):
+        """اختبار إن نفس المسودة بتترسم مرة واحدة ومن غير ما القالب يتحفظ"""
+        response, calls = self._post()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'%PDF-preview')
+        self.assertEqual(response['X-Preview-Cache'], 'miss')
+        self.assertEqual(calls, 1)
+
+        response, calls = self._post(seq=1)
+        self.assertEqual(response['X-Preview-Cache'], 'hit')
+        self.assertEqual(calls, 0)
+
+        _, calls = self._post(first_page='1')
+        self.assertEqual(calls, 1)
+        self.assertFalse(PermissionTemplate.objects.filter(institute=self.institute).exists())
+
+    def test_superseded_request_not_rendered(self):
+        """اختبار إن الطلب الأقدم من آخر طلب للمحرر بيتلغي من غير رسم"""
+        self._post(seq=5, body_content='newer')
+        response, calls = self._post(seq=3)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(calls, 0)
+
+    def test_employee_forbidden(self):
+        """اختبار إن المعاينة للأدمن بس"""
+        self.client.login(username='employee', password='testpass123')
+        response, calls = self._post()
+        self.assertNotEqual(response.status_code, 200)
+        self.assertEqual(calls, 0)
+
+    def test_sample_permission_render(self):
+        """اختبار رسم المسودة على الإذن التجريبي من غير ما يتحفظ أي حاجة في قاعدة البيانات"""
+        draft = preview.draft_from_data(self.data)
+        permissions_before = PermissionSlip.all_objects.count()
+        with mock.patch.object(preview, 'layout_permission_html', wraps=preview.layout_permission_html) as layout:
+            self.assertTrue(preview.render_preview_pdf_bytes(self.institute.pk, draft, True))
+        html = layout.call_args[0][0]
+        self.assertIn('PRM-PREVIEW', html)
+        self.assertIn(self.institute.name, html)
+        self.assertEqual(PermissionSlip.all_objects.count(), permissions_before)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, PDF_TEMPLATE_GUARD_SANDBOX=False, PDF_TEMPLATE_MAX_PAGES=2)
+class TemplateRenderGuardTests(PermissionTestMixin, TestCase):
+    """اختبارات حماية تكلفة الرسم عند حفظ القالب"""
+
+    def setUp(self):
+        super().setUp()
+        User.objects.create_user(username='admin', password='testpass123', role=User.Role.ADMIN)
+        self.client.login(username='admin', password='testpass123')
+        self.url = reverse('institutes:pdf_template_edit', args=[self.institute.pk])
+        self.data = {
+            'header_content': '<h1>{{ institute.name }}</h1>',
+            'body_content': '{{ client.full_name }}',
+            'footer_content': '',
+            'page_size': 'A4',
+            'orientation': 'portrait',
+        }
+
+    def _post(self, metrics):
+        with mock.patch.object(render_guard, 'measure_template_render', return_value=metrics) as measure:
+            response = self.client.post(self.url, self.data)
+        return response, measure
+
+    def test_metrics_stored_on_save(self):
+        """اختبار إن القياسات بتتسجل على القالب مع الحفظ"""
+        response, measure = self._post({'render_ms': 120, 'pages': 1, 'size': 30000})
+        self.assertEqual(response.status_code, 302)
+        measure.assert_called_once()
+
+        template = PermissionTemplate.objects.get(institute=self.institute)
+        self.assertEqual((template.render_time_ms, template.render_pages, template.render_size), (120, 1, 30000))
+        self.assertIsNotNone(template.render_checked_at)
+
+    def test_save_rejected_over_limits(self):
+        """اختبار إن القالب اللي بيعدّي الحدود مش بيتحفظ والمسودة بترجع للفورم"""
+        response, _ = self._post({'render_ms': 120, 'pages': 5, 'size': 30000})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(PermissionTemplate.objects.filter(institute=self.institute).exists())
+        self.assertContains(response, 'الحد الأقصى 2')
+        self.assertEqual(response.context['template'].body_content, self.data['body_content'])
+
+    def test_render_time_measured_after_warmup(self):
+        """اختبار إن وقت الرسم المسجل للرسمة التانية بس (الأولى تسخين للـ process)"""
+        timings = iter([0.0, 0.05])
+        with mock.patch.object(render_guard, 'render_preview_document', return_value=_FakeDocument([1])) as render, \
+                mock.patch.object(render_guard, 'write_document_pdf', return_value=b'%PDF-test'), \
+                mock.patch.object(render_guard.time, 'perf_counter', side_effect=lambda: next(timings)):
+            metrics = render_guard.measure_template_render(self.institute.pk, self.data)
+        self.assertEqual(render.call_count, 2)
+        self.assertEqual(metrics, {'render_ms': 50, 'pages': 1, 'size': 9})
+
+    def test_render_failure_rejected(self):
+        """اختبار إن القالب اللي مابيترسمش أصلاً بيترفض"""
+        self.data['body_content'] = '{% if %}'
+        response = self.client.post(self.url, self.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(PermissionTemplate.objects.filter(institute=self.institute).exists())
+        self.assertContains(response, 'فشل رسم القالب')
+
+
+class _FakePage:
+    width, height = 595, 842
+
+    def __init__(self, boxes=()):
+        self._page_box = mock.Mock(descendants=lambda: iter(boxes))
+
+    def paint(self, stream, scale=1):
+        pass
+
+
+class _FakeDocument:
+    def __init__(self, pages):
+        self.pages = pages
+
+    def copy(self, pages):
+        return _FakeDocument(pages)
+
+
+class OverlayRenderTests(PermissionTestMixin, TestCase):
+    """اختبارات وضع الرسم بالطبقات"""
+
+    def setUp(self):
+        super().setUp()
+        overlay.clear_static_layers()
+        self.template = PermissionTemplate.objects.create(
+            institute=self.institute,
+            header_content='<h1>{{ institute.name }}</h1>',
+            body_content='<p>{{ client.full_name }}</p><p>{{ permission.permission_number }}</p>',
+            render_mode=PermissionTemplate.RenderMode.OVERLAY,
+        )
+        self.overlay_html = []
+
+    def _layout(self, html, font_family, render_options=None):
+        """بديل layout_permission_html: بوكس نص لكل حقل متعلّم في الطبقة الثابتة"""
+        boxes = []
+        for index in re.findall(r'data-overlay-field="(\d+)"', html):
+            box = mock.Mock(spec=overlay.TextBox, position_x=100, position_y=200, width=150, height=20)
+            box.element = mock.Mock(get=mock.Mock(return_value=index))
+            box.style = {
+                'font_family': ('Cairo',), 'font_size': 14, 'font_weight': 400, 'font_style': 'normal',
+                'color': None, 'direction': 'rtl',
+            }
+            boxes.append(box)
+        if not boxes:
+            self.overlay_html.append(html)
+        return _FakeDocument([_FakePage(boxes)])
+
+    def test_unsupported_reason(self):
+        """اختبار القوالب اللي مينفعش تترسم بالطبقات"""
+        self.assertIsNone(overlay.unsupported_reason(self.template))
+        cases = {
+            'body_content': '{% if client.gender == "male" %}أ{% endif %}',
+            'header_content': '<img src="{{ permission.qr_url }}">',
+            'custom_css': '.x { color: {{ client.color }}; }',
+        }
+        for field, value in cases.items():
+            template = PermissionTemplate(institute=self.institute, **{field: value})
+            self.assertIsNotNone(overlay.unsupported_reason(template), field)
+
+        # داخليات WeasyPrint اللي بيعتمد عليها الوضع متجربتش على إصدار رئيسي تاني
+        with mock.patch.object(overlay, 'WEASYPRINT_VERSION', '99.0'):
+            self.assertIsNotNone(overlay.unsupported_reason(self.template))
+
+    def test_static_layer_reused(self):
+        """اختبار إن الطبقة الثابتة بتترسم مرة واحدة والحقول المتغيرة بتتطبع فوقها لكل إذن"""
+        second = PermissionSlip.objects.create(
+            client=self.client_obj, institute=self.institute, diploma=self.diploma,
+            issued_by=self.employee, expiry_date=date(2027, 1, 1),
+        )
+        with mock.patch.object(overlay, 'build_static_layer', wraps=overlay.build_static_layer) as build, \
+                mock.patch.object(overlay, 'layout_permission_html', side_effect=self._layout):
+            documents = [pdf.render_permission_document(p) for p in (self.permission, second)]
+
+        build.assert_called_once()
+        self.assertEqual(len(self.overlay_html), 2)
+        self.assertIn(self.client_obj.full_name, self.overlay_html[0])
+        self.assertIn(second.permission_number, self.overlay_html[1])
+        self.assertNotIn(self.institute.name, self.overlay_html[0])
+        self.assertIn('right: 345px', self.overlay_html[0])
+        for document in documents:
+            self.assertIsInstance(document.pages[0], overlay.OverlaidPage)
+
+    def test_falls_back_to_full_render(self):
+        """اختبار إن فشل الرسم بالطبقات بيرجع للرسم الكامل"""
+        with mock.patch.object(overlay, 'render_overlay_document', side_effect=RuntimeError('boom')), \
+                mock.patch.object(pdf, 'layout_permission_html', return_value='full') as full:
+            self.assertEqual(pdf.render_permission_document(self.permission), 'full')
+        full.assert_called_once()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class RealRenderTests(PermissionTestMixin, TestCase):
+    """رسم حقيقي بـ WeasyPrint (من غير mock) لأوضاع الرسم المختلفة"""
+
+    def setUp(self):
+        super().setUp()
+        overlay.clear_static_layers()
+        self.template = PermissionTemplate.objects.create(
+            institute=self.institute,
+            header_content='<h1>{{ institute.name }}</h1>',
+            body_content='<p>{{ client.full_name }}</p><p>{{ permission.permission_number }}</p>',
+        )
+
+    def _text(self, data):
+        return ''.join(page.extract_text() for page in PdfReader(BytesIO(data)).pages)
+
+    def test_overlay_render(self):
+        """اختبار إن وضع الطبقات بيطلع صفحة فيها الطبقة الثابتة والحقول المتغيرة"""
+        self.template.render_mode = PermissionTemplate.RenderMode.OVERLAY
+        self.template.save()
+
+        document = pdf.render_permission_document(self.permission)
+        self.assertIsInstance(document.pages[0], overlay.OverlaidPage)
+
+        text = self._text(pdf.write_document_pdf(document))
+        for value in (self.institute.name, self.client_obj.full_name, self.permission.permission_number):
+            self.assertIn(value, text)
+
+    def test_overlay_long_value_falls_back(self):
+        """اختبار إن قيمة أطول من المساحة المتاحة للحقل بتخلي الإذن يترسم كامل بدل ما تطلع برّه مكانها"""
+        self.template.render_mode = PermissionTemplate.RenderMode.OVERLAY
+        self.template.body_content = '<p style="width: 220px">{{ client.full_name }}</p>'
+        self.template.save()
+
+        self.client_obj.first_name = 'Abdelrahman Mohamed Abdelaziz'
+        self.client_obj.last_name = 'Elsayed Abdelmoneim'
+        self.client_obj.save()
+        self.permission.refresh_from_db()
+
+        document = pdf.render_permission_document(self.permission)
+        self.assertNotIsInstance(document.pages[0], overlay.OverlaidPage)
+        self.assertIn('Abdelmoneim', self._text(pdf.write_document_pdf(document)))
+
+    def test_preview_first_page(self):
+        """اختبار إن معاينة الصفحة الأولى بتطلع صفحة واحدة من مسودة بصفحتين"""
+        draft = preview.draft_from_data({
+            'body_content': '<p style="page-break-after: always">{{ client.full_name }}</p><p>2</p>',
+        })
+        full = preview.render_preview_pdf_bytes(self.institute.pk, draft)
+        first = preview.render_preview_pdf_bytes(self.institute.pk, draft, first_page=True)
+        self.assertEqual(len(PdfReader(BytesIO(full)).pages), 2)
+        self.assertEqual(len(PdfReader(BytesIO(first)).pages), 1)
+
+    def test_output_profiles(self):
+        """اختبار إن كل profile بيطلع PDF صالح، والـ small أصغر من الـ quality مع خلفية"""
+        background = BytesIO()
+        Image.effect_noise((800, 1100), 64).convert('RGB').save(background, 'JPEG', quality=95)
+        self.institute.background_img.save('bg.jpg', ContentFile(background.getvalue()))
+
+        sizes = {}
+        for profile in PermissionTemplate.OutputProfile.values:
+            self.template.output_profile = profile
+            self.template.save()
+            self.permission.refresh_from_db()
+            data = pdf.generate_permission_pdf(self.permission).getvalue()
+            self.assertEqual(len(PdfReader(BytesIO(data)).pages), 1, profile)
+            sizes[profile] = len(data)
+        self.assertLess(sizes['small'], sizes['quality'])
@@ -5,6 +5,7 @@ app_name = 'permissions'
 
 urlpatterns = [
     path('', views.PermissionListView.as_view(), name='permission_list'),
+    path('batch-print/', views.PermissionBatchPrintView.as_view(), name='permission_batch_print'),
     path('create/', views.PermissionCreateView.as_view(), name='permission_create'),
     path('api/check-client/', views.ApiCheckClientPermissionView.as_view(), name='api_check_client'),
     path('api/institute-programs/', views.ApiInstituteProgramsView.as_view(), name='api_institute_programs'),
@@ -1,18 +1,59 @@
 """أدوات مشتركة لمنطق إصدار الأذونات - مشترك بين النظام الداخلي والبورتال العام"""
+from django.db.models import Q
+from django.utils.dateparse import parse_date
+
+# حقول البحث في قائمة الأذونات (والطباعة المجمعة بنفس الفلتر)
+PERMISSION_SEARCH_FIELDS = ['permission_number', 'client__full_name', 'client__national_id']
+
+
+def _parse_date(value):
+    try:
+        return parse_date(str(value or ''))
+    except ValueError:
+        return None
+
+
+def filter_permissions(queryset, params):
+    """
+    فلتر قائمة الأذونات: المعهد، الحالة، فترة تاريخ الإصدار (date_from / date_to)، والبحث.
+    params أي dict-like (request.GET أو options الأمر) - القيم الفاضية أو الغلط بتتجاهل.
+    مشترك بين صفحة القائمة والطباعة المجمعة عشان الاتنين يطلعوا نفس الأذونات بالظبط.
+    """
+    institute = str(params.get('institute') or '')
+    if institute.isdigit():
+        queryset = queryset.filter(institute_id=int(institute))
+
+    status = params.get('status')
+    if status:
+        queryset = queryset.filter(status=status)
+
+    date_from = _parse_date(params.get('date_from'))
+    if date_from:
+        queryset = queryset.filter(issue_date__gte=date_from)
+
+    date_to = _parse_date(params.get('date_to'))
+    if date_to:
+        queryset = queryset.filter(issue_date__lte=date_to)
+
+    search = params.get('search')
+    if search:
+        q_objects = Q()
+        for field in PERMISSION_SEARCH_FIELDS:
+            q_objects |= Q(**{f'{field}__icontains': search})
+        queryset = queryset.filter(q_objects)
+
+    return queryset
 
 
 def find_blocking_active_permission(client, target_institute_id):
     """
     يرجع إذن نشط للعميل في معهد مختلف عن المعهد المستهدف (لو موجود)، وإلا None.
     وجود إذن زي ده يمنع إصدار إذن جديد لحد ما يتم إلغاؤه من المعهد صاحب الإذن الأصلي.
+    لو محتاج كمان الإذن في نفس المعهد استخدم eligibility.find_active_permissions (استعلام واحد).
     """
-    from .models import PermissionSlip
+    from .eligibility import find_active_permissions
 
-    return PermissionSlip.objects.filter(
-        client=client, status='active'
-    ).exclude(institute_id=target_institute_id).select_related(
-        'institute', 'issued_by', 'referral_employee'
-    ).order_by('-created_at').first()
+    return find_active_permissions(client, target_institute_id)[0]
 
 
 def find_existing_permission(client, target_institute_id):
@@ -21,11 +62,9 @@ def find_existing_permission(client, target_institute_id):
     يُستخدم عشان لو الطالب أصدر مشهد قبل كده من نفس الفرع، نوجّهه لمشهده
     الحالي بدل ما يصدر واحد جديد مكرر.
     """
-    from .models import PermissionSlip
+    from .eligibility import find_active_permissions
 
-    return PermissionSlip.objects.filter(
-        client=client, status='active', institute_id=target_institute_id
-    ).select_related('institute').order_by('-created_at').first()
+    return find_active_permissions(client, target_institute_id)[1]
 
 
 def existing_info(permission):
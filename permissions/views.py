@@ -1,51 +1,49 @@
-import base64
-import os
 import logging
 
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views.generic import View, ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib import messages
-from django.urls import reverse_lazy
+from django.conf import settings
+from django.urls import reverse, reverse_lazy
 from django.db.models import Q
-from django.http import HttpResponse, FileResponse, JsonResponse
+from django.http import HttpResponse, FileResponse, JsonResponse, StreamingHttpResponse
 from django.utils import timezone
-from django.template import Context, Template
 from django.template.loader import render_to_string
 from django.core.mail import EmailMultiAlternatives
-from django.core.exceptions import PermissionDenied
-from django.conf import settings
-from weasyprint import HTML
-from io import BytesIO
+from django.core.exceptions import PermissionDenied, ValidationError
 
+from core.render_pool import RenderPoolBusy, RenderTimeout, busy_response, timeout_response
+from core.utils import conditional_not_modified, file_bytes_response, x_accel_redirect_response
 from core.mixins import (
     EmployeeRequiredMixin, AdminRequiredMixin, BranchManagerRequiredMixin,
     InstituteScopedMixin, InstituteScopedDetailMixin, can_view_institute,
-    SearchMixin, FilterMixin
 )
 from institutes.models import Institute
 from clients.models import Client
 from programs.models import Diploma, Course
 from .models import PermissionSlip, PermissionTemplate
-from .utils import (
-    find_blocking_active_permission, blocking_info,
-    find_existing_permission, existing_info,
-)
+from .utils import blocking_info, existing_info, filter_permissions
+from .eligibility import find_active_permissions, issue_permission
+from .batch import BATCH_FORMATS, build_batch_pdf, stream_batch_zip
+from .pdf import generate_permission_pdf, generate_default_pdf
+from .pdf_cache import get_permission_pdf, is_pdf_cached, permission_pdf_validators, record_stored_hit
+from .prerender import schedule_permission_pdf
+from .overlay import warn_overlay_unsupported
+from .render_guard import check_template_render_cost
 
 logger = logging.getLogger('edu_system')
 
 
-class PermissionListView(LoginRequiredMixin, InstituteScopedMixin, SearchMixin, FilterMixin, ListView):
+class PermissionListView(LoginRequiredMixin, InstituteScopedMixin, ListView):
     """قائمة الأذونات"""
     model = PermissionSlip
     template_name = 'permissions/permission_list.html'
     context_object_name = 'permissions'
     paginate_by = 20
-    search_fields = ['permission_number', 'client__full_name', 'client__national_id']
-    filter_fields = {'status': 'status'}
     
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = filter_permissions(super().get_queryset(), self.request.GET)
         user = self.request.user
         
         # فلترة إضافية حسب نوع المستخدم
@@ -57,9 +55,69 @@ class PermissionListView(LoginRequiredMixin, InstituteScopedMixin, SearchMixin,
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['statuses'] = PermissionSlip.Status.choices
+        user_institutes = self.get_user_institutes()
+        if user_institutes is None:
+            context['institutes'] = Institute.objects.filter(status='active').order_by('name')
+        else:
+            context['institutes'] = user_institutes
+        context['filter_query'] = self.request.GET.copy()
+        context['filter_query'].pop('page', None)
         return context
 
 
+class PermissionBatchPrintView(PermissionListView):
+    """
+    طباعة مجمعة لنفس أذونات القائمة (نفس الفلتر ونفس نطاق المعهد) في ملف واحد:
+    ?format=pdf مستند واحد متعدد الصفحات، أو ?format=zip لأعداد كبيرة (permissions.batch)
+    """
+    paginate_by = None
+
+    def get(self, request, *args, **kwargs):
+        batch_format = request.GET.get('format', 'pdf')
+        if batch_format not in BATCH_FORMATS:
+            return HttpResponse('Invalid format', status=400)
+
+        queryset = self.get_queryset().select_related('institute__registration_officer').order_by('pk')
+        total = queryset.count()
+        redirect_to = f"{reverse('permissions:permission_list')}?{self.request.GET.urlencode()}"
+
+        if not total:
+            messages.warning(request, 'لا توجد أذونات مطابقة للطباعة.')
+            return redirect(redirect_to)
+
+        if batch_format == 'pdf' and total > settings.PDF_BATCH_MAX_PDF_SLIPS:
+            messages.error(
+                request,
+                f'عدد الأذونات ({total}) أكبر من الحد المسموح لملف PDF واحد '
+                f'({settings.PDF_BATCH_MAX_PDF_SLIPS})، استخدم التحميل كملف ZIP.'
+            )
+            return redirect(redirect_to)
+
+        filename = f"permissions-{timezone.now().strftime('%Y%m%d-%H%M')}.{batch_format}"
+        if batch_format == 'pdf':
+            # الملف بيتبني كله قبل الرد: أي خطأ هنا 503/500 مش ملف مقطوع بعد هيدرز 200
+            try:
+                output = build_batch_pdf(queryset)
+            except RenderPoolBusy as e:
+                logger.warning(f'PDF render pool busy for batch print: {e}')
+                return busy_response(e)
+            except RenderTimeout as e:
+                return timeout_response(e)
+            except Exception as e:
+                logger.error(f'Error generating batch PDF: {str(e)}')
+                return HttpResponse('Error generating PDF', status=500)
+            if output is None:
+                messages.warning(request, 'لا توجد أذونات مطابقة للطباعة.')
+                return redirect(redirect_to)
+            response = FileResponse(output, content_type='application/pdf', as_attachment=True, filename=filename)
+        else:
+            response = StreamingHttpResponse(stream_batch_zip(queryset), content_type='application/zip')
+            response['Content-Disposition'] = f'attachment; filename="{filename}"'
+
+        logger.info(f'Batch print ({batch_format}) of {total} permissions by {request.user.username}')
+        return response
+
+
 class PermissionCreateView(EmployeeRequiredMixin, CreateView):
     """إنشاء إذن جديد"""
     model = PermissionSlip
@@ -137,8 +195,25 @@ class PermissionCreateView(EmployeeRequiredMixin, CreateView):
             # احتياطي أخير لو حصل خطأ ما - نرجع لمعهد العميل
             form.instance.institute = form.instance.client.institute
 
+        program = form.instance.diploma or form.instance.course
+
+        if not form.instance.expiry_date:
+            if program and program.end_date:
+                form.instance.expiry_date = program.end_date
+            else:
+                form.instance.expiry_date = timezone.now().date() + timezone.timedelta(days=365)
+
+        # طريقة الدراسة: لو البرنامج حضوري/أونلاين بس، نثبتها كده بصرف النظر عما أُرسل
+        if program and program.study_mode != 'both':
+            form.instance.study_mode = program.study_mode
+        elif form.instance.study_mode not in ('offline', 'online'):
+            form.instance.study_mode = ''
+
+        # الفحص والحفظ تحت قفل على العميل - إصدار متزامن من البورتال لنفس الطالب مبيعديش الفحص
+        permission = form.save(commit=False)
+        blocking_permission, existing_permission = issue_permission(permission)
+
         # منع إصدار إذن جديد لو عند الطالب إذن نشط بالفعل في معهد تاني
-        blocking_permission = find_blocking_active_permission(form.instance.client, form.instance.institute_id)
         if blocking_permission:
             info = blocking_info(blocking_permission)
             form.add_error(
@@ -151,7 +226,6 @@ class PermissionCreateView(EmployeeRequiredMixin, CreateView):
             return self.form_invalid(form)
 
         # منع إصدار إذن مكرر لو عند الطالب إذن نشط بالفعل في نفس الفرع
-        existing_permission = find_existing_permission(form.instance.client, form.instance.institute_id)
         if existing_permission:
             info = existing_info(existing_permission)
             form.add_error(
@@ -162,23 +236,13 @@ class PermissionCreateView(EmployeeRequiredMixin, CreateView):
             )
             return self.form_invalid(form)
 
-        program = form.instance.diploma or form.instance.course
-
-        if not form.instance.expiry_date:
-            if program and program.end_date:
-                form.instance.expiry_date = program.end_date
-            else:
-                form.instance.expiry_date = timezone.now().date() + timezone.timedelta(days=365)
-
-        # طريقة الدراسة: لو البرنامج حضوري/أونلاين بس، نثبتها كده بصرف النظر عما أُرسل
-        if program and program.study_mode != 'both':
-            form.instance.study_mode = program.study_mode
-        elif form.instance.study_mode not in ('offline', 'online'):
-            form.instance.study_mode = ''
-
+        self.object = permission
+        form.save_m2m()
         messages.success(self.request, 'تم إصدار الإذن بنجاح')
         logger.info(f'Permission issued for {form.instance.client} by {self.request.user.username}')
-        return super().form_valid(form)
+        # ملف الـ PDF بيترسم في الخلفية بعد الـ commit (برّا القفل) عشان يكون جاهز أول ما الموظف يفتحه
+        schedule_permission_pdf(self.object)
+        return redirect(self.get_success_url())
 
 
 class ApiCheckClientPermissionView(EmployeeRequiredMixin, View):
@@ -193,7 +257,7 @@ class ApiCheckClientPermissionView(EmployeeRequiredMixin, View):
 
         client = get_object_or_404(Client, pk=client_id, is_deleted=False)
 
-        blocking_permission = find_blocking_active_permission(client, institute_id)
+        blocking_permission, existing_permission = find_active_permissions(client, institute_id)
         if blocking_permission:
             return JsonResponse({
                 'blocked': True,
@@ -201,7 +265,6 @@ class ApiCheckClientPermissionView(EmployeeRequiredMixin, View):
                 'block': blocking_info(blocking_permission),
             })
 
-        existing_permission = find_existing_permission(client, institute_id)
         if existing_permission:
             return JsonResponse({
                 'blocked': False,
@@ -240,23 +303,58 @@ class PermissionDetailView(LoginRequiredMixin, InstituteScopedDetailMixin, Detai
 
 class PermissionPDFView(LoginRequiredMixin, View):
     """عرض PDF الإذن"""
+    as_attachment = False
     
     def get(self, request, pk):
-        permission = get_object_or_404(PermissionSlip, pk=pk)
+        permission = get_object_or_404(
+            PermissionSlip.objects.select_related('client', 'institute', 'institute__registration_officer', 'issued_by', 'diploma', 'course'),
+            pk=pk
+        )
         
         # التحقق من الصلاحيات
         if not self._can_view_permission(request.user, permission):
             logger.warning(f'Unauthorized PDF access attempt by {request.user.username}')
             return HttpResponse('Unauthorized', status=403)
         
+        # نسخة المتصفح لسه مطابقة (ETag = مفتاح كاش الـ PDF) -> 304 من غير قراءة أو رسم
+        etag, last_modified = permission_pdf_validators(permission)
+        not_modified = conditional_not_modified(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+        
+        filename = f'{permission.permission_number}.pdf'
+        
+        # الملف مخزن على الديسك -> nginx يبعته بدل ما الـ worker يفضل مشغول بالتحميل
+        if settings.MEDIA_X_ACCEL_REDIRECT and is_pdf_cached(permission, etag):
+            self._log_access(request, permission)
+            record_stored_hit(permission)
+            return x_accel_redirect_response(
+                permission.pdf_file, 'application/pdf', etag=etag, last_modified=last_modified,
+                filename=filename, as_attachment=self.as_attachment,
+            )
+        
         try:
-            pdf_buffer = generate_permission_pdf(permission)
-            logger.info(f'PDF viewed for permission {permission.permission_number} by {request.user.username}')
-            return HttpResponse(pdf_buffer.getvalue(), content_type='application/pdf')
+            pdf_bytes = get_permission_pdf(permission, key=etag)
+            self._log_access(request, permission)
+            return file_bytes_response(
+                request, pdf_bytes, 'application/pdf', etag=etag, last_modified=last_modified,
+                filename=filename, as_attachment=self.as_attachment,
+            )
+        except RenderPoolBusy as e:
+            logger.warning(f'PDF render pool busy for permission {permission.permission_number}: {e}')
+            return busy_response(e)
+        except RenderTimeout as e:
+            return timeout_response(e)
         except Exception as e:
             logger.error(f'Error generating PDF: {str(e)}')
             return HttpResponse('Error generating PDF', status=500)
     
+    def _log_access(self, request, permission):
+        logger.info(
+            f'PDF {"downloaded" if self.as_attachment else "viewed"} for permission '
+            f'{permission.permission_number} by {request.user.username}'
+        )
+    
     def _can_view_permission(self, user, permission):
         if user.is_admin():
             return True
@@ -309,26 +407,9 @@ class PermissionSendEmailView(EmployeeRequiredMixin, View):
         return redirect(redirect_to)
 
 
-class PermissionDownloadView(LoginRequiredMixin, View):
+class PermissionDownloadView(PermissionPDFView):
     """تحميل PDF الإذن"""
-    
-    def get(self, request, pk):
-        permission = get_object_or_404(PermissionSlip, pk=pk)
-        
-        if not PermissionPDFView()._can_view_permission(request.user, permission):
-            logger.warning(f'Unauthorized PDF download attempt by {request.user.username}')
-            return HttpResponse('Unauthorized', status=403)
-        
-        try:
-            pdf_buffer = generate_permission_pdf(permission)
-            logger.info(f'PDF downloaded for permission {permission.permission_number} by {request.user.username}')
-            
-            response = HttpResponse(pdf_buffer.getvalue(), content_type='application/pdf')
-            response['Content-Disposition'] = f'attachment; filename="{permission.permission_number}.pdf"'
-            return response
-        except Exception as e:
-            logger.error(f'Error generating PDF for download: {str(e)}')
-            return HttpResponse('Error generating PDF', status=500)
+    as_attachment = True
 
 
 class PermissionCancelView(BranchManagerRequiredMixin, View):
@@ -343,176 +424,6 @@ class PermissionCancelView(BranchManagerRequiredMixin, View):
         return redirect('permissions:permission_list')
 
 
-# ==================== PDF Generation Functions ====================
-
-def generate_default_pdf(permission):
-    """دالة احتياطية لإنتاج PDF قياسي"""
-    from django.template.loader import render_to_string
-    
-    context = {
-        'permission': permission,
-        'institute': permission.institute,
-        'client': permission.client,
-        'program': permission.get_program(),
-        'issued_by': permission.issued_by,
-    }
-    
-    html_content = render_to_string('permissions/default_permission.html', context)
-    
-    buffer = BytesIO()
-    HTML(
-        string=html_content,
-        base_url=settings.BASE_DIR
-    ).write_pdf(buffer)
-    buffer.seek(0)
-    return buffer
-
-
-def get_b64(path):
-    """Helper to convert image to base64"""
-    if path and os.path.exists(path):
-        with open(path, "rb") as f:
-            return base64.b64encode(f.read()).decode('utf-8')
-    return ""
-
-
-FONT_STACKS = {
-    'arial': "'Arial', sans-serif",
-    'cairo': "'Cairo', 'Arial', sans-serif",
-}
-
-# ملفات كل خط مضمّنة Base64 مباشرة داخل الـ CSS (زي صورة الخلفية بالظبط) بدل الاعتماد
-# على url() نسبي، لأن تحليل base_url في WeasyPrint مش مضمون يفضل شغال على كل بيئة/سيرفر
-CUSTOM_FONT_FILES = {
-    'cairo': [('normal', 'Cairo-Regular.ttf'), ('bold', 'Cairo-Bold.ttf')],
-}
-
-
-def build_font_face_css(font_choice):
-    files = CUSTOM_FONT_FILES.get(font_choice)
-    if not files:
-        return ''
-
-    faces = []
-    for weight, filename in files:
-        font_path = os.path.join(settings.BASE_DIR, 'static', 'fonts', filename)
-        font_b64 = get_b64(font_path)
-        if not font_b64:
-            continue
-        faces.append(f"""
-                    @font-face {{
-                        font-family: '{font_choice.capitalize()}';
-                        src: url('data:font/ttf;base64,{font_b64}');
-                        font-weight: {weight};
-                    }}
-        """)
-    return ''.join(faces)
-
-
-def generate_permission_pdf(permission):
-    """توليد PDF بناءً على قالب المعهد الخاص"""
-
-    institute = permission.institute
-
-    try:
-        template_obj = institute.permission_template
-
-        font_stack = FONT_STACKS.get(template_obj.font_family, FONT_STACKS['arial'])
-        font_face_css = build_font_face_css(template_obj.font_family)
-
-        background_css = ""
-        background_html = ""
-        if institute.background_img and os.path.exists(institute.background_img.path):
-            institute_bg_b64 = get_b64(institute.background_img.path)
-            background_css = f"""
-                    .bg-watermark {{
-                        position: fixed;
-                        top: 0; left: 0; right: 0; bottom: 0;
-                        width: 100%;
-                        height: 100%;
-                        background-image: url('data:image/png;base64,{institute_bg_b64}');
-                        background-size: 100% 100%;
-                        background-position: center;
-                        background-repeat: no-repeat;
-                        z-index: -1;
-                    }}
-            """
-            background_html = '<div class="bg-watermark"></div>'
-
-        sig_b64 = ''
-        if institute.signature_image and os.path.exists(institute.signature_image.path):
-            sig_b64 = get_b64(institute.signature_image.path)
-
-        stamp_b64 = ''
-        if institute.stamp_image and os.path.exists(institute.stamp_image.path):
-            stamp_b64 = get_b64(institute.stamp_image.path)
-
-        custom_html = f"""
-        <html>
-            <head>
-                <meta charset="UTF-8">
-                <style>
-                    @page {{ size: {template_obj.page_size} {template_obj.orientation}; margin: 0; }}
-                    {font_face_css}
-                    body {{ font-family: {font_stack}; direction: rtl; margin: 0; }}
-                    .page-container {{ padding: 1.5cm; box-sizing: border-box; }}
-                    {template_obj.custom_css}
-                    {background_css}
-                </style>
-            </head>
-            <body>
-                {background_html}
-                <div class="page-container">
-                    <header>{template_obj.header_content}</header>
-                    <main>{template_obj.body_content}</main>
-                    <footer>{template_obj.footer_content}</footer>
-                </div>
-            </body>
-        </html>
-        """
-    except PermissionTemplate.DoesNotExist:
-        return generate_default_pdf(permission)
-    
-    # تحويل القالب
-    django_template = Template(custom_html)
-    
-    # تحميل الصور
-    tvtc_path = os.path.join(settings.BASE_DIR, 'static', 'images', 'TVTC.jpg')
-    bg_path = os.path.join(settings.BASE_DIR, 'static', 'images', 'ahley_bg.jpg')
-    bg_path1 = os.path.join(settings.BASE_DIR, 'static', 'images', 'Afaq.jpg')
-
-    context = Context({
-        'permission': permission,
-        'client': permission.client,
-        'institute': institute,
-        'program': permission.get_program(),
-        'issued_by': permission.issued_by,
-        'today': timezone.now().date(),
-        'sig_b64': sig_b64,
-        'stamp_b64': stamp_b64,
-        'registration_officer': institute.registration_officer,
-    })
-    
-    try:
-        final_html = django_template.render(context)
-
-        buffer = BytesIO()
-        HTML(
-            string=final_html,
-            base_url=settings.BASE_DIR
-        ).write_pdf(buffer)
-    except Exception as e:
-        logger.error(f"Custom PDF template failed for institute {institute.code}: {e}")
-        return generate_default_pdf(permission)
-
-    # Debug
-    if institute.logo:
-        logger.debug(f"Logo Path: {institute.logo.path}, Exists: {os.path.exists(institute.logo.path)}")
-
-    buffer.seek(0)
-    return buffer
-
-
 # ==================== Template Views ====================
 
 class TemplateListView(AdminRequiredMixin, ListView):
@@ -528,12 +439,18 @@ class TemplateCreateView(AdminRequiredMixin, CreateView):
     template_name = 'permissions/template_form.html'
     fields = [
         'institute', 'header_content', 'body_content', 'footer_content',
-        'custom_css', 'page_size', 'orientation'
+        'custom_css', 'page_size', 'orientation', 'output_profile', 'render_mode'
     ]
     success_url = reverse_lazy('permissions:template_list')
     
     def form_valid(self, form):
+        try:
+            check_template_render_cost(form.instance)
+        except ValidationError as e:
+            form.add_error(None, e)
+            return self.form_invalid(form)
         messages.success(self.request, 'تم إنشاء القالب بنجاح')
+        warn_overlay_unsupported(self.request, form.instance)
         logger.info(f'PDF template created for {form.instance.institute.name}')
         return super().form_valid(form)
 
@@ -544,12 +461,18 @@ class TemplateUpdateView(AdminRequiredMixin, UpdateView):
     template_name = 'permissions/template_form.html'
     fields = [
         'header_content', 'body_content', 'footer_content',
-        'custom_css', 'page_size', 'orientation'
+        'custom_css', 'page_size', 'orientation', 'output_profile', 'render_mode'
     ]
     success_url = reverse_lazy('permissions:template_list')
     
     def form_valid(self, form):
+        try:
+            check_template_render_cost(form.instance)
+        except ValidationError as e:
+            form.add_error(None, e)
+            return self.form_invalid(form)
         messages.success(self.request, 'تم تحديث القالب بنجاح')
+        warn_overlay_unsupported(self.request, form.instance)
         logger.info(f'PDF template updated for {form.instance.institute.name}')
         return super().form_valid(form)
 
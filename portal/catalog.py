@@ -0,0 +1,168 @@
+"""
+كاش البورتال العام: الفروع النشطة، برامج كل فرع (دبلومات/دورات)، وأكواد الإحالة
+
+كل زائر كان بيعمل استعلام للفروع وكود الإحالة (iexact + معهد الموظف)، وكل اختيار فرع كان بيعمل
+استعلامين M2M للبرامج، وكود الإحالة بيتحل تاني في التسجيل والإصدار. دلوقتي التلاتة في ذاكرة كل
+process (dict عادي - القراءة من غير أي استعلام ولا unpickle)، وكل قسم ليه "ختم نسخة" هو ملف صغير
+في مجلد مشترك بين الـ workers: الإشارات (portal.signals) بتكتب الختم من جديد مع أي تعديل على المعهد
+أو الدبلومة/الدورة أو ربطها بالفروع أو كود/دور الموظف، وكل طلب بيقارن الختم بـ os.stat (من غير
+قاعدة بيانات)، ولو اتغير بيرمي نسخة القسم في الـ process ده ويبنيها من جديد.
+
+- PORTAL_CATALOG_STAMP_DIR لازم يكون مشترك بين كل الـ workers (نفس السيرفر؛ الافتراضي مجلد في /tmp).
+- الختم بيتكتب وقت الإشارة وتاني بعد الـ commit، عشان worker قرا البيانات قبل الـ commit ميفضلش بيها.
+- PORTAL_CATALOG_CACHE_TIMEOUT حد أقصى للعمر: التعديل بـ queryset.update() مبيبعتش إشارات،
+  فبيتحدث بعد المدة بس (أو bump_version يدوي).
+- catalog_stats(): نسبة الإصابة لكل قسم في الـ process الحالي (بتظهر في /health/).
+"""
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger('edu_system')
+
+SECTIONS = ('institutes', 'programs', 'referrals')
+
+_MISSING = object()
+_lock = threading.Lock()
+# {section: {'stamp', 'loaded_at', 'values': {name: value}}}
+_sections = {}
+_stats = {section: {'hits': 0, 'misses': 0} for section in SECTIONS}
+
+
+def _stamp_path(section):
+    directory = settings.PORTAL_CATALOG_STAMP_DIR or os.path.join(tempfile.gettempdir(), 'edu_system-catalog')
+    return os.path.join(directory, f'{section}.version')
+
+
+def _stamp(section):
+    """ختم النسخة الحالي للقسم (inode + وقت التعديل)، أو None لو لسه متكتبش"""
+    try:
+        stat = os.stat(_stamp_path(section))
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def _write_stamp(section):
+    path = _stamp_path(section)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # ملف جديد بـ os.replace: الـ inode بيتغير حتى لو وقت التعديل هو هو
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}'
+        with open(temp_path, 'w') as f:
+            f.write(str(time.time_ns()))
+        os.replace(temp_path, path)
+    except OSError as e:
+        logger.warning(f'Could not bump portal catalog stamp {path}: {e}')
+
+
+def bump_version(section):
+    """يلغي كل بيانات القسم في كل الـ workers (بيتنادى من portal.signals)"""
+    with _lock:
+        _sections.pop(section, None)
+    _write_stamp(section)
+    transaction.on_commit(lambda: _write_stamp(section))
+
+
+def _cached(section, name, build):
+    stamp = _stamp(section)
+    now = time.monotonic()
+    with _lock:
+        entry = _sections.get(section)
+        if entry is None or entry['stamp'] != stamp or now - entry['loaded_at'] > settings.PORTAL_CATALOG_CACHE_TIMEOUT:
+            entry = _sections[section] = {'stamp': stamp, 'loaded_at': now, 'values': {}}
+        value = entry['values'].get(name, _MISSING)
+        hit = value is not _MISSING
+        _stats[section]['hits' if hit else 'misses'] += 1
+
+    if not hit:
+        value = build()
+        with _lock:
+            if _sections.get(section) is entry:
+                entry['values'][name] = value
+    return value
+
+
+def clear_catalog():
+    """يفضي نسخة الـ process ده من كل الأقسام (للاختبارات)"""
+    with _lock:
+        _sections.clear()
+
+
+def catalog_stats():
+    with _lock:
+        stats = {}
+        for section, counts in _stats.items():
+            lookups = counts['hits'] + counts['misses']
+            stats[section] = {
+                **counts,
+                'hit_ratio': round(counts['hits'] / lookups, 4) if lookups else 0.0,
+            }
+        return stats
+
+
+def reset_catalog_stats():
+    with _lock:
+        for counts in _stats.values():
+            counts['hits'] = counts['misses'] = 0
+
+
+def active_institutes():
+    """[{'id', 'name'}] للفروع النشطة مترتبة بالاسم"""
+    from institutes.models import Institute
+
+    return _cached('institutes', 'active', lambda: list(
+        Institute.objects.filter(status=Institute.Status.ACTIVE).order_by('name').values('id', 'name')
+    ))
+
+
+def institute_programs(institute_id):
+    """الدبلومات والدورات النشطة المرتبطة فعلياً بالفرع - نفس شكل رد api_diplomas"""
+    from programs.models import Course, Diploma
+
+    try:
+        institute_id = int(institute_id)
+    except (TypeError, ValueError):
+        return []
+
+    def build():
+        fields = ['id', 'name', 'duration_months', 'hours', 'duration', 'study_mode']
+        results = []
+        for program_type, model in (('diploma', Diploma), ('course', Course)):
+            rows = model.objects.filter(
+                institutes__id=institute_id, status='active', is_deleted=False
+            ).order_by('name').values(*fields)
+            results.extend({**row, 'type': program_type} for row in rows)
+        return results
+
+    return _cached('programs', f'institute:{institute_id}', build)
+
+
+def _referral_map():
+    """{كود الإحالة بحروف صغيرة: {'employee_id', 'institute_id'}} للموظفين النشطين"""
+    from accounts.models import User
+
+    def build():
+        codes = {}
+        rows = User.objects.filter(
+            role=User.Role.EMPLOYEE, is_active=True
+        ).exclude(referral_code__isnull=True).exclude(referral_code='').order_by('pk').values_list(
+            'referral_code', 'pk', 'institute_id'
+        )
+        for code, employee_id, institute_id in rows:
+            codes.setdefault(code.lower(), {'employee_id': employee_id, 'institute_id': institute_id})
+        return codes
+
+    return _cached('referrals', 'codes', build)
+
+
+def resolve_referral(ref_code):
+    """{'employee_id', 'institute_id'} لموظف نشط بكود الإحالة ده (من غير فرق حروف كبيرة/صغيرة)، أو None"""
+    if not ref_code:
+        return None
+    return _referral_map().get(ref_code.lower())
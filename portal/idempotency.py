@@ -0,0 +1,141 @@
+"""
+مفاتيح idempotency لطلبات البورتال (الإصدار والتسجيل)
+
+الطلاب على شبكة موبايل ضعيفة بيعيدوا إرسال الطلب، وكل إعادة كانت بتعيد الفحص والحفظ (والرسم)
+وبترجع 409 محيّر (الحساب موجود / عنده مشهد). صفحة البورتال بتولّد مفتاح لكل عملية (هيدر
+Idempotency-Key أو حقل idempotency_key في الفورم)، وأول رد ناجح (2xx) بيتخزن في IdempotencyRecord
+لمدة PORTAL_IDEMPOTENCY_TTL وبيترجع زي ما هو لأي إعادة بنفس المفتاح ونفس البيانات.
+
+- المفتاح بيتحسب مع بيانات الطلب، فنفس الصفحة لو بعتت بيانات مختلفة (صححت خطأ مثلاً) طلب جديد.
+- إعادة وصلت والطلب الأول لسه شغال بترجع 409 مع Retry-After على طول - مبتستناش وهي ماسكة thread
+  من threads الـ gunicorn. طلبات الـ fetch (هيدر Idempotency-Key أو AJAX) بياخدوا الرد JSON
+  ({'success': False, 'error', 'retry': True}) وبيعيدوا بعد Retry-After. طلب أول مات في النص
+  (process اتقفل) بيتاخد مكانه بعد PENDING_STALE_AFTER.
+- الردود غير الناجحة مبتتخزنش: المفتاح بيتساب والإعادة بتتنفذ من الأول.
+"""
+import hashlib
+import logging
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .models import IdempotencyRecord
+
+logger = logging.getLogger('edu_system')
+
+HEADER = 'Idempotency-Key'
+FIELD = 'idempotency_key'
+# حقول مش جزء من بيانات الطلب نفسه
+IGNORED_FIELDS = {FIELD, 'csrfmiddlewaretoken'}
+
+# طلب أول ماخلصش في المدة دي يعتبر ميت ومفتاحه بيتاخد
+PENDING_STALE_AFTER = 120
+# الثواني اللي العميل يستناها قبل ما يعيد طلب لسه تحت التنفيذ
+RETRY_AFTER = 2
+# مسح السجلات المنتهية بيحصل مرة كل ساعة بالكتير لكل process
+PURGE_INTERVAL = 3600
+
+_last_purge = 0.0
+
+
+def request_key(scope, client_key, data):
+    """sha256 للنطاق والمفتاح وبيانات الطلب (مترتبة)"""
+    digest = hashlib.sha256(f'{scope}\0{client_key}'.encode())
+    for name in sorted(set(data) - IGNORED_FIELDS):
+        for value in data.getlist(name):
+            digest.update(f'\0{name}={value}'.encode())
+    return digest.hexdigest()
+
+
+def _claim(key, scope):
+    """(record, claimed): claimed=True لو الطلب ده أول واحد بالمفتاح (أو خد مكان سجل منتهي/ميت)"""
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            return IdempotencyRecord.objects.create(key=key, scope=scope, created_at=now), True
+    except IntegrityError:
+        pass
+
+    record = IdempotencyRecord.objects.filter(key=key).first()
+    if record is None:
+        return _claim(key, scope)
+
+    expired = record.status_code is not None and record.created_at < now - timedelta(seconds=settings.PORTAL_IDEMPOTENCY_TTL)
+    stale = record.status_code is None and record.created_at < now - timedelta(seconds=PENDING_STALE_AFTER)
+    if expired or stale:
+        # update مشروط عشان إعادتين في نفس اللحظة مياخدوش السجل الاتنين
+        taken = IdempotencyRecord.objects.filter(
+            pk=record.pk, status_code=record.status_code, created_at=record.created_at
+        ).update(status_code=None, content_type='', body=b'', created_at=now)
+        if taken:
+            record.created_at = now
+            record.status_code = None
+            return record, True
+    return record, False
+
+
+def _replay(record):
+    response = HttpResponse(bytes(record.body), status=record.status_code, content_type=record.content_type)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _in_progress(request):
+    message = 'الطلب السابق لسه تحت التنفيذ، برجاء المحاولة بعد لحظات.'
+    if request.headers.get(HEADER) or request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        response = JsonResponse({'success': False, 'error': message, 'retry': True}, status=409)
+    else:
+        response = HttpResponse(message, status=409)
+    response['Retry-After'] = str(RETRY_AFTER)
+    return response
+
+
+def _purge_expired():
+    global _last_purge
+    if time.monotonic() - _last_purge < PURGE_INTERVAL:
+        return
+    _last_purge = time.monotonic()
+    cutoff = timezone.now() - timedelta(seconds=settings.PORTAL_IDEMPOTENCY_TTL + PENDING_STALE_AFTER)
+    IdempotencyRecord.objects.filter(created_at__lt=cutoff).delete()
+
+
+def idempotent(scope):
+    """decorator لـ view بيستقبل POST: أول رد ناجح بالمفتاح بيتخزن ويترجع لأي إعادة"""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            client_key = (request.headers.get(HEADER) or request.POST.get(FIELD) or '').strip()
+            if request.method != 'POST' or not client_key:
+                return view(request, *args, **kwargs)
+
+            _purge_expired()
+            key = request_key(scope, client_key[:200], request.POST)
+            record, claimed = _claim(key, scope)
+            if not claimed:
+                if record.status_code is not None:
+                    logger.info(f'Idempotent replay for portal {scope} ({record.status_code})')
+                    return _replay(record)
+                return _in_progress(request)
+
+            try:
+                response = view(request, *args, **kwargs)
+            except Exception:
+                IdempotencyRecord.objects.filter(pk=record.pk).delete()
+                raise
+
+            if 200 <= response.status_code < 300 and not response.streaming:
+                IdempotencyRecord.objects.filter(pk=record.pk).update(
+                    status_code=response.status_code,
+                    content_type=response.get('Content-Type', ''),
+                    body=response.content,
+                )
+            else:
+                IdempotencyRecord.objects.filter(pk=record.pk).delete()
+            return response
+        return wrapped
+    return decorator
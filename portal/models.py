@@ -1,3 +1,25 @@
 from django.db import models
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
 
-# Create your models here.
+
+class IdempotencyRecord(models.Model):
+    """
+    أول رد على طلب من البورتال بمفتاح idempotency (portal.idempotency) - الإعادة من نفس الصفحة بنفس
+    البيانات بترجع نفس الرد من غير ما الطلب يتنفذ تاني. status_code فاضي = الطلب الأول لسه شغال.
+    """
+
+    # sha256 للنطاق (issue/register) + المفتاح اللي الصفحة ولّدته + بيانات الطلب
+    key = models.CharField(max_length=64, unique=True, verbose_name=_('Key'))
+    scope = models.CharField(max_length=20, verbose_name=_('Scope'))
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name=_('Status Code'))
+    content_type = models.CharField(max_length=100, blank=True, verbose_name=_('Content Type'))
+    body = models.BinaryField(default=b'', verbose_name=_('Body'))
+    created_at = models.DateTimeField(default=timezone.now, db_index=True, verbose_name=_('Created At'))
+
+    class Meta:
+        verbose_name = _('Idempotency Record')
+        verbose_name_plural = _('Idempotency Records')
+
+    def __str__(self):
+        return f'{self.scope} {self.key[:12]} {self.status_code or "pending"}'
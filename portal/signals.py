@@ -0,0 +1,41 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from accounts.models import User
+from institutes.models import Institute
+from programs.models import Course, Diploma
+from .catalog import bump_version
+
+# حقول المستخدم اللي بتأثر على حل كود الإحالة (حفظ last_login مع كل دخول ملوش دعوة)
+REFERRAL_FIELDS = {'referral_code', 'role', 'is_active', 'institute'}
+
+
+# ==================== Portal Catalog Cache ====================
+
+@receiver([post_save, post_delete], sender=Institute)
+def invalidate_portal_institutes(sender, **kwargs):
+    bump_version('institutes')
+
+
+@receiver([post_save, post_delete], sender=Diploma)
+@receiver([post_save, post_delete], sender=Course)
+def invalidate_portal_programs(sender, **kwargs):
+    bump_version('programs')
+
+
+@receiver(m2m_changed, sender=Diploma.institutes.through)
+@receiver(m2m_changed, sender=Course.institutes.through)
+def invalidate_portal_program_institutes(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_version('programs')
+
+
+@receiver(post_save, sender=User)
+def invalidate_portal_referrals(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or REFERRAL_FIELDS & set(update_fields):
+        bump_version('referrals')
+
+
+@receiver(post_delete, sender=User)
+def invalidate_portal_referrals_on_delete(sender, instance, **kwargs):
+    bump_version('referrals')
@@ -1,3 +1,189 @@
-from django.test import TestCase
+"""
+Tests for Portal App
+اختبارات تطبيق البورتال
+"""
+import shutil
+import tempfile
+from datetime import date
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from clients.models import Client
+from institutes.models import Institute
+from permissions import eligibility
+from permissions.models import PermissionSlip
+from programs.models import Diploma
+from . import catalog, idempotency
+from .models import IdempotencyRecord
+
+User = get_user_model()
+
+STAMP_DIR = tempfile.mkdtemp()
+
+
+class IdempotencyTests(TestCase):
+    """اختبارات مفاتيح idempotency للإصدار والتسجيل من البورتال"""
+
+    def setUp(self):
+        self.institute = Institute.objects.create(
+            name='Test Institute',
+            code='TEST001',
+            license_number='LIC001',
+            address='Test',
+            city='Test',
+            region='Test',
+            phone='1234567890'
+        )
+        self.diploma = Diploma.objects.create(
+            name='Software Engineering',
+            code='SE2024',
+            start_date=date(2026, 1, 1),
+            end_date=date(2027, 1, 1),
+        )
+        self.diploma.institutes.add(self.institute)
+
+    def _register(self, key, **fields):
+        data = {
+            'national_id': '1234567890', 'institute_id': self.institute.pk, 'first_name': 'Test',
+            'last_name': 'Client', 'gender': 'male', 'birth_date': '2000-01-01', 'phone': '0123456789',
+            **fields,
+        }
+        return self.client.post(reverse('portal:api_register_client'), data, HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_register_retry_replays_first_response(self):
+        """اختبار إن إعادة التسجيل بنفس المفتاح بترجع نفس الرد بدل 409 (الحساب موجود)"""
+        first = self._register('key-1')
+        retry = self._register('key-1')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Client.objects.count(), 1)
+
+        # مفتاح تاني = طلب جديد
+        self.assertEqual(self._register('key-2').status_code, 409)
+
+    def test_retry_while_first_running_returns_immediately(self):
+        """اختبار إن الإعادة والطلب الأول لسه شغال بترجع 409 JSON فيه retry على طول من غير تنفيذ"""
+        pending = IdempotencyRecord(pk=1, key='x', scope='register')
+        with mock.patch.object(idempotency, '_claim', return_value=(pending, False)):
+            response = self._register('key-1')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Retry-After'], '2')
+        self.assertEqual(response.json()['retry'], True)
+        self.assertFalse(response.json()['success'])
+        self.assertFalse(Client.objects.exists())
+
+    def test_failed_response_not_stored(self):
+        """اختبار إن الرد غير الناجح مبيتخزنش والتصحيح بنفس المفتاح بيتنفذ"""
+        self.assertEqual(self._register('key-1', phone='').status_code, 400)
+        self.assertFalse(IdempotencyRecord.objects.exists())
+        self.assertEqual(self._register('key-1').status_code, 200)
+
+    def test_issue_retry_does_not_redo_work(self):
+        """اختبار إن إعادة الإصدار بنفس المفتاح مبتعيدش الفحص ولا الرسم"""
+        client = Client.objects.create(
+            first_name='Test', last_name='Client', national_id='1234567890', gender='male',
+            birth_date='1990-01-01', phone='0123456789', institute=self.institute,
+        )
+        data = {
+            'client_id': client.pk, 'diploma_id': self.diploma.pk, 'institute_id': self.institute.pk,
+            'idempotency_key': 'key-1',
+        }
+
+        with mock.patch('portal.views.schedule_permission_pdf') as schedule, \
+                mock.patch('portal.views.issue_permission', wraps=eligibility.issue_permission) as issue:
+            first = self.client.post(reverse('portal:issue'), data)
+            retry = self.client.post(reverse('portal:issue'), data)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(issue.call_count, 1)
+        self.assertEqual(schedule.call_count, 1)
+        self.assertEqual(PermissionSlip.objects.count(), 1)
+
+
+@override_settings(PORTAL_CATALOG_STAMP_DIR=STAMP_DIR)
+class CatalogCacheTests(TestCase):
+    """اختبارات كاش الفروع والبرامج وأكواد الإحالة في البورتال"""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(STAMP_DIR, ignore_errors=True)
+
+    def setUp(self):
+        catalog.clear_catalog()
+        catalog.reset_catalog_stats()
+        self.institute = Institute.objects.create(
+            name='Test Institute',
+            code='TEST001',
+            license_number='LIC001',
+            address='Test',
+            city='Test',
+            region='Test',
+            phone='1234567890'
+        )
+        self.diploma = Diploma.objects.create(
+            name='Software Engineering',
+            code='SE2024',
+            start_date=date(2026, 1, 1),
+            end_date=date(2027, 1, 1),
+        )
+        self.employee = User.objects.create_user(
+            username='employee',
+            password='testpass123',
+            role=User.Role.EMPLOYEE,
+            institute=self.institute
+        )
+
+    def _programs(self):
+        response = self.client.get(reverse('portal:api_diplomas'), {'institute_id': self.institute.pk})
+        return [row['id'] for row in response.json()['results']]
+
+    def test_programs_served_from_cache_until_m2m_change(self):
+        """اختبار إن برامج الفرع بتتقري مرة واحدة، وربط دبلومة بالفرع بيلغي الكاش"""
+        self.assertEqual(self._programs(), [])
+        with self.assertNumQueries(0):
+            self.assertEqual(self._programs(), [])
+
+        self.diploma.institutes.add(self.institute)
+        self.assertEqual(self._programs(), [self.diploma.pk])
+
+        self.diploma.status = 'inactive'
+        self.diploma.save()
+        self.assertEqual(self._programs(), [])
+        self.assertEqual(catalog.catalog_stats()['programs']['hits'], 1)
+
+    def test_landing_and_referral_from_cache(self):
+        """اختبار إن صفحة البورتال بكود إحالة متكررة من غير استعلامات، وتغيير دور الموظف بيلغي الكود"""
+        url = reverse('portal:landing_ref', args=[self.employee.referral_code.lower()])
+        response = self.client.get(url)
+        self.assertEqual(response.context['preselected_institute_id'], self.institute.pk)
+
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        self.employee.role = User.Role.BRANCH_MANAGER
+        self.employee.save()
+        self.assertEqual(self.client.get(url).context['ref_code'], '')
+
+        # تسجيل الدخول (last_login بس) ميلغيش الكاش
+        self.client.force_login(self.employee)
+        stats = catalog.catalog_stats()['referrals']
+        catalog.resolve_referral(self.employee.referral_code)
+        self.assertEqual(catalog.catalog_stats()['referrals']['hits'], stats['hits'] + 1)
+
+    def test_stamp_from_other_worker_invalidates(self):
+        """اختبار إن ختم النسخة اللي كتبه worker تاني بيلغي نسخة الـ process ده (من غير ما يتمسح محلياً)"""
+        self.assertEqual([row['name'] for row in catalog.active_institutes()], ['Test Institute'])
+        Institute.objects.filter(pk=self.institute.pk).update(name='Renamed')
+        self.assertEqual([row['name'] for row in catalog.active_institutes()], ['Test Institute'])
+
+        catalog._write_stamp('institutes')
+        self.assertEqual([row['name'] for row in catalog.active_institutes()], ['Renamed'])
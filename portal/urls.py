@@ -10,5 +10,7 @@ urlpatterns = [
     path('api/register-client/', views.api_register_client, name='api_register_client'),
     path('download-existing/', views.download_existing, name='download_existing'),
     path('issue/', views.IssueView.as_view(), name='issue'),
+    path('slip/<str:token>/pdf/', views.slip_pdf, name='slip_pdf'),
+    path('slip/<str:token>/status/', views.slip_pdf_status, name='slip_pdf_status'),
     path('<str:ref_code>/', views.LandingView.as_view(), name='landing_ref'),
 ]
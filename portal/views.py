@@ -1,8 +1,12 @@
 import logging
 
+from django.conf import settings
+from django.core import signing
 from django.db import IntegrityError
-from django.http import JsonResponse, HttpResponse, HttpResponseNotAllowed
+from django.http import Http404, JsonResponse, HttpResponse, HttpResponseNotAllowed
 from django.shortcuts import render, get_object_or_404
+from django.urls import reverse
+from django.utils.decorators import method_decorator
 from django.utils import timezone
 from django.views import View
 from django.views.decorators.http import require_POST
@@ -10,42 +14,38 @@ from django.views.decorators.http import require_POST
 from institutes.models import Institute
 from programs.models import Diploma, Course
 from clients.models import Client
-from accounts.models import User
 from permissions.models import PermissionSlip
+from permissions.pdf_cache import get_permission_pdf, is_pdf_cached, permission_pdf_key, record_stored_hit
+from permissions.prerender import schedule_permission_pdf
+from core.render_pool import RenderPoolBusy, RenderTimeout, busy_response, timeout_response
+from core.utils import x_accel_redirect_response
+from .catalog import active_institutes, institute_programs, resolve_referral
+from .idempotency import idempotent
+from permissions.eligibility import find_active_permissions, issue_permission
 from permissions.utils import (
-    find_blocking_active_permission, blocking_info,
+    blocking_info,
     find_existing_permission, existing_info,
 )
 
 logger = logging.getLogger('edu_system')
 
 
-def _resolve_referral_employee(ref_code):
-    """يبحث عن موظف نشط يملك referral_code مطابق، بدون كشف هويته للزائر"""
-    if not ref_code:
-        return None
-    return User.objects.filter(
-        referral_code__iexact=ref_code,
-        role=User.Role.EMPLOYEE,
-        is_active=True
-    ).first()
-
-
 class LandingView(View):
     """صفحة إصدار المشهد العامة - بدون تسجيل دخول"""
 
     def get(self, request, ref_code=None):
         ref_code = ref_code or request.GET.get('ref', '')
         # نتحقق من صلاحية الكود بصمت فقط، لا نعرض اسم الموظف للزائر أبداً
-        employee = _resolve_referral_employee(ref_code)
-        valid_ref_code = ref_code if employee else ''
+        referral = resolve_referral(ref_code)
+        valid_ref_code = ref_code if referral else ''
 
-        # لو الموظف مرتبط بفرع معين، نحدده تلقائياً بدل ما الزائر يختار
-        preselected_institute_id = ''
-        if employee and employee.institute_id and employee.institute.status == Institute.Status.ACTIVE:
-            preselected_institute_id = employee.institute_id
+        # الفروع والكود من الكاش (portal.catalog) - الصفحة مبتعملش أي استعلام في الحالة العادية
+        institutes = active_institutes()
 
-        institutes = Institute.objects.filter(status=Institute.Status.ACTIVE).order_by('name')
+        # لو الموظف مرتبط بفرع معين (ونشط)، نحدده تلقائياً بدل ما الزائر يختار
+        preselected_institute_id = ''
+        if referral and any(institute['id'] == referral['institute_id'] for institute in institutes):
+            preselected_institute_id = referral['institute_id']
 
         return render(request, 'portal/landing.html', {
             'preselected_institute_id': preselected_institute_id,
@@ -55,32 +55,12 @@ class LandingView(View):
 
 
 def api_diplomas(request):
-    """AJAX: قائمة الدبلومات والدورات النشطة المرتبطة فعلياً بالفرع المختار"""
+    """AJAX: قائمة الدبلومات والدورات النشطة المرتبطة فعلياً بالفرع المختار (من portal.catalog)"""
     institute_id = request.GET.get('institute_id')
     if not institute_id:
         return JsonResponse({'results': []})
 
-    fields = ['id', 'name', 'duration_months', 'hours', 'duration', 'study_mode']
-
-    diplomas = Diploma.objects.filter(
-        institutes__id=institute_id, status='active', is_deleted=False
-    ).order_by('name').values(*fields)
-
-    courses = Course.objects.filter(
-        institutes__id=institute_id, status='active', is_deleted=False
-    ).order_by('name').values(*fields)
-
-    results = []
-    for row in diplomas:
-        row = dict(row)
-        row['type'] = 'diploma'
-        results.append(row)
-    for row in courses:
-        row = dict(row)
-        row['type'] = 'course'
-        results.append(row)
-
-    return JsonResponse({'results': results})
+    return JsonResponse({'results': institute_programs(institute_id)})
 
 
 def api_search_client(request):
@@ -102,7 +82,7 @@ def api_search_client(request):
         return JsonResponse({'found': False})
 
     # 1) عنده إذن نشط في معهد تاني؟ - يمنع الإصدار لحد ما يتم التواصل والإلغاء
-    blocking_permission = find_blocking_active_permission(client, institute_id)
+    blocking_permission, existing_permission = find_active_permissions(client, institute_id)
     if blocking_permission:
         return JsonResponse({
             'found': True,
@@ -111,7 +91,6 @@ def api_search_client(request):
         })
 
     # 2) عنده مشهد سابق بالفعل في نفس الفرع ده؟ - نوجهه لتحميله بدل ما يصدر واحد جديد
-    existing_permission = find_existing_permission(client, institute_id)
     if existing_permission:
         return JsonResponse({
             'found': True,
@@ -157,18 +136,70 @@ def download_existing(request):
     if not permission:
         return HttpResponse('لا يوجد مشهد سابق', status=404)
 
-    from permissions.views import generate_permission_pdf
-    pdf_buffer = generate_permission_pdf(permission)
+    return _permission_pdf_response(permission)
+
 
-    response = HttpResponse(pdf_buffer.getvalue(), content_type='application/pdf')
+def _permission_pdf_response(permission):
+    """PDF الإذن: من nginx لو متخزن (X-Accel-Redirect)، وإلا بيترسم أو يتقري في الطلب نفسه"""
+    key = permission_pdf_key(permission)
+    if settings.MEDIA_X_ACCEL_REDIRECT and is_pdf_cached(permission, key):
+        record_stored_hit(permission)
+        return x_accel_redirect_response(
+            permission.pdf_file, 'application/pdf', filename=f'{permission.permission_number}.pdf'
+        )
+
+    try:
+        pdf_bytes = get_permission_pdf(permission, key=key)
+    except RenderPoolBusy as e:
+        return busy_response(e)
+    except RenderTimeout as e:
+        return timeout_response(e)
+
+    response = HttpResponse(pdf_bytes, content_type='application/pdf')
     response['Content-Disposition'] = f'inline; filename="{permission.permission_number}.pdf"'
     return response
 
 
+# ==================== رابط PDF المشهد بعد الإصدار ====================
+
+SLIP_TOKEN_SALT = 'portal.slip'
+
+
+def slip_token(permission):
+    """
+    رابط موقّع لمشهد الزائر - مش مسجل دخول فمينفعش نعتمد على pk مكشوف. ممكن يكون مشهد سابق في نفس
+    الفرع (حتى لو موظف هو اللي أصدره)، بنفس مستوى الحماية بتاع download_existing
+    """
+    return signing.dumps(permission.pk, salt=SLIP_TOKEN_SALT)
+
+
+def _permission_from_token(token):
+    try:
+        pk = signing.loads(token, salt=SLIP_TOKEN_SALT, max_age=settings.PORTAL_SLIP_LINK_MAX_AGE)
+    except signing.BadSignature:
+        raise Http404('رابط غير صالح أو منتهي')
+    return get_object_or_404(
+        PermissionSlip.objects.select_related('client', 'institute', 'institute__registration_officer', 'issued_by', 'diploma', 'course'),
+        pk=pk,
+    )
+
+
+def slip_pdf(request, token):
+    """PDF المشهد من صفحة التأكيد - لو الرسم في الخلفية لسه شغال الطلب بيستنى نفس الرسمة"""
+    return _permission_pdf_response(_permission_from_token(token))
+
+
+def slip_pdf_status(request, token):
+    """AJAX: صفحة التأكيد بتسأل هل ملف الـ PDF اترسم وبقى جاهز"""
+    permission = _permission_from_token(token)
+    return JsonResponse({'ready': is_pdf_cached(permission)})
+
+
 REQUIRED_REGISTER_FIELDS = ['first_name', 'last_name', 'gender', 'birth_date', 'phone']
 
 
 @require_POST
+@idempotent('register')
 def api_register_client(request):
     """AJAX: تسجيل طالب جديد بصمت لو مش موجود، ثم إرجاعه زي نتيجة البحث"""
     national_id = (request.POST.get('national_id') or '').strip()
@@ -197,7 +228,7 @@ def api_register_client(request):
             'error': 'يوجد بالفعل حساب بهذا الرقم، برجاء التواصل مع المعهد.'
         }, status=409)
 
-    employee = _resolve_referral_employee(ref_code)
+    referral = resolve_referral(ref_code)
 
     try:
         client = Client.objects.create(
@@ -211,7 +242,7 @@ def api_register_client(request):
             email=(request.POST.get('email') or '').strip(),
             city=(request.POST.get('city') or '').strip(),
             sector=(request.POST.get('sector') or '').strip(),
-            registered_by=employee,
+            registered_by_id=referral['employee_id'] if referral else None,
         )
     except IntegrityError:
         return JsonResponse({
@@ -232,12 +263,32 @@ def api_register_client(request):
     })
 
 
+def _blocked_response(blocking_permission):
+    """صفحة منع الإصدار لو عند الطالب إذن نشط في معهد تاني"""
+    info = blocking_info(blocking_permission)
+    html = f"""
+    <html dir="rtl" lang="ar"><head><meta charset="UTF-8"><title>لا يمكن الإصدار</title>
+    <style>body{{font-family:Arial,sans-serif;background:#fef2f2;padding:40px;text-align:center;color:#7f1d1d}}
+    .box{{background:#fff;border:1px solid #fecaca;border-radius:12px;padding:24px;max-width:480px;margin:0 auto}}
+    </style></head><body><div class="box">
+    <h3>لا يمكن إصدار المشهد</h3>
+    <p>يوجد للطالب إذن نشط بالفعل من معهد "{info['institute_name']}".</p>
+    <p>يجب التواصل مع <strong>{info['contact_name']}</strong> على الرقم <strong>{info['contact_phone'] or 'غير متوفر'}</strong> لإلغاء الإذن القديم أولاً، ثم إعادة المحاولة.</p>
+    </div></body></html>
+    """
+    return HttpResponse(html, status=409)
+
+
 class IssueView(View):
-    """إصدار المشهد فعلياً وإرجاع الـ PDF مباشرة - بنفس منطق الإصدار الداخلي"""
+    """
+    إصدار المشهد فعلياً بنفس منطق الإصدار الداخلي - بيرجع فوراً صفحة HTML خفيفة فيها بيانات المشهد
+    (قابلة للطباعة)، والـ PDF بيترسم في الخلفية والصفحة فيها رابط ليه
+    """
 
     def get(self, request):
         return HttpResponseNotAllowed(['POST'])
 
+    @method_decorator(idempotent('issue'))
     def post(self, request):
         client_id = request.POST.get('client_id')
         diploma_id = request.POST.get('diploma_id')
@@ -253,22 +304,6 @@ class IssueView(View):
         if not institute:
             institute = client.institute
 
-        # حماية إضافية (server-side): منع الإصدار لو عند الطالب إذن نشط في معهد تاني بالفعل
-        blocking_permission = find_blocking_active_permission(client, institute.id)
-        if blocking_permission:
-            info = blocking_info(blocking_permission)
-            html = f"""
-            <html dir="rtl" lang="ar"><head><meta charset="UTF-8"><title>لا يمكن الإصدار</title>
-            <style>body{{font-family:Arial,sans-serif;background:#fef2f2;padding:40px;text-align:center;color:#7f1d1d}}
-            .box{{background:#fff;border:1px solid #fecaca;border-radius:12px;padding:24px;max-width:480px;margin:0 auto}}
-            </style></head><body><div class="box">
-            <h3>لا يمكن إصدار المشهد</h3>
-            <p>يوجد للطالب إذن نشط بالفعل من معهد "{info['institute_name']}".</p>
-            <p>يجب التواصل مع <strong>{info['contact_name']}</strong> على الرقم <strong>{info['contact_phone'] or 'غير متوفر'}</strong> لإلغاء الإذن القديم أولاً، ثم إعادة المحاولة.</p>
-            </div></body></html>
-            """
-            return HttpResponse(html, status=409)
-
         # حماية: التأكد إن البرنامج (دبلومة أو دورة) فعلاً مرتبط بالفرع ده
         program_model = Course if program_type == 'course' else Diploma
         program = get_object_or_404(
@@ -281,7 +316,7 @@ class IssueView(View):
         elif study_mode not in ('offline', 'online'):
             study_mode = ''
 
-        employee = _resolve_referral_employee(ref_code)
+        referral = resolve_referral(ref_code)
 
         permission = PermissionSlip(
             client=client,
@@ -292,19 +327,31 @@ class IssueView(View):
             expiry_date=program.end_date or (timezone.now().date() + timezone.timedelta(days=365)),
             issued_by=None,
             issued_from_public=True,
-            referral_employee=employee,
-            referral_code=ref_code if employee else '',
+            referral_employee_id=referral['employee_id'] if referral else None,
+            referral_code=ref_code if referral else '',
         )
-        permission.save()
 
-        logger.info(
-            f'Public permission {permission.permission_number} issued for client {client.national_id} '
-            f'(ref={ref_code or "-"})'
-        )
-
-        from permissions.views import generate_permission_pdf
-        pdf_buffer = generate_permission_pdf(permission)
+        # حماية إضافية (server-side): الفحص والحفظ تحت قفل على العميل، فإصدار متزامن لنفس الطالب
+        # (من البورتال أو من موظف) مبيطلعش إذنين نشطين
+        blocking_permission, existing_permission = issue_permission(permission)
+        if blocking_permission:
+            return _blocked_response(blocking_permission)
+
+        if existing_permission:
+            # عنده مشهد نشط في نفس الفرع (طلب مكرر أو اتنين في نفس اللحظة) - نعرضه بدل مشهد جديد
+            permission = existing_permission
+        else:
+            logger.info(
+                f'Public permission {permission.permission_number} issued for client {client.national_id} '
+                f'(ref={ref_code or "-"})'
+            )
+            schedule_permission_pdf(permission)
+
+        token = slip_token(permission)
+        return render(request, 'portal/slip.html', {
+            'permission': permission,
+            'pdf_url': reverse('portal:slip_pdf', args=[token]),
+            'status_url': reverse('portal:slip_pdf_status', args=[token]),
+            'prerender': settings.PDF_PRERENDER_ON_ISSUE,
+        })
 
-        response = HttpResponse(pdf_buffer.getvalue(), content_type='application/pdf')
-        response['Content-Disposition'] = f'inline; filename="{permission.permission_number}.pdf"'
-        return response
@@ -14,7 +14,7 @@ from core.mixins import (
     InstituteScopedMixin, InstituteScopedRegistrationMixin, InstituteScopedDetailMixin,
     SearchMixin, FilterMixin, SoftDeleteMixin
 )
-from core.utils import get_pdf_response
+from core.reports import ReportColumn, TabularReport
 from institutes.models import Institute
 from .models import Diploma, Course, ProgramCategory, ProgramRegistration
 
@@ -505,42 +505,40 @@ def export_diplomas_excel(request):
         return redirect('programs:diploma_list')
 
 
+def _institute_names(program):
+    """أسماء المعاهد من الـ prefetch (get_institutes_display بيعمل query لكل صف)"""
+    return '، '.join(institute.name for institute in program.institutes.all())
+
+
 def export_diplomas_pdf(request):
     """تصدير الدبلومات لـ PDF"""
-    from weasyprint import HTML
-    from django.template.loader import render_to_string
-    from django.conf import settings
-    
-    diplomas = Diploma.objects.all()
-    logo_url = request.build_absolute_uri(settings.STATIC_URL + 'images/logo.png')
-    
-    context = {
-        'diplomas': diplomas,
-        'logo_url': logo_url,
-        'user': request.user,
-    }
-    
-    html_string = render_to_string('programs/diplomas_pdf_template.html', context)
-    
-    try:
-        html = HTML(string=html_string, base_url=request.build_absolute_uri('/'))
-        pdf = html.write_pdf()
-        
-        response = HttpResponse(pdf, content_type='application/pdf')
-        response['Content-Disposition'] = 'inline; filename="diplomas_report.pdf"'
-        logger.info(f'Diplomas PDF exported by {request.user.username}')
-        return response
-    except Exception as e:
-        logger.error(f'Error generating PDF: {str(e)}')
-        return HttpResponse(f"خطأ في إنشاء PDF: {str(e)}", status=500)
+    report = TabularReport(
+        'تقرير الدبلومات المعتمدة',
+        [
+            ReportColumn('الكود', 'code'),
+            ReportColumn('اسم الدبلومة', 'name', width=3, align='RIGHT'),
+            ReportColumn('المعهد', _institute_names, width=3, align='RIGHT'),
+            ReportColumn('الرسوم', lambda diploma: f'{diploma.fees} ج.م'),
+            ReportColumn('الحالة', 'get_status_display'),
+        ],
+        Diploma.objects.prefetch_related('institutes'),
+        user=request.user, color='#2c3e50',
+    )
+    return report.response('diplomas_report')
 
 
 def export_courses_pdf(request):
     """تصدير الدورات لـ PDF"""
-    courses = Course.objects.all()
-    return get_pdf_response(
-        request,
-        'programs/courses_pdf_template.html',
-        {'courses': courses, 'title': 'تقرير الدورات التدريبية'},
-        'courses_report'
+    report = TabularReport(
+        'تقرير الدورات التدريبية',
+        [
+            ReportColumn('الكود', 'code'),
+            ReportColumn('اسم الدورة', 'name', width=3, align='RIGHT'),
+            ReportColumn('المعهد', _institute_names, width=3, align='RIGHT'),
+            ReportColumn('المدة', lambda course: f'{course.duration_months} شهر'),
+            ReportColumn('الرسوم', lambda course: f'{course.fees} ج.م'),
+        ],
+        Course.objects.prefetch_related('institutes'),
+        user=request.user, color='#2980b9',
     )
+    return report.response('courses_report')
@@ -150,6 +150,9 @@ function loadPreset(presetKey) {
     if (window.bodyCM) window.bodyCM.setValue(preset.body);
     if (window.footerCM) window.footerCM.setValue(preset.footer);
     if (window.cssCM) window.cssCM.setValue(preset.css);
+
+    // تحديث المعاينة المباشرة لو موجودة
+    if (window.schedulePreview) window.schedulePreview(0);
 }
 
 document.addEventListener('DOMContentLoaded', function() {